@@ -0,0 +1,102 @@
+'''
+double buffered waveforms of the ao task
+while iteration n is acquiring, a background thread generates the waveform of
+iteration n+1 into the second of two preallocated buffers, so that at the
+iteration boundary only the write to the (stopped) task is left
+a buffer is refilled only after the engine took the other one, i.e. after the
+waveform in it was written to the task, the driver keeps its own copy
+'''
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import numpy as np
+
+
+class WaveformStager:
+    '''
+    source(iteration) returns the waveform of an iteration, at most width
+    points, it is zero padded to width
+    prefetch = False generates every waveform when it is taken, in the
+    calling thread
+    stalls counts the takes which had to wait for the background thread,
+    stall_time is the total time waited
+    scaling: a DacScaling (see dac.py), the buffers then hold the int16 dac
+    codes of the waveforms, padded with the code of 0 V, a waveform outside
+    the output range raises ValueError
+    '''
+    def __init__(self, source, width, iterations, prefetch = True, dtype = np.float64,
+                 scaling = None):
+        self.source = source
+        self.width = width
+        self.iterations = list(iterations)
+        self.prefetch = prefetch
+        self.scaling = scaling
+        if scaling is not None:
+            dtype = np.int16
+            self.pad = scaling.zero_code
+        else:
+            self.pad = 0
+        self.buffers = [np.zeros(width, dtype = dtype), np.zeros(width, dtype = dtype)]
+        self.executor = ThreadPoolExecutor(1, 'waveform_stager') if prefetch else None
+        self.pending = None # (index, slot, future)
+        self.stalls = 0
+        self.stall_time = 0.0
+
+    def fill(self, slot, index):
+        waveform = self.source(self.iterations[index])
+        if len(waveform) > self.width:
+            raise ValueError(f'the waveform of iteration {self.iterations[index]} has '
+                             f'{len(waveform)} points, the ao buffer only {self.width}')
+        buffer = self.buffers[slot]
+        if self.scaling is None:
+            buffer[:len(waveform)] = waveform
+        else:
+            _, clipped = self.scaling.codes(waveform, buffer[:len(waveform)])
+            if clipped:
+                raise ValueError(f'{clipped} points of the waveform of iteration {self.iterations[index]} are '
+                                 f'outside the ao range {self.scaling.low} to {self.scaling.high} V')
+        buffer[len(waveform):] = self.pad
+        return buffer
+
+    def stage(self, index, slot):
+        '''
+        start generating the waveform of iterations[index] into buffers[slot]
+        '''
+        if self.executor is None or index >= len(self.iterations):
+            self.pending = None
+            return
+        self.pending = (index, slot, self.executor.submit(self.fill, slot, index))
+
+    def start(self):
+        self.stage(0, 0)
+
+    def take(self, index):
+        '''
+        the zero padded waveform of iterations[index], the next one is staged
+        in the other buffer right away
+        '''
+        if self.pending is not None and self.pending[0] == index:
+            _, slot, future = self.pending
+            if not future.done():
+                start = time.perf_counter()
+                future.result()
+                self.stalls += 1
+                self.stall_time += time.perf_counter() - start
+            buffer = future.result()
+        else:
+            if self.pending is not None:
+                '''
+                an out of order take, let the staged waveform finish first so
+                that its buffer is not written twice at the same time
+                '''
+                self.pending[2].result()
+            slot = 0
+            buffer = self.fill(slot, index)
+        self.stage(index + 1, 1 - slot)
+        return buffer
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
+            self.pending = None
@@ -0,0 +1,61 @@
+'''
+in place averaging of the acquired shots
+nothing is allocated per shot: the shot is read into a reused buffer, added to
+a running float64 sum and only divided when an average is asked for
+'''
+import numpy as np
+
+
+class ShotAccumulator:
+    '''
+    running sum of the shots of one iteration, shape is (channels, samp_num)
+    dtype is float64, or complex128 for the baseband of the lock-in, or an
+    integer type for the codes of the adc, shot_dtype (default dtype) is the
+    type the shots are read as, e.g. int16 codes summed as int64
+    variance = True also keeps a Welford mean/M2 pair for the per point noise
+    (of the real part only for complex data)
+    '''
+    def __init__(self, channels, samp_num, variance = False, dtype = np.float64, shot_dtype = None):
+        self.shot = np.zeros((channels, samp_num), dtype = dtype if shot_dtype is None else shot_dtype)
+        self.sum = np.zeros((channels, samp_num), dtype = dtype)
+        self.variance = variance
+        if variance:
+            self.mean = np.zeros((channels, samp_num))
+            self.m2 = np.zeros((channels, samp_num))
+            self._delta = np.zeros((channels, samp_num))
+            self._scratch = np.zeros((channels, samp_num))
+        self.count = 0
+
+    def reset(self):
+        self.sum.fill(0)
+        if self.variance:
+            self.mean.fill(0)
+            self.m2.fill(0)
+        self.count = 0
+
+    def add(self, shot):
+        self.count += 1
+        self.sum += shot
+        if self.variance:
+            shot = shot.real
+            np.subtract(shot, self.mean, out = self._delta)
+            np.multiply(self._delta, 1/self.count, out = self._scratch)
+            self.mean += self._scratch
+            np.subtract(shot, self.mean, out = self._scratch)
+            self._scratch *= self._delta
+            self.m2 += self._scratch
+
+    def average(self, out = None):
+        '''
+        the average of the shots so far, a new array unless out is given
+        '''
+        return np.divide(self.sum, max(self.count, 1), out = out)
+
+    def noise(self, out = None):
+        '''
+        standard deviation of a single shot at every point
+        '''
+        if not self.variance:
+            raise ValueError('the accumulator was created without variance')
+        out = np.divide(self.m2, max(self.count - 1, 1), out = out)
+        return np.sqrt(out, out = out)
@@ -0,0 +1,348 @@
+'''
+benchmark of the hot paths of a shot, runs headless:
+
+    python benchmark.py --save-baseline      record the baseline of this machine
+    python benchmark.py                      run everything, compare with it
+    python benchmark.py --output now.json    also write the results as json
+    python benchmark.py --only pulse spectrum --quick --no-compare
+
+groups
+    pulse       pulse_interpreter of every file in pulse_sequences at several
+                sampling rates and repeat_num, and the batched waveforms of
+                ITERATIONS iterations
+    averaging   per shot accumulation and snapshot of the acquisition loop,
+                with and without the lock-in
+    spectrum    SpectrumEngine of one snapshot (the former FourierWorker)
+    dataset     writing one snapshot into the memory mapped dataset
+    redraw      LivePlotter frame of all four axes on the Agg canvas
+    telemetry   the timing calls of one shot, switched on and off
+    ao          converting a shot to dac codes and writing it to the simulated
+                ao task as float64 volts and as int16 codes
+    lod         views of cpmg_sequence in the pulse visualizer from the min/max
+                pyramid, from the whole sequence down to a span of samples
+
+every case is timed in rounds of enough calls to last MIN_ROUND_TIME, the
+median time per call over the rounds is compared with the baseline, a case
+slower than the baseline by more than the threshold is a regression and the
+exit code is 1
+the baseline only makes sense on the machine it was recorded on, so none is
+shipped: without one the comparison fails with exit code 2, --no-compare only
+prints the timings; the cases of FASTER are checked on every run, a case which
+is not faster than its reference is a regression as well
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from nmr_pulses import PulseProgram, pulse_interpreter
+from averaging import ShotAccumulator
+from lockin import LockIn
+from spectrum import SpectrumEngine
+from dataset import ShotDataset
+from telemetry import Telemetry, STAGES
+
+MODULE_FOLDER = os.path.dirname(os.path.realpath(__file__))
+PULSE_FOLDER = os.path.join(MODULE_FOLDER, 'pulse_sequences')
+BASELINE_FILE = os.path.join(MODULE_FOLDER, 'benchmark_baseline.json')
+
+GROUPS = ('pulse', 'averaging', 'spectrum', 'dataset', 'redraw', 'telemetry', 'ao', 'lod')
+SAMPLING_RATES = (100000, 250000, 1000000)
+# factors applied to repeat_num of the files which repeat a part
+REPEAT_SCALES = (1, 4)
+ITERATIONS = 10
+# a shot of the size of simple_sequence at the default sampling rate
+SHOT_RATE = 250000
+SHOT_NUM = 151150
+THRESHOLD = 0.2
+# (case, reference): the case has to be faster than the reference
+FASTER = (('spectrum/zoom/rect', 'spectrum/full/rect'),)
+MIN_ROUND_TIME = 0.05
+ROUNDS = 7
+
+
+def measure(func, rounds = ROUNDS, min_round_time = MIN_ROUND_TIME):
+    '''
+    seconds per call of func: median and minimum over rounds
+    '''
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time or number >= 2**20:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_round_time/elapsed) + 1)
+    times = [elapsed/number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start)/number)
+    return {'median': float(np.median(times)), 'min': float(np.min(times)),
+            'number': number, 'rounds': rounds}
+
+
+def repeated_file(file_path, scale, folder):
+    '''
+    a copy of the pulse file with repeat_num multiplied by scale, None if the
+    file repeats nothing
+    '''
+    with open(file_path, 'r') as f:
+        lines = f.read().splitlines()
+    for index, line in enumerate(lines):
+        key, _, value = line.partition('=')
+        if key.strip() == 'repeat_pos' and value.split() == ['0', '0']:
+            return None
+        if key.strip() == 'repeat_num':
+            lines[index] = 'repeat_num = ' + ' '.join(str(int(num)*scale) for num in value.split())
+    copy = os.path.join(folder, f'x{scale}_' + os.path.basename(file_path))
+    with open(copy, 'w') as f:
+        f.write('\n'.join(lines))
+    return copy
+
+
+def pulse_cases(quick, folder):
+    rates = (SHOT_RATE,) if quick else SAMPLING_RATES
+    for file_name in sorted(os.listdir(PULSE_FOLDER)):
+        file_path = os.path.join(PULSE_FOLDER, file_name)
+        name = os.path.splitext(file_name)[0]
+        for scale in REPEAT_SCALES:
+            path = file_path if scale == 1 else repeated_file(file_path, scale, folder)
+            if path is None:
+                continue
+            for rate in rates:
+                yield (f'pulse/{name}/{rate}/x{scale}',
+                       lambda path = path, rate = rate: pulse_interpreter(path, rate, 0))
+        program = PulseProgram(file_path)
+        yield (f'pulse_batch/{name}/{SHOT_RATE}/{ITERATIONS}',
+               lambda program = program: program.waveforms(SHOT_RATE, range(ITERATIONS)))
+
+
+def shot(rng, samp_num = SHOT_NUM):
+    t = np.arange(samp_num)/SHOT_RATE
+    data = 0.01*rng.standard_normal((3, samp_num))
+    data[0:2] += np.cos(2*np.pi*31200*t)*np.exp(-t/0.1)
+    return data
+
+
+def averaging_cases(quick, rng):
+    data = shot(rng)
+    accumulator = ShotAccumulator(3, SHOT_NUM)
+    snapshot = np.empty((3, SHOT_NUM))
+    def add_and_snapshot():
+        accumulator.add(data)
+        accumulator.average(out = snapshot)
+    yield 'averaging/add', add_and_snapshot
+    variance = ShotAccumulator(3, SHOT_NUM, variance = True)
+    yield 'averaging/add_variance', lambda: variance.add(data)
+    lockin = LockIn(SHOT_RATE, 31200, 0, 2500)
+    baseband = ShotAccumulator(3, lockin.output_length(SHOT_NUM), dtype = complex)
+    baseband_snapshot = np.empty_like(baseband.sum)
+    def demodulate_and_add():
+        baseband.add(lockin.demodulate_shot(data))
+        baseband.average(out = baseband_snapshot)
+    yield 'averaging/lockin', demodulate_and_add
+
+
+def spectrum_cases(quick, rng):
+    data = shot(rng)
+    windows = ('rect',) if quick else ('rect', 'hann')
+    for window in windows:
+        engine = SpectrumEngine(SHOT_RATE, window)
+        yield f'spectrum/full/{window}', lambda engine = engine: engine.spectrum(data)
+    zoom = SpectrumEngine(SHOT_RATE, 'rect', band = (30000, 32500))
+    yield 'spectrum/zoom/rect', lambda: zoom.spectrum(data)
+    lockin = LockIn(SHOT_RATE, 31200, 0, 2500)
+    baseband = lockin.demodulate_shot(data)
+    complex_engine = SpectrumEngine(lockin.out_rate, 'rect', center = 31200)
+    yield 'spectrum/baseband/rect', lambda: complex_engine.spectrum(baseband)
+
+
+def dataset_cases(quick, rng, folder):
+    data = shot(rng)
+    dataset = ShotDataset.create(os.path.join(folder, 'benchmark'), ITERATIONS, SHOT_NUM, SHOT_RATE)
+    position = [0]
+    def write():
+        dataset.write(position[0] % ITERATIONS, data, 1)
+        position[0] += 1
+    yield 'dataset/write', write
+
+
+def redraw_cases(quick, rng):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from live_plot import LivePlotter
+    canvas = FigureCanvasAgg(Figure(figsize = (20, 6), dpi = 100))
+    axes = {key: canvas.figure.add_subplot(221 + index)
+            for index, key in enumerate(('nmr_time', 'nmr_freq', 'nsor_time', 'nsor_freq'))}
+    plotter = LivePlotter(canvas, axes)
+    plotter.timer.stop()
+    data = shot(rng)
+    t = np.arange(SHOT_NUM)/SHOT_RATE
+    freq, spectra = SpectrumEngine(SHOT_RATE).spectrum(data)
+    def frame():
+        plotter.update('nmr_time', t, data[0])
+        plotter.update('nsor_time', t, data[1])
+        plotter.update('nmr_freq', freq, np.abs(spectra[0]))
+        plotter.update('nsor_freq', freq, np.abs(spectra[1]))
+        plotter.draw_frame()
+    yield 'redraw/frame', frame
+
+
+def telemetry_cases(quick):
+    for enabled in (True, False):
+        telemetry = Telemetry(4096, enabled = enabled)
+        def record(telemetry = telemetry):
+            telemetry.begin(0, 0)
+            for stage in STAGES:
+                telemetry.mark(stage)
+        yield f'telemetry/shot/{"on" if enabled else "off"}', record
+
+
+def ao_cases(quick):
+    from simulated_daq import SimulatedBackend
+    backend = SimulatedBackend(noise = 0)
+    task = backend.task('pulse task')
+    task.ao_channels.add_ao_voltage_chan('Dev1/ao1')
+    task.timing.cfg_samp_clk_timing(SHOT_RATE, samps_per_chan = SHOT_NUM)
+    writer = backend.unscaled_writer(task)
+    scaling = backend.ao_scaling(task)
+    volts = pulse_interpreter(os.path.join(PULSE_FOLDER, 'simple_sequence.txt'), SHOT_RATE, 0)
+    codes = scaling.codes(volts)[0]
+    yield 'ao/convert', lambda: scaling.codes(volts, codes)
+    yield 'ao/write/float64', lambda: task.write(volts)
+    yield 'ao/write/int16', lambda: writer.write_int16(codes.reshape(1, -1))
+
+
+def lod_cases(quick):
+    from waveform_pyramid import MinMaxPyramid
+    program = PulseProgram(os.path.join(PULSE_FOLDER, 'cpmg_sequence.txt'))
+    yield 'lod/build', lambda: MinMaxPyramid(program, 1000000)
+    pyramid = MinMaxPyramid(program, 1000000)
+    duration = pyramid.duration()
+    for fraction in (1, 0.01, 0.0005):
+        yield (f'lod/view/{fraction:g}',
+               lambda fraction = fraction: pyramid.view(duration/2, duration/2 + duration*fraction, 1500))
+
+
+def run(groups = GROUPS, quick = False, log = None):
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp(prefix = 'benchmark_')
+    makers = {'pulse': lambda: pulse_cases(quick, folder),
+              'averaging': lambda: averaging_cases(quick, rng),
+              'spectrum': lambda: spectrum_cases(quick, rng),
+              'dataset': lambda: dataset_cases(quick, rng, folder),
+              'redraw': lambda: redraw_cases(quick, rng),
+              'telemetry': lambda: telemetry_cases(quick),
+              'ao': lambda: ao_cases(quick),
+              'lod': lambda: lod_cases(quick)}
+    rounds = 3 if quick else ROUNDS
+    results = {}
+    try:
+        for group in groups:
+            for name, func in makers[group]():
+                results[name] = measure(func, rounds)
+                if log is not None:
+                    log(f'{name:45s} {results[name]["median"]*1000:10.3f} ms')
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    return {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'processor': platform.processor()},
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'quick': quick,
+            'results': results}
+
+
+def compare(results, baseline, threshold = THRESHOLD):
+    '''
+    (name, current, baseline, ratio, status) of the cases in both, status is
+    'regression', 'improvement' or 'ok'
+    '''
+    rows = []
+    for name, current in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median']
+        ratio = current['median']/before if before else float('inf')
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1/(1 + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, current['median'], before, ratio, status))
+    return rows
+
+
+def check_faster(results):
+    '''
+    (case, reference, ratio) of the cases of FASTER which are not faster
+    than their reference
+    '''
+    slow = []
+    for name, reference in FASTER:
+        if name in results['results'] and reference in results['results']:
+            ratio = results['results'][name]['median']/results['results'][reference]['median']
+            if ratio >= 1:
+                slow.append((name, reference, ratio))
+    return slow
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'benchmark of the hot paths of a shot')
+    parser.add_argument('--only', nargs = '+', choices = GROUPS, default = list(GROUPS),
+                        help = 'groups to run')
+    parser.add_argument('--quick', action = 'store_true',
+                        help = 'one sampling rate, one window and fewer rounds')
+    parser.add_argument('--output', help = 'write the results to this json file')
+    parser.add_argument('--baseline', default = BASELINE_FILE, help = 'baseline json file')
+    parser.add_argument('--save-baseline', action = 'store_true',
+                        help = 'store the results as the new baseline')
+    parser.add_argument('--no-compare', action = 'store_true',
+                        help = 'only print the timings, no baseline needed')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD,
+                        help = 'relative slow down counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.only, args.quick, log = print)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent = 2)
+        print(f'baseline saved to {args.baseline}')
+        return 0
+    slow = check_faster(results)
+    for name, reference, ratio in slow:
+        print(f'regression: {name} takes {ratio:.2f} times as long as {reference}')
+    if args.no_compare:
+        return 1 if slow else 0
+    if not os.path.exists(args.baseline):
+        print(f'error: no baseline {args.baseline} to compare with, record one on this machine '
+              f'with --save-baseline or pass --no-compare', file = sys.stderr)
+        return 2
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold)
+    print(f'\n{"case":45s} {"now ms":>10s} {"base ms":>10s} {"ratio":>7s}')
+    for name, current, before, ratio, status in rows:
+        print(f'{name:45s} {current*1000:10.3f} {before*1000:10.3f} {ratio:7.2f} {status}')
+    regressions = [row for row in rows if row[4] == 'regression']
+    print(f'{len(regressions)} regressions above {args.threshold*100:.0f} %')
+    return 1 if regressions or slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
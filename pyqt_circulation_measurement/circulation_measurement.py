@@ -10,40 +10,25 @@ import matplotlib
 
 import sys
 import os
+import time
+import threading
 
 import numpy as np
 from numpy import pi
 
-import json
-
-import time
-
-from nidaqmx.task import Task
-from nidaqmx import constants
-
-
-from nmr_pulses import pulse_interpreter
+from engine import AcquisitionEngine, read_parameter, save_parameter, format_stats
+from live_plot import LivePlotter
+from spectrum import SpectrumEngine
+from processing import SpectrumProcessPool
+from ring import RingReader
+from reducers import REDUCERS
 
 BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
 PARAMETER_FILE = BASE_FOLDER + r'\pyqt_circulation_measurement\parameter.txt'
-'''
-################################################################################
-useful functions
-'''
 
-def read_parameter(parameter_file):
-    with open(parameter_file, 'r') as f:
-        parameter_raw = f.read()
-    parameters = json.loads(parameter_raw)
-    return parameters
-
-def save_parameter(parameter_file, **kwargs):
-    parameters = read_parameter(parameter_file)
-    with open(parameter_file,'w') as f:
-        for key,val in kwargs.items():
-            parameters[key] = val
-        json.dump(parameters, f, indent = 2)
+STATUS_INTERVAL = 500 # ms between updates of the status bar during a run
+RESULT_INTERVAL = 10 # ms between polls of the spectrum processes
 
 '''
 customized widget
@@ -74,8 +59,10 @@ Multithreading
 
 
 class WorkerSignals(QObject):
-    data_measured = pyqtSignal(np.ndarray)
+    snapshot_ready = pyqtSignal(int) # sequence number of the newest snapshot in the ring
     data = pyqtSignal(tuple)
+    dead_time = pyqtSignal(float) # mean dead time per shot of an iteration in s
+    finished = pyqtSignal()
 
 
 '''
@@ -83,48 +70,58 @@ class WorkerSignals(QObject):
 '''
 
 class ReadDataWorker(QRunnable): #Multithreading
-    def __init__(self, ao_task, ai_task, stop_btn, parameter, samp_num):
+    '''
+    runs the prepared AcquisitionEngine in the threadpool, the snapshots stay
+    in the ring of the engine, snapshot_ready only tells the gui that there
+    is a new one, and is not emitted again before the gui called acknowledge()
+    so that the Qt event queue holds at most one of them
+    '''
+    def __init__(self, engine):
         super(ReadDataWorker,self).__init__()
-        self.ao_task = ao_task
-        self.ai_task = ai_task
-        self.stop_btn = stop_btn
-        self.average = int(parameter['average'])
-        self.iteration = int(parameter['iteration'])
-        self.samp_num = samp_num
+        self.engine = engine
         self.signals = WorkerSignals()
+        self.notified = threading.Event()
 
 
     @pyqtSlot()
     def run(self):
-        for current_iter in range(self.iteration):
-            '''
-            initiate data in the current interation
-            '''
-            sig_data = np.zeros((3,self.samp_num))
-            for current_avg in range(self.average):
-
-                self.ai_task.start()
-                self.ao_task.start()
-                self.ai_task.wait_until_done()
-                self.ao_task.wait_until_done()
-                sig_data = (current_avg*sig_data + np.array(self.ai_task.read(number_of_samples_per_channel = self.samp_num)))/(current_avg+1)
-                self.signals.data_measured.emit(sig_data)
-                self.ai_task.stop()
-                self.ao_task.stop()
-
-
-class FourierWorker(QRunnable): #Multithreading
-    def __init__(self, time_data_y, f_max, key):
-        super(FourierWorker,self).__init__()
-        self.f_max = f_max
-        self.time_data_y = time_data_y
+        try:
+            self.engine.run(on_snapshot = self.notify,
+                            on_dead_time = self.signals.dead_time.emit)
+        finally:
+            self.signals.finished.emit()
+
+    def stop(self):
+        '''
+        called from the gui, the run ends after the current shot
+        '''
+        self.engine.stop()
+
+    def notify(self, sequence):
+        if not self.notified.is_set():
+            self.notified.set()
+            self.signals.snapshot_ready.emit(sequence)
+
+    def acknowledge(self):
+        '''
+        called from the gui before it reads the ring
+        '''
+        self.notified.clear()
+
+
+class SpectrumWorker(QRunnable): #Multithreading
+    '''
+    spectra of all rows of one snapshot in a single batched transform
+    '''
+    def __init__(self, data, engine):
+        super(SpectrumWorker,self).__init__()
+        self.data = data
+        self.engine = engine
         self.signals = WorkerSignals()
-        self.key = key
     @pyqtSlot()
     def run(self):
-        self.freq_data_y = np.fft.rfft(self.time_data_y)/len(self.time_data_y)*2
-        self.freq_data_x = np.linspace(0, self.f_max, int(len(self.time_data_y)/2)+1)
-        self.signals.data.emit((self.freq_data_x,self.freq_data_y, self.key))
+        freq_data_x, freq_data_y = self.engine.spectrum(self.data)
+        self.signals.data.emit((freq_data_x, freq_data_y))
 
 
 
@@ -173,9 +170,9 @@ class MainWindow(QMainWindow):
         '''
 
 
-        if app.desktop().screenGeometry().height() == 2160:
+        if QApplication.desktop().screenGeometry().height() == 2160:
             matplotlib.rcParams.update({'font.size': 28})
-        elif app.desktop().screenGeometry().height() == 1080:
+        elif QApplication.desktop().screenGeometry().height() == 1080:
             matplotlib.rcParams.update({'font.size': 14})
         canvas = FigureCanvas(Figure(figsize=(50, 15)))
 
@@ -187,11 +184,35 @@ class MainWindow(QMainWindow):
         self.ax['nsor_freq'] = canvas.figure.add_subplot(224)
 
         for axis in self.ax.values():
-            if app.desktop().screenGeometry().height() == 2160:
+            if QApplication.desktop().screenGeometry().height() == 2160:
                 axis.tick_params(pad=20)
-            elif app.desktop().screenGeometry().height() == 1080:
+            elif QApplication.desktop().screenGeometry().height() == 1080:
                 axis.tick_params(pad=10)
 
+        '''
+        the plotter owns the lines and the cursors of the axes, see live_plot.py
+        '''
+        self.plotter = LivePlotter(canvas, self.ax)
+
+        '''
+        the curves of the reducers, one row of axes per reducer, see reducers.py
+        curve_ax['nmr_peak_curve'], curve_ax['nsor_peak_curve'], ...
+        '''
+        curve_canvas = FigureCanvas(Figure(figsize=(50, 15)))
+        self.curve_ax = {}
+        for row, name in enumerate(REDUCERS):
+            for column, channel in enumerate(['nmr', 'nsor']):
+                axis = curve_canvas.figure.add_subplot(len(REDUCERS), 2, 2*row + column + 1)
+                axis.set_title(f'{channel} {name}')
+                self.curve_ax[f'{channel}_{name}_curve'] = axis
+        self.curve_plotter = LivePlotter(curve_canvas, self.curve_ax)
+        self.curve_count = 0
+        self.spectrum_engine = None
+        self.processor = None
+        for key, value in self.parameters.items():
+            if 'limit' in key or 'cursor' in key:
+                self.apply_limit_and_cursor(key, value)
+
         '''
         --------------------------setting widgets-------------------------------
         '''
@@ -236,6 +257,7 @@ class MainWindow(QMainWindow):
         startExpBtn.clicked.connect(self.start_experiment)
         self.stopBtn = QPushButton('STOP',self)
         self.stopBtn.setCheckable(True)
+        self.stopBtn.clicked.connect(self.stop_experiment)
         updateParamBtn = QPushButton('Update Parameter', self)
         updateParamBtn.clicked.connect(self.update_parameter)
 
@@ -247,8 +269,8 @@ class MainWindow(QMainWindow):
         tabs.setTabPosition(QTabWidget.North)
         tabs.setMovable(True)
 
-        tab = {'parameter': QWidget(), 'data': QWidget()}
-        tab_layout = {'parameter' : QVBoxLayout(), 'data': QHBoxLayout()}
+        tab = {'parameter': QWidget(), 'data': QWidget(), 'curve': QWidget()}
+        tab_layout = {'parameter' : QVBoxLayout(), 'data': QHBoxLayout(), 'curve': QVBoxLayout()}
         parameter_tab_layout = QFormLayout()
         sub_tab_layout = {'time': QVBoxLayout(), 'freq':QVBoxLayout()}
         '''
@@ -317,6 +339,7 @@ class MainWindow(QMainWindow):
         tab_layout['data'].addLayout(sub_tab_layout['time'])
         tab_layout['data'].addWidget(canvas)
         tab_layout['data'].addLayout(sub_tab_layout['freq'])
+        tab_layout['curve'].addWidget(curve_canvas)
         for key in tab.keys():
             tabs.addTab(tab[key], key)
             tab[key].setLayout(tab_layout[key])
@@ -332,13 +355,32 @@ class MainWindow(QMainWindow):
         --------------------------Multithreading preparation--------------------
         '''
         self.threadpool = QThreadPool() #Multithreading
-
+        self.worker = None
+        self.spectrum_busy = False
+        self.plot_reader = None
+        self.spectrum_reader = None
+        self.dead_time = 0.0
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(STATUS_INTERVAL)
+        self.status_timer.timeout.connect(self.show_status)
+        '''
+        processing 'process' computes the spectra in processing_workers
+        processes, started here once, see processing.py
+        '''
+        self.peaks = None
+        if self.parameters['processing'] == 'process':
+            self.processor = SpectrumProcessPool(int(self.parameters['processing_workers']))
+            self.result_timer = QTimer(self)
+            self.result_timer.setInterval(RESULT_INTERVAL)
+            self.result_timer.timeout.connect(self.collect_spectra)
+            self.result_timer.start()
 
         '''
-        --------------------------Daqmx Task initialization---------------------
+        --------------------------acquisition engine----------------------------
+        the engine owns the daq tasks and the waveform cache, daq_backend
+        'simulated' runs without the card, see engine.py and simulated_daq.py
         '''
-        self.sig_task = Task('signal_task')
-        self.pulse_task = Task('pulse task')
+        self.engine = AcquisitionEngine(self.parameters)
         self.update_parameter()
 
 
@@ -363,85 +405,201 @@ class MainWindow(QMainWindow):
                                                 'Are you sure about exit?',
                                                 QMessageBox.Yes | QMessageBox.No) #Set a QMessageBox when called
         if choice == QMessageBox.Yes:  # give actions when answered the question
+            '''
+            let a running experiment finish its shot and flush the writer
+            '''
+            self.stop_experiment()
+            self.threadpool.waitForDone()
+            self.engine.close()
+            if self.processor is not None:
+                self.processor.close()
             sys.exit()
 
     '''
     --------------------------parameter update slots----------------------------
     '''
     def limit_and_cursor(self, key, text):
-        pass
+        self.parameters[key] = text.split(' ')
+        self.apply_limit_and_cursor(key, self.parameters[key])
+
+    def apply_limit_and_cursor(self, key, value):
+        '''
+        key is e.g. time_x_limit or freq_cursor, value the two numbers as strings
+        '''
+        try:
+            value = [float(val) for val in value]
+        except ValueError:
+            return
+        if len(value) != 2:
+            return
+        kind = key[0:4]
+        if 'x_limit' in key:
+            self.plotter.set_x_limit(kind, value)
+            if kind == 'freq' and self.spectrum_engine is not None \
+                    and self.spectrum_engine.band is not None:
+                self.spectrum_engine.set_band(value)
+                if self.processor is not None:
+                    self.processor.set_engine(self.spectrum_engine)
+        elif 'y_limit' in key:
+            self.plotter.set_y_limit(kind, value)
+        elif 'cursor' in key:
+            self.plotter.set_cursor(kind, value)
 
     def parameter_change(self, key, text):
         self.parameters[key] = text
 
     def update_parameter(self):
-        self.sig_task.close()
-        self.pulse_task.close()
-        samp_rate = int(self.parameters['sampling_rate'])
-        pulse_data = pulse_interpreter(BASE_FOLDER +
-                                        '\pyqt_circulation_measurement\pulse_sequences\\' +
-                                        self.parameters['pulse_file'], samp_rate,
-                                         int(self.parameters['iteration']))
-        self.samp_num = len(pulse_data)
-        self.sig_task = Task('signal_task')
-        self.pulse_task = Task('pulse task')
-        for key,item in self.parameters.items():
-            if 'channel' in key:
-                if 'pulse' in key:
-                    self.pulse_task.ao_channels.add_ao_voltage_chan(item)
-                else:
-                    self.sig_task.ai_channels.add_ai_voltage_chan(physical_channel = item,
-                            terminal_config = constants.TerminalConfiguration.DIFFERENTIAL)
-
-        self.pulse_task.timing.cfg_samp_clk_timing(rate = samp_rate,
-                        samps_per_chan = self.samp_num,
-                        sample_mode=constants.AcquisitionType.FINITE)
-        self.sig_task.timing.cfg_samp_clk_timing(rate = samp_rate,
-                     source = '/Dev1/ao/SampleClock',
-                     samps_per_chan = self.samp_num,
-                     sample_mode=constants.AcquisitionType.FINITE)
-        self.pulse_task.write(pulse_data)
-        self.time_data = np.linspace(0,(self.samp_num/samp_rate), self.samp_num)
-        self.time_data = np.reshape(self.time_data,(1,self.samp_num))
+        self.engine.configure(BASE_FOLDER +
+                              '\pyqt_circulation_measurement\pulse_sequences\\' +
+                              self.parameters['pulse_file'])
+        self.time_data = np.reshape(self.engine.time_axis(),(1,self.engine.data_num))
+        '''
+        spectrum_zoom 'on' computes only the freq_x_limit band, the baseband
+        of the lock-in is shown around the reference frequency
+        '''
+        band = None
+        if self.parameters['spectrum_zoom'] == 'on':
+            band = [float(val) for val in self.parameters['freq_x_limit']]
+        center = 0
+        if self.engine.lockin is not None:
+            center = self.engine.references[0][0]
+        self.spectrum_engine = SpectrumEngine(self.engine.data_rate, self.parameters['spectrum_window'],
+                                              band, int(self.parameters['spectrum_points']), center)
+        if self.processor is not None:
+            self.processor.configure(self.spectrum_engine, (3, self.engine.data_num),
+                                     np.float64 if self.engine.lockin is None else complex)
 
     '''
     --------------------------Multithreading slots------------------------------
     '''
     def start_experiment(self):
-        worker = ReadDataWorker(self.pulse_task, self.sig_task, self.stopBtn, self.parameters, self.samp_num)
-        worker.signals.data_measured.connect(self.store_plot_data)
-        self.threadpool.start(worker)
-
-    def store_plot_data(self, data):
+        if self.worker is not None:
+            return
+        self.engine.prepare_run()
+        self.worker = ReadDataWorker(self.engine)
+        self.worker.signals.snapshot_ready.connect(self.store_plot_data)
+        self.plot_reader = RingReader(self.engine.ring)
+        self.spectrum_reader = RingReader(self.engine.ring)
+        self.curve_count = 0
+        if self.engine.reduction is not None:
+            for axis in self.curve_ax.values():
+                axis.set_xlabel(self.engine.reduction.header['axis_name'])
+        self.worker.signals.dead_time.connect(self.show_dead_time)
+        self.worker.signals.finished.connect(self.experiment_finished)
+        self.dead_time = 0.0
+        self.threadpool.start(self.worker)
+        self.status_timer.start()
+
+    def stop_experiment(self):
+        if self.worker is not None:
+            self.worker.stop()
+
+    def experiment_finished(self):
+        self.status_timer.stop()
+        self.worker = None
         if self.stopBtn.isChecked():
             self.stopBtn.toggle()
-        np.save(self.parameters['file_name'], np.concatenate((self.time_data, data)))
-        self.ax['nmr_time'].clear()
-        self.ax['nmr_time'].plot(self.time_data[0,:], data[0,:])
-        self.ax['nsor_time'].clear()
-        self.ax['nsor_time'].plot(self.time_data[0,:], data[1,:])
+        self.show_curves()
+        self.statusBar().showMessage('finished, ' + format_stats(self.engine.stats()).replace('\n', ', '))
 
-        f_max = int(self.parameters['sampling_rate'])/2
-        fourier_worker_nmr = FourierWorker(data[0,:], f_max, 'nmr_freq')
-        fourier_worker_nmr.signals.data.connect(self.set_fourier)
-        self.threadpool.start(fourier_worker_nmr)
+    def show_dead_time(self, dead_time):
+        self.dead_time = dead_time
 
-        fourier_worker_nsor = FourierWorker(data[1,:], f_max, 'nsor_freq')
-        fourier_worker_nsor.signals.data.connect(self.set_fourier)
-        self.threadpool.start(fourier_worker_nsor)
+    def show_status(self):
+        '''
+        live throughput of the run, from the last telemetry records when the
+        telemetry is on, otherwise averaged over the whole run
+        '''
+        self.show_curves()
+        if self.engine.telemetry.enabled:
+            shots_per_second, duty_cycle = self.engine.telemetry.rates()
+        else:
+            stats = self.engine.stats()
+            shots_per_second, duty_cycle = stats['shots_per_second'], stats['duty_cycle']
+        writer = self.engine.writer.stats()
+        self.statusBar().showMessage(f'{shots_per_second:.1f} shots/s, duty cycle {duty_cycle*100:.1f} %, '
+                                     f'dead time per shot: {self.dead_time*1000:.2f} ms, '
+                                     f'writer queue: {writer["depth"]} (max {writer["max_depth"]}), '
+                                     f'dropped: {writer["dropped"]} saved, {writer["coalesced"]} coalesced, '
+                                     f'{self.plot_reader.skipped} plotted, {self.spectrum_reader.skipped} in the spectrum, '
+                                     f'{self.plot_reader.overruns + self.spectrum_reader.overruns} overruns'
+                                     + (f', nmr peak {self.peaks[0][0]:.1f} Hz, nsor peak {self.peaks[1][0]:.1f} Hz'
+                                        if self.peaks is not None else ''))
+
+    def show_curves(self):
+        '''
+        redraw the reduced curves when the writer reduced another iteration,
+        only the reduced points are drawn
+        '''
+        reduction = self.engine.reduction
+        if reduction is None or reduction.count == self.curve_count:
+            return
+        self.curve_count = reduction.count
+        for name in reduction.header['reducers']:
+            for channel in ['nmr', 'nsor']:
+                x, y = reduction.curve(name, channel)
+                reduced = ~np.isnan(y)
+                self.curve_plotter.update(f'{channel}_{name}_curve', x[reduced], y[reduced])
+
+    def store_plot_data(self, sequence):
+        '''
+        plot the newest snapshot of the ring, older ones are skipped
+        '''
+        if self.worker is not None:
+            self.worker.acknowledge()
+        snapshot = self.plot_reader.latest()
+        if snapshot is None:
+            return
+        start = time.perf_counter()
+        sequence, iteration, averages, data = snapshot
+        self.plotter.update('nmr_time', self.time_data[0,:], data[0,:].real)
+        self.plotter.update('nsor_time', self.time_data[0,:], data[1,:].real)
+
+        self.start_spectrum()
+        self.engine.telemetry.add('plot', time.perf_counter() - start,
+                                  self.engine.shot_number(iteration, averages))
+
+    def start_spectrum(self):
+        '''
+        only one spectrum is computed at a time (one per worker process), it
+        takes the newest snapshot of the ring when it starts
+        '''
+        if self.spectrum_reader is None or not self.spectrum_reader.pending():
+            return
+        if self.processor is not None:
+            if self.processor.free:
+                self.processor.submit(self.spectrum_reader.latest()[3])
+            return
+        if self.spectrum_busy:
+            return
+        self.spectrum_busy = True
+        '''
+        the thread gets its own copy, the buffer of the reader is reused
+        '''
+        data = self.spectrum_reader.latest(np.empty_like(self.spectrum_reader.buffer))[3]
+        spectrum_worker = SpectrumWorker(data, self.spectrum_engine)
+        spectrum_worker.signals.data.connect(self.set_fourier)
+        self.threadpool.start(spectrum_worker)
 
     def set_fourier(self, data):
-        key = data[2]
-        self.ax[key].clear()
-        self.ax[key].plot(data[0], np.abs(data[1]))
+        self.plotter.update('nmr_freq', data[0], np.abs(data[1][0]))
+        self.plotter.update('nsor_freq', data[0], np.abs(data[1][1]))
+        self.spectrum_busy = False
+        self.start_spectrum()
+
+    def collect_spectra(self):
+        for axis, spectra, peaks in self.processor.poll():
+            self.peaks = peaks
+            self.set_fourier((axis, spectra))
 
 '''
 ################################################################################
 '''
 
-app = QApplication(sys.argv)
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
 
-window = MainWindow()
-window.move(300,300)
-window.show()
-app.exec_()
+    window = MainWindow()
+    window.move(300,300)
+    window.show()
+    app.exec_()
@@ -0,0 +1,148 @@
+'''
+int16 dac codes of the ao waveforms
+with ao_format 'int16' the waveforms are converted to the native codes of the
+dac here, with the scaling coefficients the driver reports for the channel,
+and written with the unscaled writer: the driver neither validates nor scales
+them and takes a quarter of the bytes of float64
+the conversion works in blocks, so a sequence of several seconds needs no
+float64 temporaries of its size, and counts the points outside the output
+range of the channel (which the float path would refuse)
+
+the adc goes the other way: with ai_format 'int16' the shots are read as codes
+and only scaled to volts (AdcScaling) when an average is looked at
+'''
+import numpy as np
+
+from oscillator import BLOCK_SIZE
+
+CODE_MIN = -2**15
+CODE_MAX = 2**15 - 1
+AO_FORMATS = ('float64', 'int16')
+AI_FORMATS = ('float64', 'int16')
+
+
+class DacScaling:
+    '''
+    coefficients: c0, c1, ... of code = c0 + c1*v + c2*v**2 + ... (the
+    ao_dev_scaling_coeff of the channel)
+    low, high: output range of the channel in volts
+    '''
+    def __init__(self, coefficients, low = -10.0, high = 10.0):
+        self.coefficients = [float(val) for val in coefficients]
+        while len(self.coefficients) > 2 and self.coefficients[-1] == 0:
+            self.coefficients.pop()
+        if len(self.coefficients) < 2 or self.coefficients[1] == 0:
+            raise ValueError(f'dac scaling coefficients {coefficients} are not invertible')
+        self.low = float(low)
+        self.high = float(high)
+        self.lsb = 1/abs(self.coefficients[1]) # volts per code
+        self.zero_code = self.codes(np.zeros(1))[0][0]
+
+    def polynomial(self, volts, out):
+        out[:] = self.coefficients[-1]
+        for coefficient in self.coefficients[-2::-1]:
+            out *= volts
+            out += coefficient
+        return out
+
+    def codes(self, volts, out = None):
+        '''
+        (codes, clipped): the rounded int16 codes of volts, into out if given,
+        and the number of points outside low to high, which are clipped
+        '''
+        volts = np.asarray(volts)
+        if out is None:
+            out = np.empty(volts.shape, dtype = np.int16)
+        clipped = 0
+        block = np.empty(min(BLOCK_SIZE, len(volts)))
+        for _b in range(0, len(volts), BLOCK_SIZE):
+            _v = volts[_b:_b+BLOCK_SIZE]
+            _value = block[:len(_v)]
+            clipped += int(np.count_nonzero((_v < self.low) | (_v > self.high)))
+            np.clip(_v, self.low, self.high, out = _value)
+            if len(self.coefficients) > 2:
+                self.polynomial(_value.copy(), _value)
+            else:
+                self.linear(_value)
+            np.rint(_value, out = _value)
+            np.clip(_value, CODE_MIN, CODE_MAX, out = _value)
+            out[_b:_b+BLOCK_SIZE] = _value
+        return out, clipped
+
+    def linear(self, value):
+        value *= self.coefficients[1]
+        value += self.coefficients[0]
+        return value
+
+    def volts(self, codes):
+        '''
+        output voltage of codes, the inverse of the polynomial (refined with
+        newton steps when it is not linear)
+        '''
+        codes = np.asarray(codes, dtype = np.float64)
+        c0, c1 = self.coefficients[:2]
+        volts = (codes - c0)/c1
+        if len(self.coefficients) > 2:
+            derivative = np.polynomial.polynomial.polyder(self.coefficients)
+            for _ in range(3):
+                error = np.polynomial.polynomial.polyval(volts, self.coefficients) - codes
+                volts -= error/np.polynomial.polynomial.polyval(volts, derivative)
+        return volts
+
+    def max_error(self, volts, codes = None):
+        '''
+        largest difference in volts between the output of the codes (computed
+        from volts if not given) and volts inside the range, lsb/2 when the
+        codes are equivalent to the float path (about lsb/2 for a polynomial
+        which is not linear)
+        '''
+        volts = np.asarray(volts)
+        if codes is None:
+            codes = self.codes(volts)[0]
+        error = 0.0
+        for _b in range(0, len(volts), BLOCK_SIZE):
+            _v = np.clip(volts[_b:_b+BLOCK_SIZE], self.low, self.high)
+            error = max(error, float(np.max(np.abs(self.volts(codes[_b:_b+BLOCK_SIZE]) - _v), initial = 0)))
+        return error
+
+
+class AdcScaling:
+    '''
+    coefficients: for every channel c0, c1, ... of v = c0 + c1*code +
+    c2*code**2 + ... (the ai_dev_scaling_coeff of the channel)
+    '''
+    def __init__(self, coefficients):
+        self.coefficients = [[float(val) for val in channel] for channel in coefficients]
+        for channel in self.coefficients:
+            if len(channel) < 2 or channel[1] == 0:
+                raise ValueError(f'adc scaling coefficients {channel} are not invertible')
+
+    def volts(self, codes, out = None):
+        '''
+        volts of codes (channel, points), which may be averages of codes
+        '''
+        codes = np.asarray(codes)
+        if out is None:
+            out = np.empty(codes.shape)
+        for row, coefficients in zip(range(len(codes)), self.coefficients):
+            _value = out[row]
+            _value[:] = coefficients[-1]
+            for coefficient in coefficients[-2::-1]:
+                _value *= codes[row]
+                _value += coefficient
+        return out
+
+    def codes(self, volts, out = None):
+        '''
+        rounded int16 codes of volts (channel, points), with the linear part of
+        the scaling only (the simulated adc)
+        '''
+        volts = np.asarray(volts)
+        if out is None:
+            out = np.empty(volts.shape, dtype = np.int16)
+        for row, coefficients in zip(range(len(volts)), self.coefficients):
+            _value = (volts[row] - coefficients[0])/coefficients[1]
+            np.rint(_value, out = _value)
+            np.clip(_value, CODE_MIN, CODE_MAX, out = _value)
+            out[row] = _value
+        return out
@@ -0,0 +1,77 @@
+'''
+daq backends, selected with daq_backend in parameter.txt
+'nidaqmx'   the national instruments card through the nidaqmx package
+'simulated' simulated_daq, same subset of the nidaqmx api, no card needed
+a backend hands out tasks, readers, unscaled readers and unscaled ao writers,
+the dac scaling of an ao task and the adc scaling of an ai task (see dac.py)
+and carries the nidaqmx constants, nidaqmx is only
+imported when the real backend is used
+'''
+from dac import DacScaling, AdcScaling
+
+
+class NidaqmxBackend:
+    name = 'nidaqmx'
+
+    def __init__(self):
+        from nidaqmx import constants
+        from nidaqmx.task import Task
+        from nidaqmx.stream_readers import AnalogMultiChannelReader, AnalogUnscaledReader
+        from nidaqmx.stream_writers import AnalogUnscaledWriter
+        self.constants = constants
+        self._task = Task
+        self._reader = AnalogMultiChannelReader
+        self._unscaled_reader = AnalogUnscaledReader
+        self._unscaled_writer = AnalogUnscaledWriter
+
+    def task(self, name):
+        return self._task(name)
+
+    def reader(self, task):
+        return self._reader(task.in_stream)
+
+    def unscaled_reader(self, task):
+        '''
+        read_int16(data, number_of_samples_per_channel) into int16 data of
+        shape (channel, sample)
+        '''
+        return self._unscaled_reader(task.in_stream)
+
+    def ai_scaling(self, task):
+        '''
+        AdcScaling of the ai channels of task
+        '''
+        return AdcScaling([channel.ai_dev_scaling_coeff for channel in task.ai_channels])
+
+    def unscaled_writer(self, task):
+        '''
+        write_int16(codes) with codes of shape (channel, sample)
+        '''
+        return self._unscaled_writer(task.out_stream)
+
+    def ao_scaling(self, task):
+        '''
+        DacScaling of the first ao channel of task
+        '''
+        channel = task.ao_channels[0]
+        return DacScaling(channel.ao_dev_scaling_coeff, channel.ao_min, channel.ao_max)
+
+
+def get_backend(name, **options):
+    '''
+    options are passed on to the simulated backend (noise, time_scale, ...)
+    '''
+    if name == 'nidaqmx':
+        return NidaqmxBackend()
+    elif name == 'simulated':
+        from simulated_daq import SimulatedBackend
+        return SimulatedBackend(**options)
+    raise ValueError(f'unknown daq backend {name}, use nidaqmx or simulated')
+
+
+def sample_clock(channel):
+    '''
+    the ao sample clock terminal of the device of channel, e.g. Dev1/ao1
+    gives /Dev1/ao/SampleClock
+    '''
+    return '/' + channel.strip('/').split('/')[0] + '/ao/SampleClock'
@@ -0,0 +1,290 @@
+'''
+on disk dataset of one run, made of two files
+file_name.npy:  preallocated array (iteration, channel, samp_num), memory mapped,
+                every iteration is written in place
+file_name.json: header with the time base (t0, dt), the parameters of the run
+                and the number of averages stored for every iteration
+the files can be opened with open_dataset while the run is still going
+
+RawDataset stores the integer sums of the adc codes instead (ai_format
+'int16'), losslessly compressed, in
+file_name.raw:  one zlib chunk per iteration, the differences along the
+                points split into byte planes before compression, only the
+                final sums of an iteration are written (see Engine.store), an
+                iteration written again is appended and the chunk it replaces
+                is dropped when the dataset is closed
+file_name.json: the same header, with the format, the dtype of the sums, the
+                scaling polynomials of the channels and the (offset, size) of
+                the chunk of every iteration
+its data is a lazy view which decompresses and scales an iteration only when
+it is indexed
+'''
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from dac import AdcScaling
+
+CHANNELS = ['nmr', 'nsor', 'laser']
+# zlib level of the chunks of a RawDataset, 1 is fast and compresses the
+# byte planes nearly as well as the higher levels
+COMPRESSION_LEVEL = 1
+# iterations kept decompressed by the view of a RawDataset
+CACHED_ITERATIONS = 4
+
+
+def write_header(file_name, header):
+    '''
+    the header is replaced in one step so a reader never sees half of it
+    '''
+    temp_name = file_name + '.json.tmp'
+    with open(temp_name, 'w') as f:
+        json.dump(header, f, indent = 2)
+    os.replace(temp_name, file_name + '.json')
+
+
+def read_header(file_name):
+    with open(file_name + '.json', 'r') as f:
+        return json.load(f)
+
+
+class ShotDataset:
+    '''
+    use ShotDataset.create for a new run and open_dataset for reading
+    '''
+    def __init__(self, file_name, data, header):
+        self.file_name = file_name
+        self.data = data
+        self.header = header
+
+    @classmethod
+    def create(cls, file_name, iterations, samp_num, samp_rate, parameters = None,
+               channels = CHANNELS, dtype = np.float64, t0 = 0.0):
+        data = np.lib.format.open_memmap(file_name + '.npy', mode = 'w+', dtype = dtype,
+                                         shape = (iterations, len(channels), samp_num))
+        header = {'shape': list(data.shape),
+                  'dtype': np.dtype(dtype).str,
+                  'channels': list(channels),
+                  't0': t0,
+                  'dt': 1/samp_rate,
+                  'averages': [0]*iterations,
+                  'parameters': parameters or {}}
+        write_header(file_name, header)
+        return cls(file_name, data, header)
+
+    def write(self, iteration, data, averages):
+        '''
+        store the average of one iteration, averages is the number of shots in it
+        '''
+        self.data[iteration] = data
+        self.data.flush()
+        self.header['averages'][iteration] = averages
+        write_header(self.file_name, self.header)
+
+    def volts(self, data, averages):
+        '''
+        the snapshots are stored as they are, see RawDataset.volts
+        '''
+        return data
+
+    def completed(self):
+        '''
+        the iterations which hold data so far
+        '''
+        return [i for i, avg in enumerate(self.header['averages']) if avg > 0]
+
+    def time_axis(self):
+        return self.header['t0'] + self.header['dt']*np.arange(self.header['shape'][2])
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+
+def encode_chunk(sums):
+    '''
+    zlib of the byte planes of the differences along the points
+    '''
+    delta = np.diff(sums, axis = -1, prepend = np.zeros(sums.shape[:-1] + (1,), dtype = sums.dtype))
+    planes = delta.reshape(-1).view(np.uint8).reshape(-1, sums.dtype.itemsize).T
+    return zlib.compress(np.ascontiguousarray(planes).tobytes(), COMPRESSION_LEVEL)
+
+
+def decode_chunk(chunk, shape, dtype):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(zlib.decompress(chunk), dtype = np.uint8).reshape(dtype.itemsize, -1)
+    delta = np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+    return np.cumsum(delta, axis = -1, dtype = dtype)
+
+
+class RawDataset:
+    '''
+    use RawDataset.create for a new run and open_dataset for reading
+    the sums are stored, an iteration is scaled as volts(sums/averages)
+    '''
+    def __init__(self, file_name, header):
+        self.file_name = file_name
+        self.header = header
+        self.scaling = AdcScaling(header['scaling'])
+        self.data = ScaledView(self)
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    @classmethod
+    def create(cls, file_name, iterations, samp_num, samp_rate, scaling, parameters = None,
+               channels = CHANNELS, dtype = np.int64, t0 = 0.0):
+        '''
+        scaling: the coefficients of every channel, see AdcScaling
+        dtype: integer type of the sums
+        '''
+        open(file_name + '.raw', 'wb').close()
+        header = {'format': 'raw',
+                  'shape': [iterations, len(channels), samp_num],
+                  'dtype': np.dtype(dtype).str,
+                  'channels': list(channels),
+                  't0': t0,
+                  'dt': 1/samp_rate,
+                  'scaling': [list(map(float, coefficients)) for coefficients in scaling],
+                  'averages': [0]*iterations,
+                  'chunks': [None]*iterations,
+                  'size': 0,
+                  'parameters': parameters or {}}
+        write_header(file_name, header)
+        return cls(file_name, header)
+
+    def write(self, iteration, sums, averages):
+        '''
+        store the sums of averages shots of one iteration, the chunk is
+        appended, so a reader never sees a chunk of the index being replaced
+        '''
+        chunk = encode_chunk(np.asarray(sums, dtype = self.header['dtype']))
+        offset = self.header['size']
+        with open(self.file_name + '.raw', 'ab') as f:
+            f.write(chunk)
+        self.header['size'] = offset + len(chunk)
+        self.header['chunks'][iteration] = [offset, len(chunk)]
+        self.header['averages'][iteration] = averages
+        write_header(self.file_name, self.header)
+        self.raw_bytes += sums.size*2
+        self.stored_bytes += len(chunk)
+
+    def volts(self, sums, averages):
+        '''
+        the average of the sums in volts
+        '''
+        return self.scaling.volts(np.divide(sums, max(averages, 1)))
+
+    def sums(self, iteration):
+        '''
+        the stored sums of iteration, zeros if it holds no data
+        '''
+        shape = self.header['shape'][1:]
+        if self.header['chunks'][iteration] is None:
+            return np.zeros(shape, dtype = self.header['dtype'])
+        offset, size = self.header['chunks'][iteration]
+        with open(self.file_name + '.raw', 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(size)
+        return decode_chunk(chunk, shape, self.header['dtype'])
+
+    def read(self, iteration):
+        '''
+        the iteration in volts, zeros like a ShotDataset if it holds no data
+        '''
+        if self.header['chunks'][iteration] is None:
+            return np.zeros(self.header['shape'][1:])
+        return self.volts(self.sums(iteration), self.header['averages'][iteration])
+
+    def completed(self):
+        return [i for i, avg in enumerate(self.header['averages']) if avg > 0]
+
+    def time_axis(self):
+        return self.header['t0'] + self.header['dt']*np.arange(self.header['shape'][2])
+
+    def stats(self):
+        '''
+        bytes of the int16 codes written and of their chunks
+        '''
+        return {'raw_bytes': self.raw_bytes, 'stored_bytes': self.stored_bytes,
+                'file_bytes': self.header['size']}
+
+    def compact(self):
+        '''
+        drop the chunks of iterations written again, which are no longer in
+        the index
+        '''
+        chunks = self.header['chunks']
+        live = sum(chunk[1] for chunk in chunks if chunk is not None)
+        if live == self.header['size']:
+            return
+        offset = 0
+        with open(self.file_name + '.raw', 'rb') as old, open(self.file_name + '.raw.tmp', 'wb') as new:
+            for chunk in chunks:
+                if chunk is None:
+                    continue
+                old.seek(chunk[0])
+                new.write(old.read(chunk[1]))
+                chunk[0] = offset
+                offset += chunk[1]
+        os.replace(self.file_name + '.raw.tmp', self.file_name + '.raw')
+        self.header['size'] = offset
+        write_header(self.file_name, self.header)
+
+    def close(self):
+        self.compact()
+
+
+class ScaledView:
+    '''
+    read only array like view of a RawDataset in volts, shape (iteration,
+    channel, samp_num), indexing decompresses the iterations it touches,
+    the last CACHED_ITERATIONS of them are kept
+    '''
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = tuple(dataset.header['shape'])
+        self.dtype = np.dtype(np.float64)
+        self.ndim = 3
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def iteration(self, index):
+        key = (index, tuple(self.dataset.header['chunks'][index] or ()))
+        if key not in self.cache:
+            self.cache[key] = self.dataset.read(index)
+            if len(self.cache) > CACHED_ITERATIONS:
+                self.cache.popitem(last = False)
+        else:
+            self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = key[0], key[1:]
+        if isinstance(first, (int, np.integer)):
+            index = range(self.shape[0])[first]
+            return self.iteration(index)[rest]
+        indices = np.arange(self.shape[0])[first]
+        return np.stack([self.iteration(index)[rest] for index in indices.ravel()]).reshape(
+            indices.shape + self.iteration(0)[rest].shape)
+
+    def __array__(self, dtype = None, copy = None):
+        array = self[:]
+        return array if dtype is None else array.astype(dtype)
+
+
+def open_dataset(file_name):
+    '''
+    read only view of a dataset, also works while it is being written
+    a RawDataset is returned for the raw format, its data is scaled lazily
+    '''
+    header = read_header(file_name)
+    if header.get('format') == 'raw':
+        return RawDataset(file_name, header)
+    return ShotDataset(file_name, np.load(file_name + '.npy', mmap_mode = 'r'), header)
@@ -0,0 +1,729 @@
+'''
+acquisition engine, everything of a measurement except the display
+the engine configures the tasks of the daq backend for a pulse file, runs the
+iterations and averages, streams the snapshots to the dataset through the
+DatasetWriter and keeps the throughput statistics, it imports neither Qt nor
+matplotlib so it runs unattended from the command line:
+
+    python engine.py parameter.txt pulse_sequences/cpmg_sequence.txt
+
+the gui (circulation_measurement.py) is a client of the same engine, every
+snapshot is published in the ShotRing ring (see ring.py) and on_snapshot of
+run() is only told its sequence number
+'''
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+import time
+
+import numpy as np
+
+from daq_backend import get_backend, sample_clock
+from nmr_pulses import PulseProgram
+from waveform_cache import WaveformCache
+from averaging import ShotAccumulator
+from dataset import ShotDataset, RawDataset, write_header
+from writer import DatasetWriter
+from lockin import LockIn
+from telemetry import Telemetry
+from ao_buffer import WaveformStager
+from ring import ShotRing
+from dac import AO_FORMATS, AI_FORMATS
+from reducers import ReductionStage, SpectralPeak, TimeAmplitude, parse_reducers
+
+MODULE_FOLDER = os.path.dirname(os.path.realpath(__file__))
+
+# size of the ai buffer in continuous mode, in shots
+CONTINUOUS_BUFFER_SHOTS = 8
+
+
+def read_parameter(parameter_file):
+    with open(parameter_file, 'r') as f:
+        parameter_raw = f.read()
+    parameters = json.loads(parameter_raw)
+    return parameters
+
+def save_parameter(parameter_file, **kwargs):
+    parameters = read_parameter(parameter_file)
+    with open(parameter_file,'w') as f:
+        for key,val in kwargs.items():
+            parameters[key] = val
+        json.dump(parameters, f, indent = 2)
+
+def make_waveform_cache(parameters):
+    '''
+    an empty cache_folder keeps the cache in memory only, a relative folder
+    is taken from the folder of this module, cache_disk_mb caps the folder
+    '''
+    cache_folder = None
+    if parameters['cache_folder']:
+        cache_folder = os.path.join(MODULE_FOLDER, parameters['cache_folder'])
+    return WaveformCache(float(parameters['cache_size_mb'])*2**20, cache_folder,
+                         float(parameters['cache_disk_mb'])*2**20)
+
+
+class AcquisitionEngine:
+    '''
+    parameters is the dictionary of parameter.txt, it is read again by
+    configure() and prepare_run() so edits made in between are picked up
+
+    configure(pulse_file) builds the waveforms of all iterations and sets up
+    the tasks, afterwards samp_num, data_num, data_rate, data_t0, lockin and
+    references describe the snapshots of the run
+
+    acquisition_mode 'finite' starts and stops both tasks for every shot,
+    'continuous' keeps them running for all averages of an iteration, the ao
+    task regenerates its buffer so the shots follow each other back to back
+    and the ai task hands over every shot through the every n samples event
+
+    with a LockIn every shot is demodulated before it is averaged, the
+    snapshots are then complex baseband, references holds the (frequency,
+    phase) of every iteration
+
+    the stages of every shot are timed into telemetry, see telemetry.py, the
+    records are exported next to the dataset when telemetry is csv or json
+
+    ao_prefetch 'on' generates the waveform of the next iteration while the
+    current one is acquiring (see ao_buffer.py), 'off' generates the
+    waveforms of all iterations in configure()
+
+    ai_format 'int16' reads the shots as the int16 codes of the adc, sums
+    them as integers and stores the sums compressed in a RawDataset with the
+    scaling of the channels, only the final sums of every iteration are
+    written, the snapshots in ring are still volts, it does not go with
+    the lock-in, which needs volts for every shot
+
+    ao_format 'int16' converts the waveforms to the codes of the dac while
+    they are staged and writes them with the unscaled writer, 'float64'
+    writes volts, compare_ao() checks both paths against each other
+
+    reducers (e.g. 'peak,amplitude' or 'off') reduce the final snapshot of
+    every iteration to one number per channel inside freq_cursor and
+    time_cursor, see reducers.py
+    '''
+    def __init__(self, parameters, backend = None, waveform_cache = None):
+        self.parameters = parameters
+        if backend is None:
+            backend = get_backend(parameters['daq_backend'],
+                                  noise = float(parameters['simulated_noise']))
+        if waveform_cache is None:
+            waveform_cache = make_waveform_cache(parameters)
+        self.backend = backend
+        self.waveform_cache = waveform_cache
+        self.sig_task = None
+        self.pulse_task = None
+        self.pulse_program = None
+        self.iterations = []
+        self.stager = None
+        self.dac = None
+        self.ao_writer = None
+        self.adc = None
+        self.dataset = None
+        self.ao_running = False
+        self.writer = None
+        self.ring = None
+        self.reduction = None
+        self.telemetry = Telemetry(1, enabled = False)
+        self.stopped = threading.Event()
+        self.reset_stats()
+
+    def close(self):
+        if self.sig_task is not None:
+            self.sig_task.close()
+            self.pulse_task.close()
+            self.ao_running = False
+        if self.stager is not None:
+            self.stager.close()
+
+    def configure(self, pulse_file):
+        self.close()
+        samp_rate = int(self.parameters['sampling_rate'])
+        self.pulse_program = PulseProgram(pulse_file)
+        '''
+        every iteration gets its own waveform, padded to the longest one so
+        that the tasks keep the same number of samples
+        '''
+        self.iterations = list(range(int(self.parameters['iteration'])))
+        self.samp_rate = samp_rate
+        if self.parameters['ao_prefetch'] == 'on':
+            lengths = self.pulse_program.segment_table(samp_rate, self.iterations).sum(axis = 1)
+            self.samp_num = int(np.max(lengths, initial = 0))
+            source = lambda iteration: self.waveform_cache.waveform(self.pulse_program, samp_rate, iteration)
+            prefetch = True
+        else:
+            pulse_batch = self.waveform_cache.waveforms(self.pulse_program, samp_rate, self.iterations)
+            self.samp_num = pulse_batch.data.shape[1]
+            source = lambda iteration: pulse_batch.data[iteration]
+            prefetch = False
+        constants = self.backend.constants
+        clock = sample_clock(self.parameters['pulse_channel'])
+        self.sig_task = self.backend.task('signal_task')
+        self.pulse_task = self.backend.task('pulse task')
+        for key,item in self.parameters.items():
+            if 'channel' in key:
+                if 'pulse' in key:
+                    self.pulse_task.ao_channels.add_ao_voltage_chan(item)
+                else:
+                    self.sig_task.ai_channels.add_ai_voltage_chan(physical_channel = item,
+                            terminal_config = constants.TerminalConfiguration.DIFFERENTIAL)
+
+        if self.parameters['acquisition_mode'] == 'continuous':
+            '''
+            the ao buffer is one shot long and regenerated, the ai buffer holds
+            a few shots so the every n samples callback can fall behind a bit
+            '''
+            self.pulse_task.timing.cfg_samp_clk_timing(rate = samp_rate,
+                            samps_per_chan = self.samp_num,
+                            sample_mode=constants.AcquisitionType.CONTINUOUS)
+            self.sig_task.timing.cfg_samp_clk_timing(rate = samp_rate,
+                         source = clock,
+                         samps_per_chan = CONTINUOUS_BUFFER_SHOTS*self.samp_num,
+                         sample_mode=constants.AcquisitionType.CONTINUOUS)
+        else:
+            self.pulse_task.timing.cfg_samp_clk_timing(rate = samp_rate,
+                            samps_per_chan = self.samp_num,
+                            sample_mode=constants.AcquisitionType.FINITE)
+            self.sig_task.timing.cfg_samp_clk_timing(rate = samp_rate,
+                         source = clock,
+                         samps_per_chan = self.samp_num,
+                         sample_mode=constants.AcquisitionType.FINITE)
+        self.ao_format = self.parameters['ao_format']
+        if self.ao_format not in AO_FORMATS:
+            raise ValueError(f'unknown ao_format {self.ao_format}, use one of {AO_FORMATS}')
+        self.dac = None
+        self.ao_writer = None
+        if self.ao_format == 'int16':
+            self.dac = self.backend.ao_scaling(self.pulse_task)
+            self.ao_writer = self.backend.unscaled_writer(self.pulse_task)
+        self.stager = WaveformStager(source, self.samp_num, self.iterations, prefetch, scaling = self.dac)
+        self.stager.start()
+        '''
+        lockin 'on' demodulates the shots at the frequency and phase of the
+        first pulse and keeps the complex baseband at lockin_rate
+        '''
+        self.lockin = None
+        self.references = None
+        if self.parameters['lockin'] == 'on':
+            self.references = [self.pulse_program.reference(i) for i in range(len(self.iterations))]
+            self.lockin = LockIn(samp_rate, *self.references[0], float(self.parameters['lockin_rate']))
+            self.data_num = self.lockin.output_length(self.samp_num)
+            self.data_rate = self.lockin.out_rate
+            self.data_t0 = self.lockin.t0
+        else:
+            self.data_num = self.samp_num
+            self.data_rate = samp_rate
+            self.data_t0 = 0.0
+        self.ai_format = self.parameters['ai_format']
+        if self.ai_format not in AI_FORMATS:
+            raise ValueError(f'unknown ai_format {self.ai_format}, use one of {AI_FORMATS}')
+        self.adc = None
+        if self.ai_format == 'int16':
+            if self.lockin is not None:
+                raise ValueError('ai_format int16 does not go with the lock-in, it demodulates volts')
+            self.adc = self.backend.ai_scaling(self.sig_task)
+
+    def time_axis(self):
+        '''
+        computed like ShotDataset.time_axis from dt, so that a replay puts the
+        time cursor on the same points
+        '''
+        return self.data_t0 + (1/self.data_rate)*np.arange(self.data_num)
+
+    def prepare_run(self):
+        '''
+        the dataset holds every iteration of the run, see dataset.py
+        '''
+        self.average = int(self.parameters['average'])
+        if self.adc is None:
+            self.dataset = ShotDataset.create(self.parameters['file_name'], len(self.iterations),
+                                              self.data_num, self.data_rate, self.parameters,
+                                              dtype = np.float64 if self.lockin is None else complex,
+                                              t0 = self.data_t0)
+        else:
+            '''
+            int32 sums as long as the averages of full scale codes fit
+            '''
+            self.sum_dtype = np.int32 if self.average <= 2**16 else np.int64
+            self.code_average = np.zeros((3, self.data_num))
+            self.dataset = RawDataset.create(self.parameters['file_name'], len(self.iterations),
+                                             self.data_num, self.data_rate, self.adc.coefficients,
+                                             self.parameters, dtype = self.sum_dtype, t0 = self.data_t0)
+        if self.references is not None:
+            '''
+            the reference frequency of every iteration, the center of the
+            baseband spectra when the run is replayed (see replay.py)
+            '''
+            self.dataset.header['centers'] = [reference[0] for reference in self.references]
+            write_header(self.parameters['file_name'], self.dataset.header)
+        self.reduction = self.make_reduction()
+        self.writer = DatasetWriter(self.dataset, int(self.parameters['writer_queue']),
+                                    self.parameters['writer_policy'], self.reduction)
+        self.ring = ShotRing(int(self.parameters['ring_slots']), (3, self.data_num),
+                             np.float64 if self.lockin is None else complex)
+        self.mode = self.parameters['acquisition_mode']
+        self.telemetry = Telemetry(int(self.parameters['telemetry_size']), self.samp_num/self.samp_rate,
+                                   self.parameters['telemetry'] != 'off')
+        self.stopped.clear()
+        self.reset_stats()
+        return self.writer
+
+    def make_reduction(self):
+        '''
+        the cursors are taken when the run starts, the reduced curve is
+        plotted against the arrayed duration of the pulse file
+        '''
+        names = parse_reducers(self.parameters['reducers'])
+        if not names:
+            return None
+        reducers = []
+        for name in names:
+            if name == 'peak':
+                reducers.append(SpectralPeak(self.data_rate, [float(val) for val in self.parameters['freq_cursor']],
+                                             int(self.parameters['reducer_points']),
+                                             self.parameters['spectrum_window'],
+                                             None if self.references is None else
+                                             [reference[0] for reference in self.references]))
+            else:
+                reducers.append(TimeAmplitude(self.time_axis(),
+                                              [float(val) for val in self.parameters['time_cursor']]))
+        return ReductionStage(self.parameters['file_name'], reducers,
+                              self.pulse_program.array_axis(self.iterations))
+
+    def run(self, on_snapshot = None, on_dead_time = None):
+        '''
+        acquire every iteration of the configured pulse file, blocks until the
+        run is complete or stopped, the writer is flushed and closed at the end
+        on_snapshot(sequence) gets the sequence number of every snapshot in
+        ring, it is called from the acquisition thread and should return fast,
+        on_dead_time(seconds) the mean dead time per shot of every iteration
+        '''
+        if self.writer is None or self.writer.closing:
+            self.prepare_run()
+        self.on_snapshot = on_snapshot
+        self.on_dead_time = on_dead_time
+        self.start_time = time.perf_counter()
+        try:
+            if self.mode == 'continuous':
+                self.run_continuous()
+            else:
+                self.run_finite()
+        finally:
+            if self.ao_running:
+                self.stop_tasks()
+            self.elapsed = time.perf_counter() - self.start_time
+            self.writer.close()
+            self.telemetry.export(self.parameters['file_name'] + '_telemetry',
+                                  self.parameters['telemetry'])
+        return self.stats()
+
+    def stop(self):
+        '''
+        thread safe, the run ends after the current shot
+        '''
+        self.stopped.set()
+
+    def reset_stats(self):
+        self.shots = 0
+        self.iterations_done = 0
+        self.dead_times = []
+        self.start_time = None
+        self.elapsed = 0.0
+        self.ao_writes = 0
+        self.ao_bytes = 0
+        self.ao_write_time = 0.0
+        self.dropped_shots = 0
+
+    def stats(self):
+        '''
+        shots per second, duty cycle (time covered by the sequences over wall
+        time) and dead time of the last run, with the statistics of the writer
+        '''
+        elapsed = self.elapsed
+        if self.start_time is not None and not elapsed:
+            elapsed = time.perf_counter() - self.start_time
+        stats = {'shots': self.shots,
+                 'iterations': self.iterations_done,
+                 'elapsed': elapsed,
+                 'shots_per_second': self.shots/elapsed if elapsed else 0.0,
+                 'duty_cycle': self.shots*self.samp_num/self.samp_rate/elapsed if elapsed else 0.0,
+                 'mean_dead_time': float(np.mean(self.dead_times)) if self.dead_times else 0.0,
+                 'dropped_shots': self.dropped_shots,
+                 'stopped': self.stopped.is_set()}
+        if self.telemetry.enabled:
+            stats['telemetry'] = self.telemetry.summary()
+        if self.stager is not None:
+            stats['ao_stalls'] = self.stager.stalls
+            stats['ao_stall_time'] = self.stager.stall_time
+        if self.ao_writes:
+            stats['ao_write'] = {'format': self.ao_format,
+                                 'writes': self.ao_writes,
+                                 'bytes': self.ao_bytes,
+                                 'mean_time': self.ao_write_time/self.ao_writes}
+        if self.writer is not None:
+            stats['writer'] = self.writer.stats()
+        if isinstance(self.dataset, RawDataset):
+            stats['raw_dataset'] = self.dataset.stats()
+        if self.reduction is not None:
+            stats['reduced'] = {'iterations': self.reduction.count,
+                                'file_name': self.reduction.file_name + '.npy'}
+        return stats
+
+    def shot_number(self, iteration, averages):
+        '''
+        number of the telemetry record of the snapshot of iteration after
+        averages shots
+        '''
+        return iteration*self.average + averages - 1
+
+    def make_accumulator(self):
+        if self.adc is not None:
+            return ShotAccumulator(3, self.samp_num, dtype = self.sum_dtype, shot_dtype = np.int16)
+        if self.lockin is None:
+            return ShotAccumulator(3, self.samp_num)
+        return ShotAccumulator(3, self.lockin.output_length(self.samp_num), dtype = complex)
+
+    def start_tasks(self):
+        self.sig_task.start()
+        self.pulse_task.start()
+        self.ao_running = True
+
+    def stop_tasks(self):
+        self.sig_task.stop()
+        self.pulse_task.stop()
+        self.ao_running = False
+
+    def start_iteration(self, iteration, accumulator):
+        '''
+        swap the ao buffer to the staged waveform of the iteration, only
+        allowed while the ao task is stopped and only with a waveform of the
+        size the tasks were configured for
+        '''
+        if self.ao_running:
+            raise RuntimeError('the ao task is running, its waveform cannot be replaced')
+        waveform = self.stager.take(iteration)
+        if len(waveform) != self.samp_num:
+            raise ValueError(f'waveform of {len(waveform)} points for a task of {self.samp_num} points')
+        self.write_waveform(waveform)
+        if self.lockin is not None:
+            self.lockin.set_reference(*self.references[iteration])
+        accumulator.reset()
+
+    def write_waveform(self, waveform):
+        '''
+        int16 codes go through the unscaled writer, volts through the task
+        '''
+        start = time.perf_counter()
+        if waveform.dtype == np.int16:
+            self.ao_writer.write_int16(waveform.reshape(1, -1))
+        else:
+            self.pulse_task.write(waveform)
+        self.ao_write_time += time.perf_counter() - start
+        self.ao_writes += 1
+        self.ao_bytes += waveform.nbytes
+
+    def compare_ao(self, iteration = 0, repeat = 3):
+        '''
+        write the waveform of iteration as float64 volts and as int16 codes,
+        only while the tasks are stopped, and compare the bytes, the time per
+        write (mean of repeat writes), the time of the conversion and the
+        largest difference of the codes from the volts, which is at most half
+        a code (lsb/2) when both paths are equivalent
+        a waveform outside the output range is not written as float64, the
+        driver would refuse it
+        '''
+        if self.ao_running:
+            raise RuntimeError('the ao task is running, its waveform cannot be replaced')
+        volts = np.zeros(self.samp_num)
+        waveform = self.waveform_cache.waveform(self.pulse_program, self.samp_rate, self.iterations[iteration])
+        volts[:len(waveform)] = waveform
+        scaling = self.dac or self.backend.ao_scaling(self.pulse_task)
+        writer = self.ao_writer or self.backend.unscaled_writer(self.pulse_task)
+        start = time.perf_counter()
+        codes, clipped = scaling.codes(volts)
+        convert_time = time.perf_counter() - start
+        writes = {'int16': lambda: writer.write_int16(codes.reshape(1, -1))}
+        if not clipped:
+            writes['float64'] = lambda: self.pulse_task.write(volts)
+        write_time = {}
+        for name, write in writes.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                write()
+            write_time[name] = (time.perf_counter() - start)/repeat
+        max_error = scaling.max_error(volts, codes)
+        result = {'iteration': self.iterations[iteration],
+                  'points': self.samp_num,
+                  'float64_bytes': volts.nbytes,
+                  'int16_bytes': codes.nbytes,
+                  'bytes_saved': volts.nbytes - codes.nbytes,
+                  'int16_write_time': write_time['int16'],
+                  'convert_time': convert_time,
+                  'clipped': clipped,
+                  'max_error': max_error,
+                  'lsb': scaling.lsb,
+                  'equivalent': not clipped and max_error <= scaling.lsb/2*(1 + 1e-6)}
+        if 'float64' in write_time:
+            result['float64_write_time'] = write_time['float64']
+            result['speedup'] = write_time['float64']/max(write_time['int16'], 1e-9)
+        return result
+
+    def add_shot(self, accumulator, shot):
+        if self.lockin is None:
+            accumulator.add(shot)
+        else:
+            accumulator.add(self.lockin.demodulate_shot(shot))
+
+    def store(self, iteration, accumulator, final):
+        '''
+        the average is computed into the next slot of the ring, the writer
+        copies it, with the raw format the ring gets the average in volts and
+        only the final sums go to the writer, a compressed chunk per snapshot
+        would grow the file with every average, nothing is allocated per shot
+        '''
+        self.shots += 1
+        snapshot = self.ring.claim()
+        if self.adc is None:
+            saved = accumulator.average(out = snapshot)
+        else:
+            saved = accumulator.sum
+            self.adc.volts(accumulator.average(out = self.code_average), out = snapshot)
+        self.telemetry.mark('average')
+        sequence = self.ring.publish(iteration, accumulator.count)
+        if final or self.adc is None:
+            self.writer.submit(iteration, saved, accumulator.count, final)
+        self.telemetry.mark('save')
+        if self.on_snapshot is not None:
+            self.on_snapshot(sequence)
+        self.telemetry.mark('emit')
+
+    def store_stopped(self, iteration, accumulator):
+        '''
+        the last snapshot of a stopped iteration is submitted again as final,
+        so that the 'drop' policy of the writer cannot lose it
+        '''
+        if accumulator.count > 0:
+            saved = accumulator.average() if self.adc is None else accumulator.sum
+            self.writer.submit(iteration, saved, accumulator.count, True)
+
+    def report_dead_time(self, start_time, shot_num):
+        '''
+        dead time per shot is the wall time not covered by the sequences
+        '''
+        self.iterations_done += 1
+        if shot_num > 0:
+            elapsed = time.perf_counter() - start_time
+            dead_time = elapsed/shot_num - self.samp_num/self.samp_rate
+            self.dead_times.append(dead_time)
+            if self.on_dead_time is not None:
+                self.on_dead_time(dead_time)
+
+    def shot_reader(self):
+        '''
+        the read_many_sample of the reader of the signal task, or the
+        read_int16 of the unscaled reader for the raw format
+        '''
+        if self.adc is None:
+            return self.backend.reader(self.sig_task).read_many_sample
+        return self.backend.unscaled_reader(self.sig_task).read_int16
+
+    def shot_buffer(self):
+        '''
+        a buffer of one shot as the reader fills it, int16 codes for the raw
+        format and float64 volts otherwise, also with the lock-in, whose
+        accumulator holds the complex baseband
+        '''
+        return np.zeros((3, self.samp_num), dtype = np.float64 if self.adc is None else np.int16)
+
+    def run_finite(self):
+        read = self.shot_reader()
+        accumulator = self.make_accumulator()
+        raw_shot = accumulator.shot if self.lockin is None else self.shot_buffer()
+        for current_iter in range(len(self.iterations)):
+            '''
+            initiate data in the current interation
+            '''
+            start_time = time.perf_counter()
+            self.start_iteration(current_iter, accumulator)
+            for current_avg in range(self.average):
+                if self.stopped.is_set():
+                    self.store_stopped(current_iter, accumulator)
+                    return
+
+                self.telemetry.begin(current_iter, current_avg)
+                self.start_tasks()
+                self.telemetry.mark('arm')
+                self.sig_task.wait_until_done()
+                self.pulse_task.wait_until_done()
+                self.telemetry.mark('wait')
+                read(raw_shot, number_of_samples_per_channel = self.samp_num)
+                self.telemetry.mark('read')
+                self.add_shot(accumulator, raw_shot)
+                self.store(current_iter, accumulator, current_avg+1 == self.average)
+                self.stop_tasks()
+                self.telemetry.mark('stop')
+            self.report_dead_time(start_time, self.average)
+
+    def run_continuous(self):
+        '''
+        the callback reads every shot into one of CONTINUOUS_BUFFER_SHOTS
+        reused buffers, the buffers go back to the free queue once added
+        the read time of the callback travels with the shot to its record
+        the callback runs on the thread of the driver and never waits, when
+        no buffer is free the shot is read into a scratch buffer, so that the
+        task buffer does not overrun, and counted as dropped
+        '''
+        read = self.shot_reader()
+        accumulator = self.make_accumulator()
+        free_buffers = queue.Queue()
+        shots = queue.Queue()
+        for _ in range(CONTINUOUS_BUFFER_SHOTS):
+            free_buffers.put(self.shot_buffer())
+        scratch = self.shot_buffer()
+        def shot_acquired(task_handle, event_type, number_of_samples, callback_data):
+            try:
+                shot = free_buffers.get_nowait()
+            except queue.Empty:
+                read(scratch, number_of_samples_per_channel = number_of_samples)
+                self.dropped_shots += 1
+                return 0
+            start = time.perf_counter()
+            read(shot, number_of_samples_per_channel = number_of_samples)
+            shots.put((shot, time.perf_counter() - start))
+            return 0
+        self.sig_task.register_every_n_samples_acquired_into_buffer_event(self.samp_num, shot_acquired)
+        try:
+            for current_iter in range(len(self.iterations)):
+                start_time = time.perf_counter()
+                self.start_iteration(current_iter, accumulator)
+                self.telemetry.begin(current_iter, 0)
+                self.start_tasks()
+                self.telemetry.mark('arm')
+                for current_avg in range(self.average):
+                    if self.stopped.is_set():
+                        break
+                    if current_avg > 0:
+                        self.telemetry.begin(current_iter, current_avg)
+                    shot, read_time = shots.get()
+                    self.telemetry.mark('wait')
+                    self.telemetry.add('read', read_time)
+                    self.add_shot(accumulator, shot)
+                    free_buffers.put(shot)
+                    self.store(current_iter, accumulator, current_avg+1 == self.average)
+                self.stop_tasks()
+                self.telemetry.mark('stop')
+                if self.stopped.is_set():
+                    self.store_stopped(current_iter, accumulator)
+                    return
+                self.report_dead_time(start_time, self.average)
+                '''
+                shots which came in after the last average belong to no iteration
+                '''
+                while not shots.empty():
+                    free_buffers.put(shots.get()[0])
+        finally:
+            self.sig_task.register_every_n_samples_acquired_into_buffer_event(self.samp_num, None)
+
+
+def format_stats(stats):
+    text = (f'{stats["shots"]} shots in {stats["elapsed"]:.2f} s, '
+            f'{stats["shots_per_second"]:.1f} shots/s, duty cycle {stats["duty_cycle"]*100:.1f} %, '
+            f'dead time per shot {stats["mean_dead_time"]*1000:.2f} ms')
+    if 'writer' in stats:
+        writer = stats['writer']
+        text += (f'\nwriter: {writer["written"]} snapshots written, {writer["dropped"]} dropped, '
+                 f'{writer["coalesced"]} coalesced, max queue {writer["max_depth"]}, '
+                 f'mean write latency {writer["mean_latency"]*1000:.1f} ms')
+    if stats.get('dropped_shots'):
+        text += f'\n{stats["dropped_shots"]} shots dropped, no free buffer when they were read'
+    if stats.get('ao_stalls'):
+        text += (f'\nao waveform not ready {stats["ao_stalls"]} times, '
+                 f'waited {stats["ao_stall_time"]*1000:.1f} ms')
+    if 'ao_write' in stats:
+        ao = stats['ao_write']
+        text += (f'\nao: {ao["writes"]} writes of {ao["bytes"]/ao["writes"]/2**20:.2f} MB {ao["format"]}, '
+                 f'mean write time {ao["mean_time"]*1000:.2f} ms')
+    if 'raw_dataset' in stats:
+        raw = stats['raw_dataset']
+        text += (f'\nraw dataset: {raw["stored_bytes"]/2**20:.2f} MB stored for {raw["raw_bytes"]/2**20:.2f} MB '
+                 f'of int16 codes ({raw["raw_bytes"]*4/2**20:.2f} MB as float64)')
+    if 'reduced' in stats:
+        text += f'\n{stats["reduced"]["iterations"]} iterations reduced into {stats["reduced"]["file_name"]}'
+    if 'telemetry' in stats:
+        stages = stats['telemetry']['stages']
+        text += '\nmean per shot: ' + ', '.join(f'{stage} {stages[stage]["mean"]*1000:.2f} ms'
+                                                 for stage in stages)
+    return text
+
+
+def format_ao_comparison(result):
+    text = (f'iteration {result["iteration"]}, {result["points"]} points: '
+            f'{result["float64_bytes"]/2**20:.2f} MB float64, {result["int16_bytes"]/2**20:.2f} MB int16, '
+            f'{result["bytes_saved"]/2**20:.2f} MB saved')
+    if 'float64_write_time' in result:
+        text += (f'\nwrite time {result["float64_write_time"]*1000:.2f} ms float64, '
+                 f'{result["int16_write_time"]*1000:.2f} ms int16 (speedup {result["speedup"]:.1f}), '
+                 f'conversion {result["convert_time"]*1000:.2f} ms')
+    else:
+        text += f'\nint16 write time {result["int16_write_time"]*1000:.2f} ms'
+    text += (f'\nlargest difference {result["max_error"]*1e6:.1f} uV, half a code is {result["lsb"]/2*1e6:.1f} uV, '
+             f'{result["clipped"]} points clipped: '
+             + ('equivalent' if result['equivalent'] else 'NOT equivalent'))
+    return text
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'run a circulation measurement without the gui')
+    parser.add_argument('parameter_file', help = 'parameter file, see parameter.txt')
+    parser.add_argument('pulse_file', help = 'pulse sequence file')
+    parser.add_argument('--file-name', help = 'output dataset, overrides file_name')
+    parser.add_argument('--iteration', type = int, help = 'overrides iteration')
+    parser.add_argument('--average', type = int, help = 'overrides average')
+    parser.add_argument('--backend', choices = ['nidaqmx', 'simulated'],
+                        help = 'overrides daq_backend')
+    parser.add_argument('--json', action = 'store_true', help = 'print the statistics as json')
+    parser.add_argument('--compare-ao', action = 'store_true',
+                        help = 'compare the float64 and int16 ao writes of every iteration instead of running')
+    args = parser.parse_args(argv)
+
+    parameters = read_parameter(args.parameter_file)
+    for key, value in (('file_name', args.file_name), ('iteration', args.iteration),
+                       ('average', args.average), ('daq_backend', args.backend)):
+        if value is not None:
+            parameters[key] = str(value)
+
+    engine = AcquisitionEngine(parameters)
+    engine.configure(args.pulse_file)
+    if args.compare_ao:
+        try:
+            results = [engine.compare_ao(index) for index in range(len(engine.iterations))]
+        finally:
+            engine.close()
+        if args.json:
+            print(json.dumps(results, indent = 2))
+        else:
+            print('\n'.join(format_ao_comparison(result) for result in results))
+        return
+    engine.prepare_run()
+    '''
+    ctrl-c ends the run after the current shot, the dataset stays consistent
+    '''
+    signal.signal(signal.SIGINT, lambda signum, frame: engine.stop())
+    def iteration_done(dead_time):
+        print(f'iteration {engine.iterations_done}/{len(engine.iterations)}, '
+              f'{engine.stats()["shots_per_second"]:.1f} shots/s, '
+              f'dead time per shot {dead_time*1000:.2f} ms', flush = True)
+    try:
+        stats = engine.run(on_dead_time = None if args.json else iteration_done)
+    finally:
+        engine.close()
+    if args.json:
+        print(json.dumps(stats, indent = 2))
+    else:
+        print(('stopped, ' if stats['stopped'] else 'finished, ') + format_stats(stats))
+
+
+if __name__ == '__main__':
+    main()
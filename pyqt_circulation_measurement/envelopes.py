@@ -0,0 +1,140 @@
+'''
+envelopes of shaped pulses
+a shape is given as the optional 6th item of a pulse line of the pulse file,
+name and parameters separated by colons:
+    square                  the default, no envelope
+    gauss[:k]               exp(-(k*x)**2/2), truncated at k sigma (k = 3)
+    sinc[:lobes]            sinc(lobes*x), lobes zero crossings on each side (3)
+    hsec[:beta[:sweep]]     hyperbolic secant sech(beta*x) (beta = 5.3), with an
+                            adiabatic frequency sweep of sweep Hz (0) across
+                            the pulse, f(x) = frequency + sweep/2*tanh(beta*x)
+    table:file              user table, one line per point with the amplitude
+                            and optionally the phase in degrees, the file is
+                            relative to the pulse file, linearly interpolated
+x runs from -1 to 1 over the pulse, the envelopes peak at 1 so that the power
+of the pulse stays its peak voltage
+
+an envelope is the amplitude (float64) and the phase (64 bit phase words, see
+oscillator) of every point, or None where there is none, they are memoized per
+(number of points, sampling rate) on the Shape, so the iterations of an array
+and the echoes of a cpmg train reuse them
+'''
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+SHAPES = ('square', 'gauss', 'sinc', 'hsec', 'table')
+DEFAULTS = {'gauss': (3.0,), 'sinc': (3.0,), 'hsec': (5.3, 0.0)}
+# envelopes kept per shape
+MAX_ENVELOPES = 64
+
+
+def phase_words(turns):
+    '''
+    np.array of fractions of a turn as 64 bit phase words (53 bit precision)
+    '''
+    return np.left_shift(np.floor((turns % 1.0)*2.0**53).astype(np.uint64), np.uint64(11))
+
+
+def pulse_axis(n):
+    '''
+    the centers of n points spread over -1 to 1
+    '''
+    return (np.arange(n) + 0.5)*(2/n) - 1 if n else np.zeros(0)
+
+
+class Shape:
+    '''
+    name: one of SHAPES, params: the numbers after the name, table: (amplitude,
+    phase in degrees) arrays of a user table read from file_path
+    '''
+    def __init__(self, name, params = (), table = None, file_path = None):
+        if name not in SHAPES:
+            raise ValueError(f'unknown pulse shape {name}, use one of {SHAPES}')
+        self.name = name
+        self.params = tuple(params) + DEFAULTS.get(name, ())[len(params):]
+        self.table = table
+        self.file_path = file_path
+        self.envelopes = OrderedDict()
+        self.computed = 0
+
+    def __repr__(self):
+        if self.name == 'table':
+            return f'table:{self.file_path}'
+        return ':'.join([self.name] + [f'{val:g}' for val in self.params])
+
+    def envelope(self, n, samp_freq):
+        '''
+        (amplitude, phase words) of a pulse of n points
+        '''
+        key = (n, float(samp_freq))
+        if key in self.envelopes:
+            self.envelopes.move_to_end(key)
+            return self.envelopes[key]
+        amplitude, phase = self.compute(n, samp_freq)
+        for array in (amplitude, phase):
+            if array is not None:
+                array.setflags(write = False)
+        self.envelopes[key] = (amplitude, phase)
+        self.computed += 1
+        if len(self.envelopes) > MAX_ENVELOPES:
+            self.envelopes.popitem(last = False)
+        return amplitude, phase
+
+    def compute(self, n, samp_freq):
+        x = pulse_axis(n)
+        if self.name == 'square':
+            return None, None
+        elif self.name == 'gauss':
+            return np.exp(-(self.params[0]*x)**2/2), None
+        elif self.name == 'sinc':
+            return np.sinc(self.params[0]*x), None
+        elif self.name == 'hsec':
+            beta, sweep = self.params
+            amplitude = 1/np.cosh(beta*x)
+            if sweep == 0:
+                return amplitude, None
+            '''
+            phase = 2*pi*integral of sweep/2*tanh(beta*x) dt with dt = T/2*dx
+            '''
+            duration = n/samp_freq
+            turns = sweep*duration/(4*beta)*np.log(np.cosh(beta*x))
+            return amplitude, phase_words(turns)
+        elif self.name == 'table':
+            table_amplitude, table_phase = self.table
+            table_x = pulse_axis(len(table_amplitude))
+            amplitude = np.interp(x, table_x, table_amplitude)
+            if table_phase is None:
+                return amplitude, None
+            return amplitude, phase_words(np.interp(x, table_x, table_phase)/360)
+
+
+def read_table(file_path):
+    '''
+    amplitude and phase (None without a second column) of a table file,
+    lines starting with # are comments
+    '''
+    table = np.atleast_2d(np.loadtxt(file_path, comments = '#', ndmin = 2))
+    if table.shape[0] < 2:
+        raise ValueError(f'the shape table {file_path} needs at least two points')
+    amplitude = table[:,0]
+    phase = table[:,1] if table.shape[1] > 1 else None
+    return amplitude, phase
+
+
+def parse_shape(spec, folder = ''):
+    '''
+    Shape of a spec like gauss:2.5, None for square
+    '''
+    name, *params = spec.split(':')
+    if name == 'square':
+        return None
+    if name == 'table':
+        if len(params) != 1:
+            raise ValueError(f'table shapes are given as table:file, not {spec}')
+        file_path = os.path.join(folder, params[0])
+        return Shape(name, table = read_table(file_path), file_path = file_path)
+    if name in DEFAULTS and len(params) > len(DEFAULTS[name]):
+        raise ValueError(f'{name} takes at most {len(DEFAULTS[name])} parameters, got {spec}')
+    return Shape(name, [float(val) for val in params])
@@ -0,0 +1,167 @@
+'''
+live plotting of the data axes
+every axis keeps one Line2D which is updated with set_data, the data inside the
+x limits is reduced with a min/max decimation to the pixel width of the axis,
+and the canvas is updated at most once per display frame: a snapshot that is
+replaced before the next frame is never drawn (counted in dropped)
+
+most of a full draw of the figure is spent on ticks and labels, so the lines
+are animated artists which are blitted onto the background of their axis
+(restore_region, draw_artist, blit) and the figure is only drawn again when
+the limits or the cursors change; an autoscaled axis is only rescaled when the
+data leaves the view or fills less than RESCALE_FILL of it
+'''
+import numpy as np
+
+FRAME_INTERVAL = 33 # ms, about 30 frames per second
+# an autoscaled axis is rescaled when the data spans less than this of its view
+RESCALE_FILL = 0.5
+
+
+def minmax_decimate(x, y, n_bins):
+    '''
+    reduce (x, y) to about 2*n_bins points keeping the minimum and maximum of
+    every bin in their original order, so that no peak is lost
+    '''
+    n = len(y)
+    if n <= 2*n_bins or n_bins < 1:
+        return x, y
+    bin_size = n // n_bins
+    m = n_bins * bin_size
+    binned = y[:m].reshape(n_bins, bin_size)
+    offset = np.arange(n_bins) * bin_size
+    index = np.stack((binned.argmin(axis = 1) + offset, binned.argmax(axis = 1) + offset), axis = 1)
+    index.sort(axis = 1)
+    index = index.ravel()
+    if m < n:
+        tail = np.arange(m, n)
+        index = np.concatenate((index, np.sort([tail[np.argmin(y[m:])], tail[np.argmax(y[m:])]])))
+    return x[index], y[index]
+
+
+class LivePlotter:
+    '''
+    axes is the dictionary of axes of the main window, the last part of a key
+    after an underscore ('time' or 'freq' after the channel name) gives the
+    kind of axis
+    blit = False draws the whole figure every frame, for canvases which are
+    saved (animated lines are left out of print_png and savefig)
+    '''
+    def __init__(self, canvas, axes, blit = True):
+        self.canvas = canvas
+        self.ax = axes
+        self.blit = blit and canvas.supports_blit
+        self.lines = {key: axis.plot([], [], animated = self.blit)[0] for key, axis in axes.items()}
+        self.backgrounds = {}
+        self.full_draws = 0
+        self.cursors = {}
+        self.x_limit = {}
+        self.y_limit = {}
+        self.latest = {}
+        self.pending = {}
+        self.dirty = False
+        self.frames = 0
+        self.dropped = 0
+        self.timer = canvas.new_timer(interval = FRAME_INTERVAL)
+        self.timer.add_callback(self.draw_frame)
+        self.timer.start()
+        if self.blit:
+            canvas.mpl_connect('draw_event', self.capture)
+
+    def axes_of(self, kind):
+        return [key for key in self.ax if key.split('_')[-1] == kind]
+
+    def update(self, key, x, y):
+        '''
+        queue new data of one axis for the next frame
+        '''
+        if key in self.pending:
+            self.dropped += 1
+        self.pending[key] = (x, y)
+
+    def set_x_limit(self, kind, limit):
+        self.x_limit[kind] = limit
+        for key in self.axes_of(kind):
+            self.ax[key].set_xlim(limit)
+            if key in self.latest:
+                self.render(key)
+        self.dirty = True
+
+    def set_y_limit(self, kind, limit):
+        self.y_limit[kind] = limit
+        for key in self.axes_of(kind):
+            self.ax[key].set_ylim(limit)
+        self.dirty = True
+
+    def set_cursor(self, kind, position):
+        '''
+        two vertical lines on every axis of the kind
+        '''
+        for key in self.axes_of(kind):
+            if key not in self.cursors:
+                self.cursors[key] = [self.ax[key].axvline(pos, color = 'r', linestyle = '--')
+                                     for pos in position]
+            else:
+                for line, pos in zip(self.cursors[key], position):
+                    line.set_xdata([pos, pos])
+        self.dirty = True
+
+    def render(self, key):
+        '''
+        decimate the visible part of the latest data of the axis into its line,
+        True if the axis was rescaled
+        '''
+        x, y = self.latest[key]
+        kind = key.split('_')[-1]
+        if kind in self.x_limit:
+            start, stop = np.searchsorted(x, self.x_limit[kind])
+            x = x[max(start-1, 0):stop+1]
+            y = y[max(start-1, 0):stop+1]
+        width = int(self.ax[key].bbox.width)
+        x, y = minmax_decimate(x, y, width)
+        self.lines[key].set_data(x, y)
+        if kind in self.y_limit or len(y) == 0:
+            return False
+        scalex = kind not in self.x_limit
+        if not (outside(self.ax[key].get_ylim(), y) or scalex and outside(self.ax[key].get_xlim(), x)):
+            return False
+        self.ax[key].relim()
+        self.ax[key].autoscale_view(scalex = scalex)
+        return True
+
+    def capture(self, event):
+        '''
+        after a full draw: keep the background of every axis and draw the
+        lines onto it
+        '''
+        self.backgrounds = {key: self.canvas.copy_from_bbox(axis.bbox) for key, axis in self.ax.items()}
+        for key, axis in self.ax.items():
+            axis.draw_artist(self.lines[key])
+        self.full_draws += 1
+
+    def draw_frame(self):
+        if not self.pending and not self.dirty:
+            return
+        pending, self.pending = self.pending, {}
+        for key, data in pending.items():
+            self.latest[key] = data
+            if self.render(key):
+                self.dirty = True
+        self.frames += 1
+        if self.dirty or not self.blit or not self.backgrounds:
+            self.dirty = False
+            self.canvas.draw_idle()
+            return
+        for key in pending:
+            self.canvas.restore_region(self.backgrounds[key])
+            self.ax[key].draw_artist(self.lines[key])
+            self.canvas.blit(self.ax[key].bbox)
+
+
+def outside(limits, values):
+    '''
+    True if values leave limits or span less than RESCALE_FILL of them
+    '''
+    low, high = sorted(limits)
+    value_min, value_max = np.min(values), np.max(values)
+    return value_min < low or value_max > high or value_max - value_min < RESCALE_FILL*(high - low)
@@ -0,0 +1,113 @@
+'''
+streaming digital lock-in at the larmor frequency
+every channel is mixed with the reference exp(-i(2*pi*f*t + phase)) taken
+from the pulse file, low pass filtered with a windowed sinc fir and decimated
+to out_rate, the result is the complex baseband: a cosine of amplitude a at
+the reference frequency becomes a*exp(i*(its phase - reference phase))
+
+the fir is applied in polyphase form, taps = TAP_BLOCKS*factor so a window
+of the filter is TAP_BLOCKS whole blocks of factor samples, and every output
+point is a sum of TAP_BLOCKS small matrix products, nothing is computed for
+the points thrown away by the decimation
+the filter history and the reference phase carry over from one chunk to the
+next until reset() is called
+'''
+import numpy as np
+
+from oscillator import synthesize
+
+TAP_BLOCKS = 8
+# cut off of the low pass relative to the output nyquist frequency
+CUTOFF = 0.8
+
+
+def lowpass_taps(factor, blocks = TAP_BLOCKS):
+    '''
+    windowed sinc with unit dc gain for a decimation by factor
+    '''
+    taps = blocks * factor
+    cutoff = CUTOFF / (2 * factor)
+    n = np.arange(taps) - (taps - 1)/2
+    h = np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return h / h.sum()
+
+
+class LockIn:
+    '''
+    samp_rate: input rate, out_rate: requested output rate, rounded so that the
+    decimation factor is an integer (see self.out_rate)
+    '''
+    def __init__(self, samp_rate, ref_freq, ref_phase, out_rate, channels = 3):
+        self.samp_rate = samp_rate
+        self.factor = max(1, int(round(samp_rate/out_rate)))
+        self.out_rate = samp_rate/self.factor
+        self.channels = channels
+        h = lowpass_taps(self.factor)
+        # rows of the reversed filter, one per block of the window
+        self.poly = h[::-1].reshape(TAP_BLOCKS, self.factor).astype(complex)
+        self.history_len = (TAP_BLOCKS - 1) * self.factor
+        # an output point sits at the end of its window, minus the filter delay
+        self.t0 = (self.factor - 1 - (len(h) - 1)/2) / samp_rate
+        self._lo = None
+        self._lo_key = None
+        self.set_reference(ref_freq, ref_phase)
+        self.reset()
+
+    def set_reference(self, ref_freq, ref_phase):
+        self.ref_freq = ref_freq
+        self.ref_phase = ref_phase
+        self._lo_key = None
+
+    def reset(self):
+        self.history = np.zeros((self.channels, self.history_len), dtype = complex)
+        self.sample_index = 0
+
+    def output_length(self, n):
+        '''
+        number of output points of a shot of n points after reset()
+        '''
+        return n // self.factor
+
+    def time_axis(self, n_out):
+        return self.t0 + np.arange(n_out)/self.out_rate
+
+    def reference(self, n):
+        '''
+        2*exp(-i*phase) of the next n input points, cached since every shot
+        starts at the same sample index
+        '''
+        key = (self.sample_index, n)
+        if self._lo_key != key:
+            lo = np.empty(n, dtype = complex)
+            lo.real = synthesize(np.empty(n), self.ref_freq, self.ref_phase, 2,
+                                 self.samp_rate, self.sample_index)
+            lo.imag = synthesize(np.empty(n), self.ref_freq, self.ref_phase + 90, 2,
+                                 self.samp_rate, self.sample_index)
+            self._lo, self._lo_key = lo, key
+        return self._lo
+
+    def process(self, chunk):
+        '''
+        chunk is (channels, n) real, returns the baseband points whose filter
+        window ends inside the chunk, (channels, m) complex
+        '''
+        n = chunk.shape[1]
+        mixed = chunk * self.reference(n)
+        buffer = np.concatenate((self.history, mixed), axis = 1)
+        blocks_num = buffer.shape[1] // self.factor
+        out_num = blocks_num - (TAP_BLOCKS - 1)
+        blocks = buffer[:, :blocks_num*self.factor].reshape(self.channels, blocks_num, self.factor)
+        out = blocks[:, 0:out_num, :] @ self.poly[0]
+        for q in range(1, TAP_BLOCKS):
+            out += blocks[:, q:q+out_num, :] @ self.poly[q]
+        self.history = buffer[:, out_num*self.factor:]
+        self.sample_index += n
+        return out
+
+    def demodulate_shot(self, shot):
+        '''
+        baseband of one complete shot, every shot starts from a clean state so
+        that the shots of an average stay coherent
+        '''
+        self.reset()
+        return self.process(shot)
@@ -1,9 +1,14 @@
 '''
 default unit is SI unit
 '''
+import os
+
 import numpy as np
 from numpy import pi
 
+from oscillator import synthesize, phase_word, BLOCK_SIZE
+from envelopes import parse_shape
+
 
 class Delay:
     '''
@@ -14,12 +19,25 @@ class Delay:
         self.duration = duration
         self.label = label
 
-    def waveform_generation(self, samp_freq, start_index, iteration):
+    def waveform_generation(self, samp_freq, start_index, iteration, dtype = np.float64):
         _d = len(self.duration)
         if _d == 2:
-            return np.zeros(int(samp_freq*(self.duration[0]+iteration*self.duration[1])))
+            return np.zeros(int(samp_freq*(self.duration[0]+iteration*self.duration[1])), dtype = dtype)
         elif _d == 1:
-            return np.zeros(int(samp_freq*self.duration[0]))
+            return np.zeros(int(samp_freq*self.duration[0]), dtype = dtype)
+
+    def write_waveform(self, out, samp_freq, start_index, iteration):
+        '''
+        write the waveform into out, a slice of nop() points of a bigger buffer
+        '''
+        out.fill(0)
+
+    def write_span(self, out, samp_freq, start_index, iteration, first):
+        '''
+        write points first to first+len(out) of the waveform into out, the
+        item starts at sample start_index of the sequence
+        '''
+        out.fill(0)
 
     def nop(self, samp_freq, iteration):
         _d = len(self.duration)
@@ -28,54 +46,312 @@ class Delay:
         elif _d == 1:
             return int(samp_freq*self.duration[0])
 
+    def nop_array(self, samp_freq, iterations):
+        '''
+        nop for an array of iterations at once
+        '''
+        _d = len(self.duration)
+        iterations = np.asarray(iterations)
+        if _d == 2:
+            return (samp_freq*(self.duration[0]+iterations*self.duration[1])).astype(int)
+        elif _d == 1:
+            return np.full(iterations.shape, int(samp_freq*self.duration[0]))
+
+    def write_batch(self, out, samp_freq, start_indices, lengths, iterations):
+        '''
+        write the waveforms of several iterations into the rows of the 2d array
+        out, row i starts at start_indices[i] and holds lengths[i] points
+        the span of every row is zeroed, so out may be a reused buffer
+        '''
+        for _row, (_start, _n) in enumerate(zip(start_indices, lengths)):
+            out[_row, _start:_start+_n] = 0
+
 
 class Pulse(Delay):
     '''
     a pulse class simulates the pulse in the pulse sequence
     the waveform_generation method returns a 1d np array with specified properties
     iteration index is assumed to start with 0
+    shape is a Shape or a spec like 'gauss:3', see envelopes.py
+    phase_key is the name of the phase constant, for the phase cycling of Loop
     '''
     def __init__(self, duration, label, frequency,
-                power, phase, shape = 'square'):
+                power, phase, shape = 'square', phase_key = None):
         super().__init__(duration,label)
         self.frequency = frequency
         self.power = power
         self.phase = phase
+        self.phase_key = phase_key
+        if isinstance(shape, str):
+            shape = parse_shape(shape)
+        self.shape = shape
+
+    def waveform_generation(self, samp_freq, start_index, iteration, dtype = np.float64):
+        _wave = np.empty(self.nop(samp_freq, iteration), dtype = dtype)
+        self.write_waveform(_wave, samp_freq, start_index, iteration)
+        return _wave
+
+    def write_waveform(self, out, samp_freq, start_index, iteration):
+        '''
+        write the waveform into out, a slice of nop() points of a bigger buffer,
+        sample n of the buffer is at exactly n/samp_freq (see oscillator)
+        '''
+        synthesize(out, self.frequency[iteration % len(self.frequency)],
+                   self.phase[iteration % len(self.phase)],
+                   self.power[iteration % len(self.power)], samp_freq, start_index,
+                   *self.shaped_waveform(len(out), samp_freq))
+
+    def write_span(self, out, samp_freq, start_index, iteration, first):
+        '''
+        only the points of the span are synthesized, with the matching part
+        of the envelope of a shaped pulse
+        '''
+        envelope, phase_offset = self.shaped_waveform(self.nop(samp_freq, iteration), samp_freq)
+        stop = first + len(out)
+        synthesize(out, self.frequency[iteration % len(self.frequency)],
+                   self.phase[iteration % len(self.phase)],
+                   self.power[iteration % len(self.power)], samp_freq, start_index + first,
+                   None if envelope is None else envelope[first:stop],
+                   None if phase_offset is None else phase_offset[first:stop])
+
+    def write_batch(self, out, samp_freq, start_indices, lengths, iterations):
+        '''
+        write_waveform over the rows of out, iterations which end up with the
+        same position and parameters are synthesized once and copied
+        '''
+        _f = np.asarray(iterations) % len(self.frequency)
+        _ph = np.asarray(iterations) % len(self.phase)
+        _pw = np.asarray(iterations) % len(self.power)
+        keys = np.stack((start_indices, lengths, _f, _ph, _pw), axis = 1)
+        unique_keys, first_rows, inverse = np.unique(keys, axis = 0,
+                                                     return_index = True, return_inverse = True)
+        for _u, (_start, _n, _fi, _phi, _pwi) in enumerate(unique_keys):
+            _row = first_rows[_u]
+            synthesize(out[_row, _start:_start+_n], self.frequency[_fi], self.phase[_phi],
+                       self.power[_pwi], samp_freq, _start, *self.shaped_waveform(_n, samp_freq))
+            _same = np.nonzero(inverse.ravel() == _u)[0]
+            out[_same, _start:_start+_n] = out[_row, _start:_start+_n]
+
+    def write_repeated(self, out, samp_freq, start_index, iteration, offsets, cycle = None):
+        '''
+        write a copy of the pulse at every offset of out, sample 0 of out is
+        sample start_index of the sequence, cycle is the index into the
+        phases of every copy (None: the phase of the iteration)
+        the copies only differ by the phase word their accumulator starts
+        with, copies with the same word are synthesized once and copied, with
+        more than two different words the pulse is synthesized at its phase
+        and 90 degrees later and every copy is the rotation
+            w(phase + d) = cos(d)*w(phase) + sin(d)*w(phase + 90)
+        which stays within 2*OSCILLATOR_TOLERANCE*power
+        '''
+        _n = self.nop(samp_freq, iteration)
+        if _n == 0 or len(offsets) == 0:
+            return
+        frequency = self.frequency[iteration % len(self.frequency)]
+        power = self.power[iteration % len(self.power)]
+        if cycle is None:
+            phases = np.full(len(offsets), self.phase[iteration % len(self.phase)])
+        else:
+            phases = np.asarray(self.phase)[cycle % len(self.phase)]
+        '''
+        the same start word as synthesize computes for every copy
+        '''
+        unique_phases, phase_index = np.unique(phases, return_inverse = True)
+        phase_start = np.array([phase_word(_ph/360) for _ph in unique_phases], dtype = np.uint64)
+        words = (start_index + offsets).astype(np.uint64)*np.uint64(phase_word(frequency/samp_freq))
+        words += phase_start[phase_index.ravel()]
+        unique_words, first, inverse = np.unique(words, return_index = True, return_inverse = True)
+        envelope, phase_offset = self.shaped_waveform(_n, samp_freq)
+        index = np.arange(_n)
+        rows = max(1, BLOCK_SIZE//_n)
+        if len(unique_words) <= 2:
+            segment = np.empty(_n, dtype = out.dtype)
+            for _u, _first in enumerate(first):
+                synthesize(segment, frequency, phases[_first], power, samp_freq,
+                           start_index + offsets[_first], envelope, phase_offset)
+                _starts = offsets[inverse.ravel() == _u]
+                for _r in range(0, len(_starts), rows):
+                    out[_starts[_r:_r+rows, None] + index] = segment
+            return
+        base = np.empty((2, _n))
+        for _row, _shift in enumerate((0, 90)):
+            synthesize(base[_row], frequency, phases[0] + _shift, power, samp_freq,
+                       start_index + offsets[0], envelope, phase_offset)
+        angle = (words - words[0]).astype(np.float64)*(2*pi/2.0**64)
+        rotation = np.stack((np.cos(angle), np.sin(angle)), axis = 1)
+        for _r in range(0, len(offsets), rows):
+            out[offsets[_r:_r+rows, None] + index] = rotation[_r:_r+rows] @ base
+
+    def shaped_waveform(self, n, samp_freq):
+        '''
+        (envelope, phase offset) of the pulse with n points for synthesize,
+        (None, None) for a square pulse
+        '''
+        if self.shape is None:
+            return None, None
+        return self.shape.envelope(n, samp_freq)
+
+
+class Loop:
+    '''
+    count repetitions of body, a list of Delay, Pulse and Loop items
+    the phase constants named in cycles step through their values with the
+    repetitions of the loop (phase cycling) instead of with the iteration
+    the loop is never expanded: every pulse inside is synthesized once (once
+    per distinct phase) and written to all its repetitions at once, see
+    Pulse.write_repeated, so the cost grows with the number of different
+    segments and not with count
+    '''
+    def __init__(self, count, body, cycles = ()):
+        if count < 1:
+            raise ValueError(f'a loop needs at least one repetition, not {count}')
+        self.count = int(count)
+        self.body = list(body)
+        self.cycles = tuple(cycles)
+
+    def nop(self, samp_freq, iteration):
+        return self.count*sum(item.nop(samp_freq, iteration) for item in self.body)
+
+    def nop_array(self, samp_freq, iterations):
+        iterations = np.asarray(iterations)
+        return self.count*sum((item.nop_array(samp_freq, iterations) for item in self.body),
+                              np.zeros(iterations.shape, dtype = int))
+
+    def occurrences(self, samp_freq, iteration):
+        '''
+        (pulse, offsets, cycle) of every pulse in the loop, the offsets of all
+        its copies from the start of the loop and the repetition of the loop
+        which selects the phase of every copy (None: the phase follows the
+        iteration), a loop inside claims its own cycles first
+        '''
+        lengths = [item.nop(samp_freq, iteration) for item in self.body]
+        period = sum(lengths)
+        starts = np.cumsum([0] + lengths[:-1])
+        repetitions = np.arange(self.count, dtype = np.int64)
+        result = []
+        for item, start in zip(self.body, starts):
+            if isinstance(item, Loop):
+                inner = item.occurrences(samp_freq, iteration)
+            elif isinstance(item, Pulse):
+                inner = [(item, np.zeros(1, dtype = np.int64), None)]
+            else:
+                continue
+            for pulse, offsets, cycle in inner:
+                copies = (start + period*repetitions)[:, None] + offsets[None, :]
+                if cycle is not None:
+                    cycle = np.broadcast_to(cycle, copies.shape).ravel()
+                elif pulse.phase_key in self.cycles:
+                    cycle = np.broadcast_to(repetitions[:, None], copies.shape).ravel()
+                result.append((pulse, copies.ravel(), cycle))
+        return result
+
+    def write_waveform(self, out, samp_freq, start_index, iteration):
+        out.fill(0)
+        for pulse, offsets, cycle in self.occurrences(samp_freq, iteration):
+            pulse.write_repeated(out, samp_freq, start_index, iteration, offsets, cycle)
+
+    def write_span(self, out, samp_freq, start_index, iteration, first):
+        '''
+        only the copies which overlap the span are written, each one whole
+        into a window around the span, so the cost follows the span and not
+        the length of the loop
+        '''
+        out.fill(0)
+        stop = first + len(out)
+        for pulse, offsets, cycle in self.occurrences(samp_freq, iteration):
+            _n = pulse.nop(samp_freq, iteration)
+            keep = (offsets < stop) & (offsets + _n > first)
+            if _n == 0 or not keep.any():
+                continue
+            offsets = offsets[keep]
+            low, high = int(offsets.min()), int(offsets.max()) + _n
+            window = np.zeros(high - low, dtype = out.dtype)
+            pulse.write_repeated(window, samp_freq, start_index + low, iteration, offsets - low,
+                                 None if cycle is None else cycle[keep])
+            _a, _b = max(first, low), min(stop, high)
+            out[_a-first:_b-first] += window[_a-low:_b-low]
+
+    def write_batch(self, out, samp_freq, start_indices, lengths, iterations):
+        '''
+        write_waveform over the rows of out, the rows whose items all have the
+        same position, length and parameters are written once and copied
+        '''
+        iterations = np.asarray(iterations)
+        columns = [start_indices, lengths]
+        for item, _ in walk(self.body):
+            columns.append(item.nop_array(samp_freq, iterations))
+            if isinstance(item, Pulse):
+                columns += [iterations % len(item.frequency), iterations % len(item.phase),
+                            iterations % len(item.power)]
+        unique_keys, first_rows, inverse = np.unique(np.stack(columns, axis = 1), axis = 0,
+                                                     return_index = True, return_inverse = True)
+        for _u, _row in enumerate(first_rows):
+            _start, _n = start_indices[_row], lengths[_row]
+            self.write_waveform(out[_row, _start:_start+_n], samp_freq, _start, iterations[_row])
+            _same = np.nonzero(inverse.ravel() == _u)[0]
+            out[_same, _start:_start+_n] = out[_row, _start:_start+_n]
+
+
+def walk(pulse_sequence, loops = ()):
+    '''
+    yield (item, loops) for every Delay and Pulse in order, loops are the
+    Loop items around it, outermost first
+    '''
+    for item in pulse_sequence:
+        if isinstance(item, Loop):
+            yield from walk(item.body, loops + (item,))
+        else:
+            yield item, loops
 
-    def waveform_generation(self, samp_freq, start_index, iteration):
-        _d = len(self.duration)
-        _start_time = start_index/samp_freq
-        if _d == 2:
-            _data_points = int( (self.duration[0]+iteration*self.duration[1]) * samp_freq )
-            _time_axis = np.linspace(_start_time, _start_time + (self.duration[0]+iteration*self.duration[1]), _data_points)
-        if _d == 1:
-            _data_points = int( self.duration[0] * samp_freq )
-            _time_axis = np.linspace(_start_time, _start_time + self.duration[0], _data_points)
-        _pw = len(self.power)
-        _f = len(self.frequency)
-        _ph = len(self.phase)
-        return self.power[iteration % _pw] * np.cos( 2 * pi * self.frequency[iteration % _f] * _time_axis + self.phase[iteration % _ph] / 180 * pi)
 
-    def shaped_waveform(self,waveform,samp_freq):
-        pass
+def repeat_loops(pulse_sequence, repeat_num, repeat_pos):
+    '''
+    the items between every pair (start, stop) of repeat_pos become a Loop of
+    repeat_num repetitions, start and stop count the items of the top level,
+    a pair inside another one is a nested loop
+    '''
+    spans = sorted(zip(repeat_pos, repeat_num), key = lambda span: (span[0][0], -span[0][1]))
+    return nest_spans(list(pulse_sequence), 0, spans)
 
 
-def pulse_repeat(pulse_sequence, repeat_num, repeat_pos):
+def nest_spans(items, offset, spans):
     '''
-    repeat the part in the pulse sequence that needs to be repeated
+    items are the items offset, offset+1, ... of the top level, spans the
+    sorted ((start, stop), num) within them
     '''
-    new_sequence = pulse_sequence
-    pos_adj = 0
-    for num,pos in zip(repeat_num,repeat_pos):
-        new_sequence[pos[1]+pos_adj:pos[1]+pos_adj] = pulse_sequence[ pos[0] : pos[1] ]*(num-1)
-        pos_adj += (pos[1]-pos[0])*(num-1)
-    return new_sequence
+    nested = []
+    index = offset
+    position = 0
+    while position < len(spans):
+        (start, stop), num = spans[position]
+        end = position + 1
+        while end < len(spans) and spans[end][0][0] < stop:
+            if spans[end][0][1] > stop:
+                raise ValueError(f'repeat_pos {spans[end][0]} overlaps {(start, stop)}')
+            end += 1
+        nested += items[index-offset:start-offset]
+        nested.append(Loop(num, nest_spans(items[start-offset:stop-offset], start,
+                                           spans[position+1:end])))
+        index = stop
+        position = end
+    return nested + items[index-offset:]
 
 
-def convert_configuraton(config_str, const_dict):
+def loop_count(word, const_dict):
+    '''
+    the count of a loop line, a number or the name of a constant
+    '''
+    if word in const_dict:
+        return int(const_dict[word][0])
+    return int(word)
+
+
+def convert_configuraton(config_str, const_dict, shapes = None, folder = ''):
     '''
     convert the configuration part of the pulse, only do one thing, that is
     convert each line into a pulse sequence without considering the repeat
+    a pulse line may end with a shape (see envelopes.py), the pulses with the
+    same shape spec share one Shape through the shapes dictionary
     '''
 
     seperated_str = config_str.split(' ')
@@ -88,7 +364,15 @@ def convert_configuraton(config_str, const_dict):
         phase = seperated_str[4]
         power = seperated_str[3]
         freq = seperated_str[2]
-        return Pulse(duration, label, const_dict[freq], const_dict[power], const_dict[phase])
+        shape = None
+        if len(seperated_str) > 5:
+            if shapes is None:
+                shapes = {}
+            if seperated_str[5] not in shapes:
+                shapes[seperated_str[5]] = parse_shape(seperated_str[5], folder)
+            shape = shapes[seperated_str[5]]
+        return Pulse(duration, label, const_dict[freq], const_dict[power], const_dict[phase], shape,
+                     phase_key = phase)
 
 
 def dict_create(line):
@@ -102,16 +386,19 @@ def dict_create(line):
     return {dict_key:dict_val}
 
 
-def pulse_interpreter(file_path, samp_freq, iteration):
+def parse_pulse_file(file_path):
     '''
-    interpret the pulse file into np array
+    read the pulse file, return the constant dictionary and the pulse sequence,
+    the lines between 'loop count [phase constants]' and 'end' and the
+    repeat_pos/repeat_num parts become Loop items
     '''
 
     with open(file_path,'r') as fl:
         constant_part = False
         configuration_part = False
-        pulse_sequence = []
+        loops = [([], None)] # (items, (count, cycles)) of the open loops
         const_dict = {}
+        shapes = {}
         for line in fl:
             _line = line.strip()
             if line[0] == '#' or _line == '':
@@ -130,19 +417,173 @@ def pulse_interpreter(file_path, samp_freq, iteration):
                 const_dict.update(dict_create(_line))
 
             elif configuration_part:
-                if len(_line.split(' ')) > 1:
-                    pulse_sequence.append(convert_configuraton( _line, const_dict))
+                _words = _line.split(' ')
+                if _words[0] == 'loop':
+                    loops.append(([], (loop_count(_words[1], const_dict), _words[2:])))
+                elif _words[0] == 'end':
+                    if len(loops) == 1:
+                        raise ValueError(f'{file_path}: end without a loop')
+                    body, (count, cycles) = loops.pop()
+                    loops[-1][0].append(Loop(count, body, cycles))
+                elif len(_words) > 1:
+                    loops[-1][0].append(convert_configuraton( _line, const_dict, shapes,
+                                                             os.path.dirname(file_path)))
+    if len(loops) > 1:
+        raise ValueError(f'{file_path}: loop without an end')
+    pulse_sequence = loops[0][0]
 
     repeat_num = const_dict['repeat_num']
     repeat_pos = const_dict['repeat_pos']
     if repeat_num[0] > 1 and repeat_pos[0] != (0,0) and len(repeat_num) == len(repeat_pos):
-            pulse_sequence = pulse_repeat(pulse_sequence, repeat_num, repeat_pos)
+            pulse_sequence = repeat_loops(pulse_sequence, repeat_num, repeat_pos)
+    return const_dict, pulse_sequence
 
-    current_index = 0
-    final_pulse = np.array([])
 
-    for item in pulse_sequence:
-        current_wave = item.waveform_generation(samp_freq, current_index,iteration)
-        current_index += item.nop(samp_freq,iteration)
-        final_pulse = np.concatenate((final_pulse,current_wave),axis = 0)
-    return final_pulse
+class PulseProgram:
+    '''
+    a compiled pulse file, the file is parsed only once
+    the waveform of any iteration is written segment by segment into a single
+    preallocated buffer, instead of concatenating the segments one by one
+    pulse_sequence holds the items of the top level, loops stay Loop items
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.const_dict, self.pulse_sequence = parse_pulse_file(file_path)
+
+    @property
+    def table_files(self):
+        '''
+        the shape tables the waveforms depend on
+        '''
+        return sorted({item.shape.file_path for item, _ in walk(self.pulse_sequence)
+                       if isinstance(item, Pulse) and item.shape is not None
+                       and item.shape.file_path is not None})
+
+    def segment_lengths(self, samp_freq, iteration):
+        '''
+        number of points of every segment in the given iteration
+        '''
+        return np.array([item.nop(samp_freq, iteration) for item in self.pulse_sequence], dtype = int)
+
+    def nop(self, samp_freq, iteration):
+        return int(self.segment_lengths(samp_freq, iteration).sum())
+
+    def waveform(self, samp_freq, iteration, out = None, dtype = np.float64):
+        '''
+        generate the waveform of the iteration, if out is given it has to hold
+        at least nop() points, the points after the sequence are left untouched
+        dtype is float64 or float32
+        '''
+        lengths = self.segment_lengths(samp_freq, iteration)
+        total = int(lengths.sum())
+        if out is None:
+            out = np.empty(total, dtype = dtype)
+        current_index = 0
+        for item, _n in zip(self.pulse_sequence, lengths):
+            item.write_waveform(out[current_index:current_index+_n], samp_freq,
+                                current_index, iteration)
+            current_index += _n
+        return out[:total]
+
+    def span(self, samp_freq, iteration, start, stop, dtype = np.float64):
+        '''
+        points start to stop of the waveform of the iteration, synthesized
+        without the rest of the waveform, clipped to the sequence
+        '''
+        lengths = self.segment_lengths(samp_freq, iteration)
+        ends = np.cumsum(lengths)
+        start, stop = max(int(start), 0), min(int(stop), int(ends[-1]) if len(ends) else 0)
+        out = np.zeros(max(stop - start, 0), dtype = dtype)
+        for item, _end, _n in zip(self.pulse_sequence, ends, lengths):
+            _begin = _end - _n
+            if _end <= start or _begin >= stop:
+                continue
+            _a, _b = max(_begin, start), min(_end, stop)
+            item.write_span(out[_a-start:_b-start], samp_freq, _begin, iteration, _a - _begin)
+        return out
+
+    def reference(self, iteration):
+        '''
+        (frequency, phase) of the first pulse in the iteration, the reference
+        of the lock-in, the first phase of a pulse with a cycled phase
+        '''
+        for item, loops in walk(self.pulse_sequence):
+            if isinstance(item, Pulse):
+                cycled = any(item.phase_key in loop.cycles for loop in loops)
+                return (item.frequency[iteration % len(item.frequency)],
+                        item.phase[0 if cycled else iteration % len(item.phase)])
+        raise ValueError(f'{self.file_path} has no pulse to take the reference from')
+
+    def array_axis(self, iterations):
+        '''
+        (name, durations) of the first item whose duration grows with the
+        iteration (e.g. the pulse of a nutation curve), name is like
+        'pulse 0 (s)', ('iteration', iterations) without such an item
+        '''
+        iterations = np.asarray(iterations, dtype = int)
+        for item, _ in walk(self.pulse_sequence):
+            if len(item.duration) == 2 and item.duration[1] != 0:
+                kind = 'pulse' if isinstance(item, Pulse) else 'delay'
+                return f'{kind} {item.label} (s)', item.duration[0] + iterations*item.duration[1]
+        return 'iteration', iterations.astype(float)
+
+    def segment_table(self, samp_freq, iterations):
+        '''
+        number of points of every segment (columns) for every iteration (rows)
+        '''
+        iterations = np.asarray(iterations, dtype = int)
+        return np.stack([item.nop_array(samp_freq, iterations) for item in self.pulse_sequence], axis = 1)
+
+    def waveforms(self, samp_freq, iterations, width = None, dtype = np.float64):
+        '''
+        generate the waveforms of all given iterations in one pass, segment by
+        segment across the iterations, returns a WaveformBatch
+        '''
+        iterations = np.atleast_1d(np.asarray(iterations, dtype = int))
+        table = self.segment_table(samp_freq, iterations)
+        ends = np.cumsum(table, axis = 1)
+        lengths = ends[:,-1]
+        if width is None:
+            width = int(np.max(lengths, initial = 0))
+        elif width < np.max(lengths, initial = 0):
+            raise ValueError(f'width {width} is shorter than the longest iteration ({np.max(lengths)} points)')
+        data = np.zeros((len(iterations), width), dtype = dtype)
+        for column, item in enumerate(self.pulse_sequence):
+            item.write_batch(data, samp_freq, ends[:,column] - table[:,column],
+                             table[:,column], iterations)
+        return WaveformBatch(data, lengths, iterations)
+
+    def iter_waveforms(self, samp_freq, iterations, width, dtype = np.float64):
+        '''
+        lazy version of waveforms, yields one zero padded waveform of width
+        points per iteration
+        '''
+        for iteration in iterations:
+            out = np.zeros(width, dtype = dtype)
+            self.waveform(samp_freq, iteration, out)
+            yield out
+
+
+class WaveformBatch:
+    '''
+    waveforms of several iterations, data is a 2d array (iteration, point)
+    padded with zeros to a common width, lengths[i] is the number of points
+    of the sequence in row i
+    '''
+    def __init__(self, data, lengths, iterations):
+        self.data = data
+        self.lengths = lengths
+        self.iterations = iterations
+
+    def __len__(self):
+        return len(self.data)
+
+    def waveform(self, index):
+        return self.data[index, :self.lengths[index]]
+
+
+def pulse_interpreter(file_path, samp_freq, iteration):
+    '''
+    interpret the pulse file into np array
+    '''
+    return PulseProgram(file_path).waveform(samp_freq, iteration)
@@ -0,0 +1,189 @@
+'''
+spectra in worker processes, outside of the gil of the gui and acquisition
+the workers are started once, every worker owns one slot of an input and an
+output shared memory block: a snapshot is copied into the input slot of a
+free worker, the worker writes the spectra into its output slot and only
+(worker, sequence number, reductions) goes back through the result queue,
+the arrays are never pickled
+
+the reductions are the frequency and height of the highest peak of every row
+
+the worker processes import only numpy and spectrum.py
+'''
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+
+import numpy as np
+
+from spectrum import SpectrumEngine
+
+PROCESSING_MODES = ('thread', 'process')
+
+
+def engine_settings(engine):
+    return {'samp_rate': engine.samp_rate, 'window': engine.window, 'band': engine.band,
+            'zoom_points': engine.zoom_points, 'center': engine.center}
+
+
+def reduce_spectra(axis, spectra):
+    '''
+    (frequency, height) of the highest peak of every row
+    '''
+    magnitude = np.abs(spectra)
+    peak = magnitude.argmax(axis = 1)
+    return [(float(axis[index]), float(magnitude[row, index])) for row, index in enumerate(peak)]
+
+
+def worker_main(index, tasks, results):
+    '''
+    the blocks belong to the parent, which alone unlinks them
+    '''
+    blocks = []
+    engine = None
+    data = out = None
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+        kind = message[0]
+        if kind == 'buffers':
+            _, in_name, out_name, workers, shape, dtype, out_shape = message
+            data = out = None
+            for block in blocks:
+                block.close()
+            blocks = [shared_memory.SharedMemory(name = in_name),
+                      shared_memory.SharedMemory(name = out_name)]
+            data = np.ndarray((workers,) + shape, dtype = dtype, buffer = blocks[0].buf)[index]
+            out = np.ndarray((workers,) + out_shape, dtype = complex, buffer = blocks[1].buf)[index]
+        elif kind == 'engine':
+            engine = SpectrumEngine(**message[1])
+        elif kind == 'spectrum':
+            '''
+            a failed spectrum still frees the worker, with None reductions
+            '''
+            try:
+                axis, spectra = engine.spectrum(data)
+                out[:] = spectra
+                results.put((index, message[1], reduce_spectra(axis, spectra)))
+            except Exception:
+                results.put((index, message[1], None))
+    del data, out
+    for block in blocks:
+        block.close()
+
+
+class SpectrumProcessPool:
+    '''
+    workers: number of worker processes, also the number of snapshots which
+    can be in flight at once
+    configure() has to be called with the SpectrumEngine and the shape of the
+    snapshots before the first submit()
+    '''
+    def __init__(self, workers = 2):
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.tasks = [context.Queue() for _ in range(workers)]
+        self.processes = [context.Process(target = worker_main, args = (index, self.tasks[index], self.results),
+                                          daemon = True, name = f'spectrum_worker_{index}')
+                          for index in range(workers)]
+        for process in self.processes:
+            process.start()
+        self.free = list(range(workers))
+        self.blocks = []
+        self.data = self.out = None
+        self.shape = None
+        self.dtype = None
+        self.axis = None
+        self.sequence = 0
+
+    def configure(self, engine, shape, dtype):
+        '''
+        the settings of engine go to every worker, with new shared buffers
+        when the shape of the snapshots or of the spectra changes, the
+        snapshots in flight are finished first
+        '''
+        self.wait_idle()
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        axis, spectra = engine.spectrum(np.zeros(shape, dtype = dtype))
+        self.axis = axis
+        workers = len(self.processes)
+        if self.out is None or shape != self.shape or dtype != self.dtype \
+                or spectra.shape != self.out.shape[1:]:
+            self.release()
+            self.blocks = [shared_memory.SharedMemory(create = True, size = workers*int(np.prod(shape))*dtype.itemsize),
+                           shared_memory.SharedMemory(create = True, size = workers*spectra.size*16)]
+            self.data = np.ndarray((workers,) + shape, dtype = dtype, buffer = self.blocks[0].buf)
+            self.out = np.ndarray((workers,) + spectra.shape, dtype = complex, buffer = self.blocks[1].buf)
+            self.shape, self.dtype = shape, dtype
+            for tasks in self.tasks:
+                tasks.put(('buffers', self.blocks[0].name, self.blocks[1].name, workers,
+                           shape, dtype.str, spectra.shape))
+        for tasks in self.tasks:
+            tasks.put(('engine', engine_settings(engine)))
+
+    def set_engine(self, engine):
+        '''
+        pass changed settings (e.g. the zoom band) on to the workers
+        '''
+        if self.shape is not None:
+            self.configure(engine, self.shape, self.dtype)
+
+    def submit(self, data):
+        '''
+        False if every worker is busy
+        '''
+        if not self.free or data.shape != self.shape:
+            return False
+        index = self.free.pop()
+        self.data[index] = data
+        self.sequence += 1
+        self.tasks[index].put(('spectrum', self.sequence))
+        return True
+
+    def poll(self, timeout = None):
+        '''
+        (axis, spectra, reductions) of every finished snapshot, oldest first,
+        waits up to timeout seconds for the first one (None: do not wait)
+        '''
+        finished = []
+        while True:
+            try:
+                if timeout is None or finished:
+                    index, sequence, reductions = self.results.get_nowait()
+                else:
+                    index, sequence, reductions = self.results.get(timeout = timeout)
+            except queue.Empty:
+                break
+            if reductions is not None:
+                finished.append((sequence, self.axis, self.out[index].copy(), reductions))
+            self.free.append(index)
+        finished.sort(key = lambda item: item[0])
+        return [item[1:] for item in finished]
+
+    def busy(self):
+        return len(self.free) < len(self.processes)
+
+    def wait_idle(self):
+        while self.busy():
+            self.poll(timeout = 1.0)
+
+    def release(self):
+        self.data = self.out = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def close(self):
+        '''
+        spectra still in flight are dropped
+        '''
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout = 5)
+            if process.is_alive():
+                process.terminate()
+        self.release()
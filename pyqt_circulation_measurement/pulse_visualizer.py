@@ -14,9 +14,15 @@ import sys
 import os
 import ntpath
 
-from nmr_pulses import pulse_interpreter
+from nmr_pulses import PulseProgram
+from waveform_cache import WaveformCache
+from waveform_pyramid import MinMaxPyramid
 
 BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+CACHE_FOLDER = BASE_FOLDER + r'\pyqt_circulation_measurement\waveform_cache'
+SAMP_RATE = 1000000
+# ms, zooming and panning redraw at most once per interval
+RENDER_INTERVAL = 33
 
 
 '''
@@ -50,7 +56,8 @@ class MainWindow(QMainWindow):
 
 
         self.canvas = FigureCanvas(Figure(figsize=(25, 15)))
-        self.addToolBar(NavigationToolbar(self.canvas, self))
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        self.addToolBar(self.toolbar)
 
 
         self.ax = self.canvas.figure.add_subplot(111)
@@ -59,6 +66,20 @@ class MainWindow(QMainWindow):
         elif app.desktop().screenGeometry().height() == 1080:
             self.ax.tick_params(pad=10)
 
+        '''
+        one line shows the visible span of the waveform, taken from the min/max
+        pyramid (see waveform_pyramid.py) whenever the x limits or the size of
+        the axis change
+        '''
+        self.pyramid = None
+        self.line, = self.ax.plot([], [])
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(RENDER_INTERVAL)
+        self.render_timer.timeout.connect(self.render_view)
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.render_timer.start())
+        self.canvas.mpl_connect('resize_event', lambda event: self.render_timer.start())
+
         '''
         --------------------------setting widgets-------------------------------
         '''
@@ -74,6 +95,8 @@ class MainWindow(QMainWindow):
         exitProgram.triggered.connect(self.exit_program)
         fileMenu.addAction(exitProgram)
 
+        self.waveform_cache = WaveformCache(cache_folder = CACHE_FOLDER)
+
         self.file_name = 'simple_sequence.txt'
         self.file_name_label = QLabel(self.file_name)
 
@@ -133,13 +156,29 @@ class MainWindow(QMainWindow):
         '''
         redraw the pulse specified with self.file_path
         '''
-        samp_rate = 1000000
-        pulse_data = pulse_interpreter(self.file_path, samp_rate, 1)
-        time_data = np.linspace(0,len(pulse_data)/samp_rate,len(pulse_data))
-
-        self.ax.clear()
-        self.ax.plot(time_data,pulse_data)
-        self.canvas.draw()
+        self.pyramid = MinMaxPyramid(PulseProgram(self.file_path), SAMP_RATE, 1, self.waveform_cache)
+        low, high = self.pyramid.limits()
+        margin = 0.05*(high - low) or 1
+        self.ax.set_ylim(low - margin, high + margin)
+        self.ax.set_xlim(0, self.pyramid.duration() or 1/SAMP_RATE)
+        self.toolbar.update()
+        self.render_view()
+
+    def render_view(self):
+        '''
+        draw the visible span with about one bin per pixel
+        '''
+        if self.pyramid is None:
+            return
+        t_start, t_stop = self.ax.get_xlim()
+        time_data, pulse_data, level = self.pyramid.view(t_start, t_stop, self.ax.bbox.width)
+        self.line.set_data(time_data, pulse_data)
+        if level < 0:
+            self.statusBar().showMessage(f'{len(pulse_data)} samples at {SAMP_RATE/1e6:g} MS/s')
+        else:
+            self.statusBar().showMessage(f'{len(pulse_data)//2} bins of '
+                                         f'{self.pyramid.bin_size(level)} samples (level {level})')
+        self.canvas.draw_idle()
 
 '''
 ################################################################################
@@ -0,0 +1,129 @@
+'''
+one number per channel and iteration, computed while the run goes on
+the final snapshot of every iteration goes through the reducers right after the
+DatasetWriter stored it, the results land in a small array next to the dataset,
+so a nutation or pulse length curve never needs the raw data again:
+    peak        integral of the magnitude spectrum over freq_cursor
+    amplitude   amplitude of the signal inside time_cursor, sqrt(2) times the
+                rms around the mean for real data, the real part of the mean
+                for the complex baseband of the lock-in (signed, so that a
+                nutation curve goes through zero)
+file_name_reduced.npy:  array (iteration, reducer, channel), nan until reduced
+file_name_reduced.json: header with the reducers, their settings, the axis of
+                        the curve (e.g. the length of the arrayed pulse) and
+                        the number of averages of every reduced iteration
+'''
+import numpy as np
+
+from dataset import CHANNELS, write_header, read_header
+from spectrum import SpectrumEngine
+
+
+class SpectralPeak:
+    '''
+    band: (f_start, f_stop) in Hz, computed with points points of a chirp z
+    transform, centers: the reference frequency of every iteration for the
+    complex baseband of the lock-in
+    '''
+    name = 'peak'
+
+    def __init__(self, samp_rate, band, points = 256, window = 'rect', centers = None):
+        self.band = sorted(band)
+        self.centers = centers
+        self.engine = SpectrumEngine(samp_rate, window, self.band, points)
+
+    def settings(self):
+        return {'band': self.band, 'points': self.engine.zoom_points, 'window': self.engine.window}
+
+    def __call__(self, iteration, rows):
+        if self.centers is not None:
+            self.engine.center = self.centers[iteration]
+        axis, spectra = self.engine.spectrum(rows)
+        return np.abs(spectra).mean(axis = 1)*(axis[-1] - axis[0])
+
+
+class TimeAmplitude:
+    '''
+    time_axis of the snapshots, window: (t_start, t_stop) in s
+    '''
+    name = 'amplitude'
+
+    def __init__(self, time_axis, window):
+        self.window = sorted(window)
+        start, stop = np.searchsorted(time_axis, self.window)
+        self.index = slice(start, max(stop, start + 1))
+
+    def settings(self):
+        return {'window': self.window}
+
+    def __call__(self, iteration, rows):
+        rows = rows[:, self.index]
+        if np.iscomplexobj(rows):
+            return rows.mean(axis = 1).real
+        return np.sqrt(2)*rows.std(axis = 1)
+
+
+REDUCERS = {'peak': SpectralPeak, 'amplitude': TimeAmplitude}
+
+
+def parse_reducers(spec):
+    '''
+    names of a comma separated spec like 'peak,amplitude', [] for 'off'
+    '''
+    if spec.strip() in ('', 'off'):
+        return []
+    names = [name.strip() for name in spec.split(',')]
+    for name in names:
+        if name not in REDUCERS:
+            raise ValueError(f'unknown reducer {name}, use some of {list(REDUCERS)}')
+    return names
+
+
+class ReductionStage:
+    '''
+    reducers: list of reducers (SpectralPeak, TimeAmplitude, or any callable
+    with a name and settings() returning one value per row of a snapshot)
+    axis: (name, values) of the curve, one value per iteration
+    '''
+    def __init__(self, file_name, reducers, axis, channels = CHANNELS):
+        self.file_name = file_name + '_reduced'
+        self.reducers = reducers
+        axis_name, axis_values = axis
+        iterations = len(axis_values)
+        self.values = np.lib.format.open_memmap(self.file_name + '.npy', mode = 'w+', dtype = np.float64,
+                                                shape = (iterations, len(reducers), len(channels)))
+        self.values.fill(np.nan)
+        self.header = {'reducers': [reducer.name for reducer in reducers],
+                       'settings': [reducer.settings() for reducer in reducers],
+                       'channels': list(channels),
+                       'axis_name': axis_name,
+                       'axis': [float(val) for val in axis_values],
+                       'averages': [0]*iterations}
+        write_header(self.file_name, self.header)
+        self.count = 0 # number of reduced snapshots, the gui redraws when it changes
+
+    def add(self, iteration, rows, averages):
+        for index, reducer in enumerate(self.reducers):
+            self.values[iteration, index] = reducer(iteration, rows)
+        self.header['averages'][iteration] = averages
+        self.values.flush()
+        write_header(self.file_name, self.header)
+        self.count += 1
+
+    def curve(self, name, channel):
+        '''
+        (axis, values) of one reducer and channel, nan where not reduced yet
+        '''
+        return (np.array(self.header['axis']),
+                self.values[:, self.header['reducers'].index(name), self.header['channels'].index(channel)])
+
+    def close(self):
+        self.values.flush()
+
+
+def open_reduction(file_name):
+    '''
+    (header, values) of the reduced curves of the dataset file_name
+    '''
+    return (read_header(file_name + '_reduced'),
+            np.load(file_name + '_reduced.npy', mmap_mode = 'r'))
@@ -0,0 +1,374 @@
+'''
+offline replay of saved runs through the processing of the live display, with
+other cursors, windows or spectrum settings, without the daq:
+
+    python replay.py data/run1 data/run2 --freq-cursor 31150 31250
+    python replay.py --folder data/0802 --workers 4 --window hann --plot
+
+a run is the file name of its dataset without extension (see dataset.py), the
+settings are the parameters stored with the run, overridden by the options
+the dataset is memory mapped (the compressed chunks of a RawDataset are read
+one at a time), a reader thread reads the next iterations in order while the
+current one is processed, so a run is read once, sequentially, and never as a
+whole; every result is written per iteration into a preallocated file:
+    file_name_replay_reduced.npy/.json  the curves of the reducers, see
+                                        reducers.py, plotted against the axis
+                                        of the live reduction if there is one
+    file_name_replay_spectrum.npy/.json magnitude spectra (iteration, channel,
+                                        frequency), only with --spectra, the
+                                        json holds the frequency axis as f0, df
+    file_name_replay.png                the last iteration and the curves as
+                                        drawn by LivePlotter, only with --plot
+several runs are replayed in parallel worker processes, which import numpy,
+the modules of the processing and, for --plot, matplotlib (Agg)
+'''
+import argparse
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from dataset import open_dataset, read_header, write_header
+from spectrum import SpectrumEngine
+from reducers import ReductionStage, SpectralPeak, TimeAmplitude, parse_reducers
+
+# iterations read ahead of the one being processed
+PREFETCH = 2
+# the settings a replay takes from the parameters of the run
+SETTINGS = ('freq_cursor', 'time_cursor', 'freq_x_limit', 'time_x_limit', 'spectrum_window',
+            'spectrum_zoom', 'spectrum_points', 'reducers', 'reducer_points')
+
+
+def find_runs(folder):
+    '''
+    file names of the datasets in folder, every json header with a time base
+    '''
+    runs = []
+    for header_file in sorted(glob.glob(os.path.join(folder, '*.json'))):
+        file_name = header_file[:-len('.json')]
+        try:
+            header = read_header(file_name)
+        except (OSError, ValueError):
+            continue
+        if isinstance(header, dict) and 'dt' in header and 'averages' in header:
+            runs.append(file_name)
+    return runs
+
+
+def replay_settings(header, overrides = None):
+    '''
+    the settings of SETTINGS of the run, with overrides (key: value as in
+    parameter.txt) applied
+    '''
+    parameters = header.get('parameters', {})
+    defaults = {'freq_cursor': ['0', '0'], 'time_cursor': ['0', '0'], 'spectrum_window': 'rect',
+                'spectrum_zoom': 'off', 'spectrum_points': '2048', 'reducers': 'peak,amplitude',
+                'reducer_points': '256'}
+    settings = {key: parameters.get(key, defaults.get(key)) for key in SETTINGS}
+    settings.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return settings
+
+
+def read_ahead(dataset, iterations, prefetch = PREFETCH):
+    '''
+    (iteration, snapshot in volts) of iterations in order, read by a thread
+    prefetch iterations ahead into reused buffers, a buffer is handed back
+    when the next one is requested
+    '''
+    shape = tuple(dataset.header['shape'][1:])
+    dtype = dataset.data.dtype
+    free_buffers = queue.Queue()
+    for _ in range(prefetch + 1):
+        free_buffers.put(np.empty(shape, dtype = dtype))
+    snapshots = queue.Queue()
+    stopped = threading.Event()
+    def read():
+        try:
+            for iteration in iterations:
+                buffer = free_buffers.get()
+                if stopped.is_set():
+                    return
+                buffer[:] = dataset.data[iteration]
+                snapshots.put((iteration, buffer))
+        except Exception as error:
+            snapshots.put(error)
+            return
+        snapshots.put(None)
+    reader = threading.Thread(target = read, daemon = True, name = 'replay_reader')
+    reader.start()
+    try:
+        while True:
+            item = snapshots.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            free_buffers.put(item[1])
+    finally:
+        stopped.set()
+        free_buffers.put(np.empty(shape, dtype = dtype))
+        reader.join()
+
+
+def sequential_access(dataset):
+    '''
+    tell the os that the memory map of a ShotDataset is read front to back
+    '''
+    handle = getattr(dataset.data, '_mmap', None)
+    if handle is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+        handle.madvise(mmap.MADV_SEQUENTIAL)
+
+
+class Replay:
+    '''
+    processing of one saved run with settings (see replay_settings), output is
+    the prefix of the result files (default file_name_replay)
+    '''
+    def __init__(self, file_name, settings, output = None, spectra = False, plot = False):
+        self.file_name = file_name
+        self.dataset = open_dataset(file_name)
+        self.settings = replay_settings(self.dataset.header, settings)
+        self.output = output or file_name + '_replay'
+        self.spectra = spectra
+        self.plot = plot
+        header = self.dataset.header
+        self.samp_rate = 1/header['dt']
+        self.time_axis = self.dataset.time_axis()
+        self.iterations = self.dataset.completed()
+        self.centers = header.get('centers')
+        self.complex = self.dataset.data.dtype.kind == 'c'
+        band = None
+        if self.settings['spectrum_zoom'] == 'on':
+            band = [float(val) for val in self.settings['freq_x_limit']]
+        self.engine = SpectrumEngine(self.samp_rate, self.settings['spectrum_window'], band,
+                                     int(self.settings['spectrum_points']))
+        self.reduction = self.make_reduction()
+        self.spectrum_file = None
+        self.last = None
+
+    def curve_axis(self):
+        '''
+        the axis of the reduction of the live run, the iteration otherwise
+        '''
+        iterations = self.dataset.header['shape'][0]
+        if os.path.exists(self.file_name + '_reduced.json'):
+            header = read_header(self.file_name + '_reduced')
+            if len(header['axis']) == iterations:
+                return header['axis_name'], header['axis']
+        return 'iteration', list(range(iterations))
+
+    def make_reduction(self):
+        names = parse_reducers(self.settings['reducers'])
+        if not names:
+            return None
+        reducers = []
+        for name in names:
+            if name == 'peak':
+                reducers.append(SpectralPeak(self.samp_rate, [float(val) for val in self.settings['freq_cursor']],
+                                             int(self.settings['reducer_points']),
+                                             self.settings['spectrum_window'],
+                                             self.centers if self.complex else None))
+            else:
+                reducers.append(TimeAmplitude(self.time_axis, [float(val) for val in self.settings['time_cursor']]))
+        return ReductionStage(self.output, reducers, self.curve_axis(), self.dataset.header['channels'])
+
+    def open_spectrum_file(self, axis, spectra):
+        shape = (self.dataset.header['shape'][0],) + spectra.shape
+        self.spectrum_file = np.lib.format.open_memmap(self.output + '_spectrum.npy', mode = 'w+',
+                                                       dtype = np.float64, shape = shape)
+        write_header(self.output + '_spectrum',
+                     {'channels': self.dataset.header['channels'],
+                      'f0': float(axis[0]),
+                      'df': float(axis[1] - axis[0]) if len(axis) > 1 else 0.0,
+                      'points': len(axis),
+                      'window': self.engine.window,
+                      'band': self.engine.band,
+                      'iterations': self.iterations,
+                      'settings': self.settings})
+
+    def process(self, iteration, snapshot):
+        if self.reduction is not None:
+            self.reduction.add(iteration, snapshot, self.dataset.header['averages'][iteration])
+        if not (self.spectra or self.plot):
+            return
+        if self.complex and self.centers is not None:
+            self.engine.center = self.centers[iteration]
+        axis, spectra = self.engine.spectrum(snapshot)
+        magnitude = np.abs(spectra)
+        if self.spectra:
+            if self.spectrum_file is None:
+                self.open_spectrum_file(axis, spectra)
+            self.spectrum_file[iteration] = magnitude
+        if self.plot:
+            self.last = (snapshot.copy(), axis, magnitude)
+
+    def run(self):
+        '''
+        process every completed iteration, returns a summary of the replay
+        '''
+        start_time = time.perf_counter()
+        if self.dataset.header.get('format') != 'raw':
+            sequential_access(self.dataset)
+        for iteration, snapshot in read_ahead(self.dataset, self.iterations):
+            self.process(iteration, snapshot)
+        if self.reduction is not None:
+            self.reduction.close()
+        if self.spectrum_file is not None:
+            self.spectrum_file.flush()
+        if self.plot and self.last is not None:
+            self.save_plot()
+        elapsed = time.perf_counter() - start_time
+        size = len(self.iterations)*int(np.prod(self.dataset.header['shape'][1:]))*self.dataset.data.dtype.itemsize
+        summary = {'file_name': self.file_name,
+                   'iterations': len(self.iterations),
+                   'elapsed': elapsed,
+                   'iterations_per_second': len(self.iterations)/elapsed if elapsed else 0.0,
+                   'mb_per_second': size/2**20/elapsed if elapsed else 0.0,
+                   'outputs': self.outputs()}
+        return summary
+
+    def outputs(self):
+        files = []
+        if self.reduction is not None:
+            files.append(self.reduction.file_name + '.npy')
+        if self.spectrum_file is not None:
+            files.append(self.output + '_spectrum.npy')
+        if self.plot and self.last is not None:
+            files.append(self.output + '.png')
+        return files
+
+    def save_plot(self):
+        '''
+        the four axes of the main window and the curves, drawn by LivePlotter
+        with the limits and cursors of the settings
+        '''
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from live_plot import LivePlotter
+        snapshot, axis, magnitude = self.last
+        curves = [] if self.reduction is None else self.reduction.header['reducers']
+        rows = 2 + len(curves)
+        canvas = FigureCanvasAgg(Figure(figsize = (20, 3*rows), dpi = 100))
+        axes = {}
+        for row, channel in enumerate(['nmr', 'nsor']):
+            axes[f'{channel}_time'] = canvas.figure.add_subplot(rows, 2, 2*row + 1)
+            axes[f'{channel}_freq'] = canvas.figure.add_subplot(rows, 2, 2*row + 2)
+        for row, name in enumerate(curves):
+            for column, channel in enumerate(['nmr', 'nsor']):
+                key = f'{channel}_{name}_curve'
+                axes[key] = canvas.figure.add_subplot(rows, 2, 2*(row + 2) + column + 1)
+                axes[key].set_title(f'{channel} {name}')
+        plotter = LivePlotter(canvas, axes, blit = False)
+        plotter.timer.stop()
+        for key in ('time_x_limit', 'freq_x_limit'):
+            if self.settings.get(key):
+                plotter.set_x_limit(key[0:4], [float(val) for val in self.settings[key]])
+        for key in ('time_cursor', 'freq_cursor'):
+            plotter.set_cursor(key[0:4], [float(val) for val in self.settings[key]])
+        channels = self.dataset.header['channels']
+        for channel in ['nmr', 'nsor']:
+            row = channels.index(channel)
+            plotter.update(f'{channel}_time', self.time_axis, snapshot[row].real)
+            plotter.update(f'{channel}_freq', axis, magnitude[row])
+            for name in curves:
+                x, y = self.reduction.curve(name, channel)
+                reduced = ~np.isnan(y)
+                plotter.update(f'{channel}_{name}_curve', x[reduced], y[reduced])
+        plotter.draw_frame()
+        canvas.print_png(self.output + '.png')
+
+
+def replay(file_name, settings = None, output = None, spectra = False, plot = False):
+    return Replay(file_name, settings, output, spectra, plot).run()
+
+
+def replay_task(arguments):
+    '''
+    replay of one run in a worker process, an error is returned instead of
+    ending the batch
+    '''
+    file_name, settings, spectra, plot = arguments
+    try:
+        return replay(file_name, settings, spectra = spectra, plot = plot)
+    except Exception as error:
+        return {'file_name': file_name, 'error': f'{type(error).__name__}: {error}'}
+
+
+def replay_batch(file_names, settings = None, workers = None, spectra = False, plot = False, on_done = None):
+    '''
+    replay every run of file_names in workers processes (one per cpu by
+    default), on_done(summary) is called in the order the runs finish
+    '''
+    workers = min(workers or os.cpu_count() or 1, len(file_names))
+    tasks = [(file_name, settings, spectra, plot) for file_name in file_names]
+    summaries = []
+    if workers <= 1:
+        results = map(replay_task, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        results = pool.imap_unordered(replay_task, tasks)
+    try:
+        for summary in results:
+            summaries.append(summary)
+            if on_done is not None:
+                on_done(summary)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return summaries
+
+
+def format_summary(summary):
+    if 'error' in summary:
+        return f'{summary["file_name"]}: failed, {summary["error"]}'
+    return (f'{summary["file_name"]}: {summary["iterations"]} iterations in {summary["elapsed"]:.2f} s, '
+            f'{summary["mb_per_second"]:.1f} MB/s -> ' + ', '.join(summary['outputs']))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'replay saved runs through the processing of the display')
+    parser.add_argument('runs', nargs = '*', help = 'datasets, file names without extension')
+    parser.add_argument('--folder', help = 'replay every dataset in the folder as well')
+    parser.add_argument('--freq-cursor', nargs = 2, help = 'overrides freq_cursor (Hz)')
+    parser.add_argument('--time-cursor', nargs = 2, help = 'overrides time_cursor (s)')
+    parser.add_argument('--window', help = 'overrides spectrum_window')
+    parser.add_argument('--zoom', nargs = 2, metavar = ('F_START', 'F_STOP'),
+                        help = 'compute the spectra of this band only (spectrum_zoom on)')
+    parser.add_argument('--points', help = 'overrides spectrum_points')
+    parser.add_argument('--reducers', help = 'overrides reducers, e.g. peak,amplitude')
+    parser.add_argument('--reducer-points', help = 'overrides reducer_points')
+    parser.add_argument('--spectra', action = 'store_true', help = 'also write the magnitude spectra')
+    parser.add_argument('--plot', action = 'store_true', help = 'also draw the last iteration and the curves')
+    parser.add_argument('--workers', type = int, help = 'worker processes, default one per cpu')
+    parser.add_argument('--json', action = 'store_true', help = 'print the summaries as json')
+    args = parser.parse_args(argv)
+
+    runs = [run[:-len('.json')] if run.endswith('.json') else run for run in args.runs]
+    if args.folder:
+        runs += [run for run in find_runs(args.folder) if run not in runs]
+    if not runs:
+        parser.error('no datasets to replay')
+    settings = {'freq_cursor': args.freq_cursor, 'time_cursor': args.time_cursor,
+                'spectrum_window': args.window, 'spectrum_points': args.points,
+                'reducers': args.reducers, 'reducer_points': args.reducer_points}
+    if args.zoom:
+        settings.update({'spectrum_zoom': 'on', 'freq_x_limit': args.zoom})
+    summaries = replay_batch(runs, settings, args.workers, args.spectra, args.plot,
+                             None if args.json else lambda summary: print(format_summary(summary), flush = True))
+    if args.json:
+        print(json.dumps(summaries, indent = 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+preallocated ring of snapshots shared by the acquisition (one producer) and
+any number of consumers (plotter, spectrum, ...)
+the producer never waits: it copies the snapshot into the next slot and
+publishes its sequence number, every consumer keeps its own position and
+reads the newest snapshot when it is ready (latest wins), counting the
+snapshots it never saw (skipped) and the reads that lost their slot to the
+producer while copying (overruns)
+
+every slot carries a version which is odd while the producer writes it
+(seqlock), a read is valid if the version is even and unchanged after the
+copy, the producer only ever overwrites older snapshots, so a failed read
+means the snapshot is gone and the consumer moves on to the newest one
+only the sequence number has to go through a Qt signal
+'''
+import numpy as np
+
+
+class ShotRing:
+    '''
+    slots snapshots of shape and dtype
+    '''
+    def __init__(self, slots, shape, dtype = np.float64):
+        self.slots = slots
+        self.data = np.zeros((slots,) + tuple(shape), dtype = dtype)
+        self.sequence = np.full(slots, -1, dtype = np.int64)
+        self.iteration = np.zeros(slots, dtype = np.int64)
+        self.averages = np.zeros(slots, dtype = np.int64)
+        self.version = np.zeros(slots, dtype = np.int64)
+        self.head = -1 # sequence number of the newest complete snapshot
+
+    def write(self, data, iteration, averages):
+        '''
+        copy data into the next slot and publish it, returns its sequence number
+        '''
+        np.copyto(self.claim(), data)
+        return self.publish(iteration, averages)
+
+    def claim(self):
+        '''
+        the array of the next slot, marked as being written, for a producer
+        which computes the snapshot in place, publish() ends the write
+        '''
+        slot = (self.head + 1) % self.slots
+        self.version[slot] += 1
+        return self.data[slot]
+
+    def publish(self, iteration, averages):
+        '''
+        publish the slot of claim(), returns its sequence number
+        '''
+        sequence = self.head + 1
+        slot = sequence % self.slots
+        self.sequence[slot] = sequence
+        self.iteration[slot] = iteration
+        self.averages[slot] = averages
+        self.version[slot] += 1
+        self.head = sequence
+        return sequence
+
+    def read(self, sequence, out):
+        '''
+        copy the snapshot sequence into out, (iteration, averages) or None if
+        the snapshot was overwritten before or during the copy
+        '''
+        slot = sequence % self.slots
+        version = self.version[slot]
+        if version % 2 or self.sequence[slot] != sequence:
+            return None
+        np.copyto(out, self.data[slot])
+        iteration, averages = int(self.iteration[slot]), int(self.averages[slot])
+        if self.version[slot] != version:
+            return None
+        return iteration, averages
+
+
+class RingReader:
+    '''
+    one consumer of a ShotRing, reads into its own buffer
+    '''
+    def __init__(self, ring):
+        self.ring = ring
+        self.buffer = np.empty_like(ring.data[0])
+        self.last = -1
+        self.read_count = 0
+        self.skipped = 0
+        self.overruns = 0
+
+    def pending(self):
+        return self.ring.head > self.last
+
+    def latest(self, out = None):
+        '''
+        (sequence, iteration, averages, data) of the newest snapshot, None if
+        there is nothing new since the last call, data is the buffer of the
+        reader (overwritten by the next call) unless out is given
+        '''
+        if out is None:
+            out = self.buffer
+        while True:
+            head = self.ring.head
+            if head <= self.last:
+                return None
+            meta = self.ring.read(head, out)
+            if meta is None:
+                self.overruns += 1
+                continue
+            self.skipped += head - self.last - 1
+            self.last = head
+            self.read_count += 1
+            return (head,) + meta + (out,)
@@ -0,0 +1,382 @@
+'''
+simulated daq card for running and benchmarking the acquisition without the
+hardware, it implements the part of the nidaqmx api used in this project:
+ao_channels/ai_channels, timing.cfg_samp_clk_timing, write, start,
+wait_until_done, read, stop, close, the every n samples event, a reader
+with read_many_sample, an unscaled reader with read_int16 and an unscaled
+writer with write_int16
+
+the ao channel is a 16 bit dac with the scaling coefficients of dac_scaling:
+write() does what the driver does with volts (range check, copy, conversion
+to codes), write_int16 takes the codes as they are, the ai channels are 16
+bit adcs with the scaling adc_scaling
+
+an ai task clocked by /DevX/ao/SampleClock acquires the response of a SpinSystem
+to the waveform written to the ao task of DevX: the first ai channel sees the
+nmr free induction decay, the second the nsor signal and the others the laser
+intensity, every read adds gaussian noise
+'''
+import threading
+import time
+from enum import Enum
+
+import numpy as np
+from numpy import pi
+
+from dac import DacScaling, AdcScaling
+
+
+class AcquisitionType(Enum):
+    FINITE = 10178
+    CONTINUOUS = 10123
+
+
+class TerminalConfiguration(Enum):
+    DEFAULT = -1
+    RSE = 10083
+    NRSE = 10078
+    DIFFERENTIAL = 10106
+    PSEUDO_DIFFERENTIAL = 12529
+
+
+class constants:
+    '''
+    stands in for nidaqmx.constants
+    '''
+    AcquisitionType = AcquisitionType
+    TerminalConfiguration = TerminalConfiguration
+
+
+class SpinSystem:
+    '''
+    a single spin packet, every shot starts from thermal equilibrium
+    larmor: precession frequency in Hz
+    rabi: nutation frequency in Hz per volt of pulse amplitude
+    t2: decay time of the transverse magnetization in s
+    amplitude: nmr signal of the full transverse magnetization in V
+    nsor_scale, nsor_phase: nsor signal relative to the nmr signal
+    laser: laser intensity signal in V
+    feedthrough: part of the pulse seen on the nmr channel
+    '''
+    def __init__(self, larmor = 31200, rabi = 54.3, t2 = 0.1, amplitude = 0.5,
+                 nsor_scale = 0.1, nsor_phase = 90, laser = 1.0, feedthrough = 0.01):
+        self.larmor = larmor
+        self.rabi = rabi
+        self.t2 = t2
+        self.amplitude = amplitude
+        self.nsor_scale = nsor_scale
+        self.nsor_phase = nsor_phase
+        self.laser = laser
+        self.feedthrough = feedthrough
+
+    def pulses(self, waveform):
+        '''
+        (start, stop) of the runs of nonzero points
+        '''
+        nonzero = np.concatenate(([0], (waveform != 0).view(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(nonzero))
+        return edges.reshape(-1, 2)
+
+    def respond(self, waveform, samp_rate, channels):
+        '''
+        noise free response (channels, len(waveform)) to one shot
+        '''
+        n = len(waveform)
+        omega = 2 * pi * self.larmor / samp_rate
+        fid = np.zeros(n, dtype = complex)
+        magnetization = np.array([0.0, 0.0, 1.0])
+        runs = self.pulses(waveform)
+        for index, (start, stop) in enumerate(runs):
+            '''
+            rotate about the effective b1 of the pulse in the rotating frame
+            '''
+            b1 = 2 * np.sum(waveform[start:stop] * np.exp(-1j * omega * np.arange(start, stop))) / samp_rate
+            angle = 2 * pi * self.rabi * abs(b1)
+            axis = np.array([np.cos(np.angle(b1)), np.sin(np.angle(b1)), 0.0])
+            magnetization = (magnetization * np.cos(angle)
+                             + np.cross(axis, magnetization) * np.sin(angle)
+                             + axis * np.dot(axis, magnetization) * (1 - np.cos(angle)))
+            '''
+            free precession until the next pulse
+            '''
+            end = runs[index + 1][0] if index + 1 < len(runs) else n
+            transverse = magnetization[0] + 1j * magnetization[1]
+            decay = np.exp(-np.arange(end - stop) / (self.t2 * samp_rate))
+            fid[stop:end] = transverse * decay * np.exp(1j * omega * np.arange(stop, end))
+            magnetization[0:2] *= decay[-1] if len(decay) else 1.0
+        response = np.empty((channels, n))
+        response[0] = self.amplitude * fid.real + self.feedthrough * waveform
+        if channels > 1:
+            response[1] = self.nsor_scale * self.amplitude * (fid * np.exp(1j * self.nsor_phase/180 * pi)).real
+        response[2:] = self.laser
+        return response
+
+
+class _Channels(list):
+    def add_ao_voltage_chan(self, physical_channel, *args, **kwargs):
+        self.append(physical_channel)
+
+    def add_ai_voltage_chan(self, physical_channel, *args, **kwargs):
+        self.append(physical_channel)
+
+
+class _Timing:
+    def __init__(self):
+        self.rate = 1000
+        self.source = ''
+        self.sample_mode = AcquisitionType.FINITE
+        self.samps_per_chan = 1000
+
+    def cfg_samp_clk_timing(self, rate, source = '', active_edge = None,
+                            sample_mode = AcquisitionType.FINITE, samps_per_chan = 1000):
+        self.rate = rate
+        self.source = source
+        self.sample_mode = sample_mode
+        self.samps_per_chan = samps_per_chan
+
+
+class SimulatedDevice:
+    '''
+    shared between the tasks using the same device name, holds the dac codes
+    and the output waveform of the ao task and the response to it
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.codes = None
+        self.waveform = None
+        self.rate = None
+        self.responses = {}
+        self.clock_start = None
+
+    def response(self, channels):
+        if channels not in self.responses:
+            self.responses[channels] = self.backend.system.respond(self.waveform, self.rate, channels)
+        return self.responses[channels]
+
+    def load(self, codes, rate):
+        self.codes = codes
+        self.waveform = self.backend.dac_scaling.volts(codes)
+        self.rate = rate
+        self.responses = {}
+        return len(codes)
+
+
+class SimulatedTask:
+    def __init__(self, backend, name = ''):
+        self.backend = backend
+        self.name = name
+        self.ao_channels = _Channels()
+        self.ai_channels = _Channels()
+        self.timing = _Timing()
+        self.in_stream = self
+        self.out_stream = self
+        self.running = False
+        self.start_time = None
+        self.read_position = 0
+        self.callback = None
+        self.callback_samples = 0
+        self._event_thread = None
+        self._stop_event = threading.Event()
+
+    def device(self):
+        if self.ao_channels:
+            name = self.ao_channels[0]
+        else:
+            name = self.timing.source
+        return self.backend.device(name.strip('/').split('/')[0])
+
+    def write(self, data, auto_start = False, timeout = 10.0):
+        '''
+        only single channel ao tasks are simulated
+        '''
+        volts = np.array(data, dtype = np.float64).ravel()
+        scaling = self.backend.dac_scaling
+        codes, clipped = scaling.codes(volts)
+        if clipped:
+            raise ValueError(f'{clipped} points are outside the ao range {scaling.low} to {scaling.high} V')
+        return self.device().load(codes, self.timing.rate)
+
+    def start(self):
+        if self.running:
+            raise RuntimeError(f'task {self.name} is already running')
+        time.sleep(self.backend.arm_time)
+        self.running = True
+        self.start_time = time.perf_counter()
+        self.read_position = 0
+        if self.ao_channels:
+            self.device().clock_start = self.start_time
+        elif self.callback is not None:
+            self._stop_event.clear()
+            self._event_thread = threading.Thread(target = self._every_n_samples, daemon = True)
+            self._event_thread.start()
+
+    def duration(self, samples):
+        return samples / self.timing.rate * self.backend.time_scale
+
+    def wait_until_done(self, timeout = 10.0):
+        if self.timing.sample_mode == AcquisitionType.CONTINUOUS:
+            raise RuntimeError('wait_until_done on a continuous task')
+        remaining = self.start_time + self.duration(self.timing.samps_per_chan) - time.perf_counter()
+        if remaining > timeout:
+            raise TimeoutError(f'task {self.name} did not finish within {timeout} s')
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        if self._event_thread is not None and self._event_thread is not threading.current_thread():
+            self._event_thread.join()
+        self._event_thread = None
+
+    def close(self):
+        self.stop()
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        if self.running:
+            raise RuntimeError('events can only be registered while the task is stopped')
+        self.callback = callback_method
+        self.callback_samples = sample_interval
+
+    def _every_n_samples(self):
+        count = 0
+        while not self._stop_event.is_set():
+            count += 1
+            '''
+            the clock of the ai task comes from the ao task, wait for it
+            '''
+            while self.device().clock_start is None or self.device().clock_start < self.start_time:
+                if self._stop_event.wait(0.001):
+                    return
+            target = self.device().clock_start + self.duration(count * self.callback_samples)
+            if self._stop_event.wait(max(0, target - time.perf_counter())):
+                return
+            self.callback(0, 1, self.callback_samples, None)
+
+    def fill(self, out):
+        '''
+        the next out.shape[1] samples of all channels, with noise, into out
+        '''
+        n = out.shape[1]
+        response = self.device().response(out.shape[0])
+        period = response.shape[1]
+        if self.timing.sample_mode == AcquisitionType.FINITE:
+            out[:] = response[:, :n]
+        else:
+            '''
+            the ao task regenerates its buffer, the response repeats
+            '''
+            done = 0
+            while done < n:
+                start = (self.read_position + done) % period
+                chunk = min(n - done, period - start)
+                out[:, done:done+chunk] = response[:, start:start+chunk]
+                done += chunk
+            self.read_position += n
+        if self.backend.noise > 0:
+            noise = self.backend.rng.standard_normal(out.shape)
+            noise *= self.backend.noise
+            out += noise
+        return out
+
+    def read(self, number_of_samples_per_channel = 1, timeout = 10.0):
+        out = np.empty((len(self.ai_channels), number_of_samples_per_channel))
+        self.fill(out)
+        return out.tolist()
+
+
+class SimulatedReader:
+    '''
+    stands in for nidaqmx.stream_readers.AnalogMultiChannelReader
+    '''
+    def __init__(self, task):
+        self.task = task
+
+    def read_many_sample(self, data, number_of_samples_per_channel = -1, timeout = 10.0):
+        '''
+        like nidaqmx, only float64 buffers are accepted
+        '''
+        if data.dtype != np.float64:
+            raise TypeError(f'read_many_sample needs a float64 buffer, not {data.dtype}')
+        self.task.fill(data[:, :number_of_samples_per_channel])
+        return number_of_samples_per_channel
+
+
+class SimulatedUnscaledWriter:
+    '''
+    stands in for nidaqmx.stream_writers.AnalogUnscaledWriter
+    '''
+    def __init__(self, task):
+        self.task = task
+
+    def write_int16(self, data, timeout = 10.0):
+        if data.dtype != np.int16 or data.ndim != 2 or data.shape[0] != 1:
+            raise ValueError(f'write_int16 takes int16 codes of shape (1, samples), not {data.dtype} {data.shape}')
+        return self.task.device().load(data[0].copy(), self.task.timing.rate)
+
+
+class SimulatedUnscaledReader:
+    '''
+    stands in for nidaqmx.stream_readers.AnalogUnscaledReader
+    '''
+    def __init__(self, task):
+        self.task = task
+        self.volts = None
+
+    def read_int16(self, data, number_of_samples_per_channel = -1, timeout = 10.0):
+        if data.dtype != np.int16:
+            raise TypeError(f'read_int16 needs an int16 buffer, not {data.dtype}')
+        shape = (data.shape[0], number_of_samples_per_channel)
+        if self.volts is None or self.volts.shape != shape:
+            self.volts = np.empty(shape)
+        self.task.fill(self.volts)
+        self.task.backend.adc_scaling.codes(self.volts, data[:, :number_of_samples_per_channel])
+        return number_of_samples_per_channel
+
+
+class SimulatedBackend:
+    '''
+    noise: standard deviation of the noise of every read in V
+    time_scale: 1 runs in real time, 0 as fast as possible
+    arm_time: time to start a task in s
+    dac_scaling: the DacScaling of every ao channel, +-10 V over 16 bits
+    adc_scaling: the AdcScaling of the ai channels, +-10 V over 16 bits with a
+    small offset
+    the remaining options go to the SpinSystem
+    '''
+    name = 'simulated'
+    constants = constants
+
+    def __init__(self, noise = 0.01, time_scale = 1.0, arm_time = 0.002, seed = None,
+                 dac_scaling = None, adc_scaling = None, **system):
+        self.noise = noise
+        self.time_scale = time_scale
+        self.arm_time = arm_time
+        self.dac_scaling = dac_scaling or DacScaling((0.0, 32767/10))
+        self.adc_scaling = adc_scaling or AdcScaling([(2e-4, 10/32768)]*8)
+        self.rng = np.random.default_rng(seed)
+        self.system = SpinSystem(**system)
+        self.devices = {}
+
+    def device(self, name):
+        if name not in self.devices:
+            self.devices[name] = SimulatedDevice(self)
+        return self.devices[name]
+
+    def task(self, name):
+        return SimulatedTask(self, name)
+
+    def reader(self, task):
+        return SimulatedReader(task)
+
+    def unscaled_reader(self, task):
+        return SimulatedUnscaledReader(task)
+
+    def ai_scaling(self, task):
+        return AdcScaling(self.adc_scaling.coefficients[:len(task.ai_channels)])
+
+    def unscaled_writer(self, task):
+        return SimulatedUnscaledWriter(task)
+
+    def ao_scaling(self, task):
+        return self.dac_scaling
@@ -0,0 +1,236 @@
+'''
+spectra of the acquired channels
+all rows (nmr, nsor, laser) go through one batched rfft, zero padded to a fast
+fft length, with the frequency axes and the windows cached per length
+the zoom mode computes only the band of interest, at any resolution, instead
+of the whole spectrum: the rows are mixed down by the center of the band, low
+pass filtered and decimated in one polyphase pass (two real matrix products
+for real rows), and the short decimated rows go through a chirp z transform
+onto the points of the band; the gain and the delay of the filter are divided
+out exactly, what is left is the aliasing through its stopband, about
+ZOOM_ATTENUATION dB below the rest of the spectrum
+the amplitude is scaled like the former FourierWorker, a cosine of amplitude a
+shows up as a peak of height a, the coherent gain of the window is divided out
+complex rows (the baseband of the lock-in) get a two sided spectrum around
+center, the reference frequency, so that the axis stays in absolute Hz
+'''
+import numpy as np
+from numpy import pi
+
+WINDOWS = {'rect': np.ones, 'hann': np.hanning, 'hamming': np.hamming,
+           'blackman': np.blackman}
+# stopband attenuation of the decimation filter of the zoom in dB
+ZOOM_ATTENUATION = 120
+
+
+def next_fast_len(n):
+    '''
+    smallest 2**a * 3**b * 5**c that is not smaller than n
+    '''
+    if n <= 1:
+        return 1
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            quotient = -(-n // p35)
+            best = min(best, p35 * (1 << (quotient - 1).bit_length()))
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def decimation_filter(samp_rate, bandwidth):
+    '''
+    (factor, taps) of the zoom of a band of bandwidth Hz: the decimated rate
+    is at least twice the bandwidth and the kaiser windowed sinc passes
+    |f| <= bandwidth/2 and stops everything from the decimated rate minus
+    bandwidth/2 on, which is what would alias into the band
+    '''
+    factor = int(samp_rate // (2*bandwidth))
+    transition = 2*pi*bandwidth/samp_rate
+    length = int(np.ceil((ZOOM_ATTENUATION - 8)/(2.285*transition))) + 1
+    beta = 0.1102*(ZOOM_ATTENUATION - 8.7)
+    cutoff = 2*bandwidth/samp_rate
+    taps = cutoff*np.sinc(cutoff*(np.arange(length) - (length - 1)/2))*np.kaiser(length, beta)
+    return factor, taps
+
+
+class SpectrumEngine:
+    '''
+    samp_rate: sampling rate of the rows
+    window: one of WINDOWS
+    band: (f_start, f_stop) in Hz, when given only this band is computed with
+          zoom_points points (chirp z transform)
+    center: frequency of 0 Hz of complex rows
+    '''
+    def __init__(self, samp_rate, window = 'rect', band = None, zoom_points = 2048, center = 0):
+        if window not in WINDOWS:
+            raise ValueError(f'unknown window {window}, use one of {list(WINDOWS)}')
+        self.samp_rate = samp_rate
+        self.window = window
+        self.band = band
+        self.zoom_points = zoom_points
+        self.center = center
+        self._windows = {}
+        self._axes = {}
+        self._chirps = {}
+        self._decimators = {}
+
+    def set_band(self, band):
+        self.band = band
+
+    def window_of(self, n):
+        if n not in self._windows:
+            self._windows[n] = WINDOWS[self.window](n)
+        return self._windows[n]
+
+    def spectrum(self, rows):
+        '''
+        rows is a 2d array (channel, point), returns the frequency axis and the
+        complex spectra (channel, frequency)
+        '''
+        rows = np.atleast_2d(rows)
+        n = rows.shape[1]
+        window = self.window_of(n)
+        if self.window == 'rect':
+            weighted = rows
+        else:
+            weighted = rows * window
+        if np.iscomplexobj(rows):
+            scale = 1/window.sum()
+            if self.band is None:
+                return self.full_complex_spectrum(weighted, scale)
+            band = (self.band[0] - self.center, self.band[1] - self.center)
+            axis, spectra = self.zoom_spectrum(weighted, scale, band)
+            return axis + self.center, spectra
+        scale = 2/window.sum()
+        if self.band is None:
+            return self.full_spectrum(weighted, scale)
+        return self.zoom_spectrum(weighted, scale, self.band)
+
+    def full_spectrum(self, weighted, scale):
+        n_fft = next_fast_len(weighted.shape[1])
+        if n_fft not in self._axes:
+            self._axes[n_fft] = np.fft.rfftfreq(n_fft, 1/self.samp_rate)
+        spectra = np.fft.rfft(weighted, n = n_fft, axis = -1)
+        spectra *= scale
+        return self._axes[n_fft], spectra
+
+    def full_complex_spectrum(self, weighted, scale):
+        n_fft = next_fast_len(weighted.shape[1])
+        key = (n_fft, self.center)
+        if key not in self._axes:
+            self._axes[key] = np.fft.fftshift(np.fft.fftfreq(n_fft, 1/self.samp_rate)) + self.center
+        spectra = np.fft.fftshift(np.fft.fft(weighted, n = n_fft, axis = -1), axes = -1)
+        spectra *= scale
+        return self._axes[key], spectra
+
+    def chirps(self, n, band, samp_rate):
+        '''
+        the Bluestein kernels of the chirp z transform of n points sampled at
+        samp_rate onto zoom_points frequencies across band
+        '''
+        key = (n, tuple(band), self.zoom_points, samp_rate)
+        if key not in self._chirps:
+            m = self.zoom_points
+            f_start, f_stop = band
+            df = (f_stop - f_start)/max(m - 1, 1)
+            n_fft = next_fast_len(n + m - 1)
+            k = np.arange(max(n, m))
+            chirp = np.exp(-1j * pi * df/samp_rate * k.astype(float)**2)
+            pre = np.exp(-2j * pi * f_start/samp_rate * np.arange(n)) * chirp[:n]
+            kernel = np.zeros(n_fft, dtype = complex)
+            kernel[:m] = 1/chirp[:m]
+            kernel[n_fft-n+1:] = 1/chirp[1:n][::-1]
+            self._chirps[key] = (pre, np.fft.fft(kernel), chirp[:m].copy(), n_fft,
+                                 f_start + df*np.arange(m))
+        return self._chirps[key]
+
+    def czt(self, rows, band, samp_rate):
+        '''
+        sum(rows[n]*exp(-2i*pi*f*n/samp_rate)) at the zoom_points f of band
+        '''
+        pre, kernel_fft, post, n_fft, axis = self.chirps(rows.shape[1], band, samp_rate)
+        spectra = np.fft.fft(rows * pre, n = n_fft, axis = -1)
+        spectra *= kernel_fft
+        spectra = np.fft.ifft(spectra, axis = -1)[:, :len(post)]
+        spectra *= post
+        return axis, spectra
+
+    def decimator(self, n, band):
+        '''
+        the filter of the zoom of n points onto band, None if the band is too
+        wide to decimate, see decimation_filter
+        polyphase: the taps are split into phases of factor taps and the rows
+        into blocks of factor points, the decimated point k (at point
+        k*factor + factor - 1) is the sum over the phases p of block k - p
+        times phase p; the mixer exp(-2i*pi*center*t) is folded into the
+        phases up to a factor exp(-2i*pi*center*k*factor) of the decimated
+        points, which the chirp z transform takes up by evaluating the band
+        itself instead of the band around 0
+        '''
+        key = (n, tuple(band))
+        if key not in self._decimators:
+            f_start, f_stop = band
+            plan = None
+            if f_stop > f_start and self.samp_rate >= 4*(f_stop - f_start):
+                factor, taps = decimation_filter(self.samp_rate, f_stop - f_start)
+                center = (f_start + f_stop)/2
+                phases = -(-len(taps) // factor)
+                padded = np.zeros(phases*factor)
+                padded[:len(taps)] = taps
+                time = np.arange(factor)[:, None] - factor*np.arange(phases)[None, :]
+                polyphase = np.exp(-2j*pi*center/self.samp_rate*time)*padded.reshape(phases, factor)[:, ::-1].T
+                '''
+                for real rows: the real and imaginary parts interleaved, so
+                that the real product is the complex one in memory
+                '''
+                real_polyphase = np.empty((factor, 2*phases))
+                real_polyphase[:, 0::2] = polyphase.real
+                real_polyphase[:, 1::2] = polyphase.imag
+                '''
+                the gain and the delay of the filter and of the decimated
+                points at every point of the band
+                '''
+                offset, gain = self.czt(taps[None, :], (f_start - center, f_stop - center), self.samp_rate)
+                correction = factor*np.exp(-2j*pi*offset*(factor - 1)/self.samp_rate)/gain[0]
+                plan = (factor, polyphase, real_polyphase, correction)
+            self._decimators[key] = plan
+        return self._decimators[key]
+
+    def zoom_spectrum(self, weighted, scale, band):
+        plan = self.decimator(weighted.shape[1], band)
+        if plan is None:
+            axis, spectra = self.czt(weighted, band, self.samp_rate)
+            spectra *= scale
+            return axis, spectra
+        factor, polyphase, real_polyphase, correction = plan
+        rows, n = weighted.shape
+        full, phases = n // factor, polyphase.shape[1]
+        blocks = -(-n // factor)
+        '''
+        products[:, b + phases - 1, p] is block b times phase p, padded with
+        phases - 1 zero blocks on both sides, the decimated points are the
+        sums along its diagonals, read through a strided view
+        '''
+        products = np.empty((rows, blocks + 2*(phases - 1), phases), dtype = complex)
+        products[:, :phases - 1] = 0
+        products[:, phases - 1 + blocks:] = 0
+        inner = products[:, phases - 1:phases - 1 + blocks]
+        if np.iscomplexobj(weighted):
+            taps = polyphase
+        else:
+            inner = inner.view(np.float64)
+            taps = real_polyphase
+        np.matmul(weighted[:, :full*factor].reshape(rows, full, factor), taps, out = inner[:, :full])
+        if blocks > full:
+            np.matmul(weighted[:, None, full*factor:], taps[:n - full*factor], out = inner[:, full:])
+        strides = products.strides
+        diagonals = np.lib.stride_tricks.as_strided(products[:, phases - 1:],
+                                                    shape = (rows, blocks + phases - 1, phases),
+                                                    strides = (strides[0], strides[1], strides[2] - strides[1]))
+        axis, spectra = self.czt(diagonals.sum(axis = 2), band, self.samp_rate/factor)
+        spectra *= correction*scale
+        return axis, spectra
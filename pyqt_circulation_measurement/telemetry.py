@@ -0,0 +1,157 @@
+'''
+per shot timing of the acquisition
+every shot gets one record in a fixed size ring buffer, the stages of the shot
+are timed with one perf_counter call per stage boundary:
+    arm      starting the tasks
+    wait     wait_until_done, or waiting for the shot in continuous mode
+    read     reading the shot from the card
+    average  adding the shot and taking the snapshot (demodulation included)
+    save     handing the snapshot to the DatasetWriter
+    emit     handing the snapshot to the gui
+    stop     stopping the tasks
+    plot     store_plot_data in the gui thread, added when it ran
+a disabled Telemetry returns from every call right away, so the acquisition
+code can call it unconditionally
+the plot time is added from the gui thread while the acquisition thread
+begins the next records, begin(), add() and snapshot() hold a lock so that a
+record is never recycled halfway through an add or a copy, mark() only
+touches the stages of the acquisition thread and goes without it
+'''
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+
+STAGES = ('arm', 'wait', 'read', 'average', 'save', 'emit', 'stop', 'plot')
+# avg is the number of the shot in its iteration
+FIELDS = ('shot', 'iteration', 'avg', 'start') + STAGES
+STAGE_INDEX = {stage: FIELDS.index(stage) for stage in STAGES}
+FORMATS = ('off', 'csv', 'json')
+
+
+class Telemetry:
+    '''
+    size: number of records kept, the oldest are overwritten
+    shot_time: duration of the pulse sequence of one shot, for the duty cycle
+    '''
+    def __init__(self, size = 4096, shot_time = 0.0, enabled = True):
+        self.size = size
+        self.shot_time = shot_time
+        self.enabled = enabled
+        self.records = np.zeros((size, len(FIELDS)))
+        self.count = 0
+        self.lock = threading.Lock()
+        self._row = None
+        self._last = 0.0
+
+    def begin(self, iteration, average):
+        '''
+        start the record of the next shot, the clock of the first stage starts
+        '''
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            row = self.records[self.count % self.size]
+            row.fill(0)
+            row[0] = self.count
+            row[1] = iteration
+            row[2] = average
+            row[3] = now
+            self._row = row
+            self._last = now
+            self.count += 1
+
+    def mark(self, stage):
+        '''
+        the time since the last mark (or begin) went to stage
+        '''
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._row[STAGE_INDEX[stage]] += now - self._last
+        self._last = now
+
+    def add(self, stage, duration, shot = None):
+        '''
+        add a duration measured elsewhere, to the current shot or to the shot
+        numbered shot if it is still in the buffer
+        '''
+        if not self.enabled:
+            return
+        with self.lock:
+            if shot is None:
+                row = self._row
+            else:
+                row = self.records[shot % self.size]
+                if row[0] != shot or shot >= self.count:
+                    return
+            if row is not None:
+                row[STAGE_INDEX[stage]] += duration
+
+    def snapshot(self, last = None):
+        '''
+        copy of the records in the buffer, oldest first
+        '''
+        with self.lock:
+            num = min(self.count, self.size)
+            if last is not None:
+                num = min(num, last)
+            index = np.arange(self.count - num, self.count) % self.size
+            return self.records[index]
+
+    def rates(self, last = 64):
+        '''
+        (shots per second, duty cycle) over the last records
+        '''
+        records = self.snapshot(last)
+        if len(records) < 2:
+            return 0.0, 0.0
+        span = records[-1, 3] - records[0, 3]
+        if span <= 0:
+            return 0.0, 0.0
+        shots_per_second = (len(records) - 1)/span
+        return shots_per_second, shots_per_second*self.shot_time
+
+    def summary(self):
+        '''
+        rates and the mean and maximum time of the stages, a stage which got
+        no time in any record (plot in a headless run) is left out
+        '''
+        records = self.snapshot()
+        shots_per_second, duty_cycle = self.rates(len(records))
+        stages = {}
+        for stage in STAGES:
+            column = records[:, STAGE_INDEX[stage]]
+            if column.any():
+                stages[stage] = {'mean': float(column.mean()), 'max': float(column.max())}
+        return {'shots': self.count, 'records': len(records),
+                'shots_per_second': shots_per_second, 'duty_cycle': duty_cycle,
+                'stages': stages}
+
+    def export_csv(self, file_name):
+        records = self.snapshot()
+        with open(file_name, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for row in records:
+                writer.writerow([int(val) for val in row[:3]] + [repr(float(val)) for val in row[3:]])
+
+    def export_json(self, file_name):
+        records = self.snapshot()
+        with open(file_name, 'w') as f:
+            json.dump({'fields': FIELDS, 'summary': self.summary(),
+                       'records': records.tolist()}, f)
+
+    def export(self, file_name, file_format):
+        '''
+        file_format is one of FORMATS, 'off' writes nothing
+        '''
+        if file_format == 'csv':
+            self.export_csv(file_name + '.csv')
+        elif file_format == 'json':
+            self.export_json(file_name + '.json')
+        elif file_format != 'off':
+            raise ValueError(f'unknown telemetry format {file_format}, use one of {FORMATS}')
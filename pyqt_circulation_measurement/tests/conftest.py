@@ -0,0 +1,8 @@
+'''
+the modules of pyqt_circulation_measurement import each other by their plain
+names, so the folder goes on the path like when the scripts are run from it
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+'''
+the double buffered waveforms of the ao task
+'''
+import threading
+
+import numpy as np
+import pytest
+
+from ao_buffer import WaveformStager
+from dac import DacScaling
+
+TIMEOUT = 5
+
+
+def source(iteration):
+    return np.arange(1, 10*iteration + 2, dtype = np.float64)/100
+
+
+def expected(iteration, width):
+    waveform = np.zeros(width)
+    waveform[:10*iteration + 1] = source(iteration)
+    return waveform
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_every_iteration_is_zero_padded(prefetch):
+    iterations = [0, 3, 1, 5]
+    stager = WaveformStager(source, 60, iterations, prefetch = prefetch)
+    stager.start()
+    for index, iteration in enumerate(iterations):
+        np.testing.assert_array_equal(stager.take(index), expected(iteration, 60))
+    stager.close()
+
+
+def test_next_iteration_is_generated_in_the_background():
+    '''
+    the waveform of iteration n+1 is generated once n is taken, a take
+    which comes before it is done waits for it and counts as a stall
+    '''
+    generated = []
+    release = threading.Event()
+    def slow_source(iteration):
+        generated.append(iteration)
+        if iteration == 2:
+            assert release.wait(TIMEOUT)
+        return source(iteration)
+    stager = WaveformStager(slow_source, 40, [0, 1, 2])
+    stager.start()
+    first = stager.take(0)
+    stager.pending[2].result(TIMEOUT)
+    assert generated == [0, 1]
+    second = stager.take(1)
+    assert second is not first
+    np.testing.assert_array_equal(first, expected(0, 40))
+    assert stager.stalls == 0
+    threading.Timer(0.05, release.set).start()
+    np.testing.assert_array_equal(stager.take(2), expected(2, 40))
+    assert generated == [0, 1, 2]
+    assert stager.stalls == 1
+    assert stager.stall_time > 0
+    stager.close()
+
+
+def test_out_of_order_take():
+    stager = WaveformStager(source, 60, [0, 1, 2, 3])
+    stager.start()
+    np.testing.assert_array_equal(stager.take(2), expected(2, 60))
+    np.testing.assert_array_equal(stager.take(3), expected(3, 60))
+    np.testing.assert_array_equal(stager.take(0), expected(0, 60))
+    stager.close()
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_a_waveform_longer_than_the_buffer_raises(prefetch):
+    stager = WaveformStager(source, 15, [0, 1, 2], prefetch = prefetch)
+    stager.start()
+    stager.take(0)
+    stager.take(1)
+    with pytest.raises(ValueError):
+        stager.take(2)
+    stager.close()
+
+
+def test_codes_are_padded_with_the_code_of_zero_volts():
+    scaling = DacScaling((12.0, 3276.7))
+    stager = WaveformStager(source, 30, [0, 2], scaling = scaling)
+    stager.start()
+    for index, iteration in enumerate([0, 2]):
+        buffer = stager.take(index)
+        assert buffer.dtype == np.int16
+        np.testing.assert_array_equal(buffer, scaling.codes(expected(iteration, 30))[0])
+        assert buffer[-1] == scaling.zero_code == 12
+    stager.close()
+
+
+def test_codes_outside_the_range_raise():
+    stager = WaveformStager(lambda iteration: np.full(5, 11.0), 10, [0], scaling = DacScaling((0.0, 3276.7)))
+    stager.start()
+    with pytest.raises(ValueError):
+        stager.take(0)
+    stager.close()
@@ -0,0 +1,102 @@
+'''
+the int16 codes of the dac and the adc
+'''
+import numpy as np
+import pytest
+
+from dac import DacScaling, AdcScaling, CODE_MIN, CODE_MAX
+from oscillator import BLOCK_SIZE
+
+LINEAR = (3.0, 32760/10)
+# a slightly bent dac, like the coefficients of a calibrated channel
+CURVED = (-4.0, 3260.0, 0.5, -0.02)
+
+
+def sweep(points = 3*BLOCK_SIZE + 123, low = -10.0, high = 10.0):
+    '''
+    volts across the range, more than a block of the conversion long
+    '''
+    rng = np.random.default_rng(8)
+    return rng.uniform(low, high, points)
+
+
+def test_linear_codes_are_the_rounded_driver_scaling():
+    volts = sweep()
+    codes, clipped = DacScaling(LINEAR).codes(volts)
+    assert clipped == 0
+    assert codes.dtype == np.int16
+    np.testing.assert_array_equal(codes, np.rint(LINEAR[0] + LINEAR[1]*volts).astype(np.int16))
+
+
+@pytest.mark.parametrize('coefficients', [LINEAR, CURVED])
+def test_dac_round_trip_is_within_half_a_code(coefficients):
+    scaling = DacScaling(coefficients)
+    volts = sweep()
+    codes, _ = scaling.codes(volts)
+    error = np.abs(scaling.volts(codes) - volts)
+    assert error.max() <= 0.5*scaling.lsb*1.01
+    assert scaling.max_error(volts, codes) == pytest.approx(error.max())
+    assert scaling.max_error(volts) == pytest.approx(error.max())
+
+
+def test_polynomial_volts_invert_the_codes():
+    scaling = DacScaling(CURVED)
+    codes = np.arange(-30000, 30000, 7)
+    np.testing.assert_allclose(np.polynomial.polynomial.polyval(scaling.volts(codes), CURVED), codes,
+                               rtol = 0, atol = 1e-6)
+
+
+def test_points_outside_the_range_are_clipped_and_counted():
+    scaling = DacScaling((0.0, 3276.8), low = -5, high = 5)
+    volts = np.array([-7.0, -5.0, 0.0, 4.9, 5.0, 5.1, 12.0])
+    codes, clipped = scaling.codes(volts)
+    assert clipped == 3
+    np.testing.assert_array_equal(codes, [-16384, -16384, 0, 16056, 16384, 16384, 16384])
+    codes, clipped = DacScaling((0.0, 4000.0), low = -10, high = 10).codes(np.array([-10.0, 10.0]))
+    assert clipped == 0
+    np.testing.assert_array_equal(codes, [CODE_MIN, CODE_MAX])
+
+
+def test_codes_into_a_buffer():
+    scaling = DacScaling(LINEAR)
+    volts = sweep(1000)
+    out = np.zeros(1200, dtype = np.int16)
+    codes, _ = scaling.codes(volts, out[100:1100])
+    assert codes.base is out
+    np.testing.assert_array_equal(out[100:1100], scaling.codes(volts)[0])
+    assert not out[:100].any() and not out[1100:].any()
+
+
+def test_dac_scaling_is_checked():
+    assert DacScaling((5.0, 3276.7, 0.0, 0.0)).coefficients == [5.0, 3276.7]
+    assert DacScaling((5.0, 3276.7)).zero_code == 5
+    for coefficients in [(1.0,), (1.0, 0.0), (1.0, 0.0, 2.0)]:
+        with pytest.raises(ValueError):
+            DacScaling(coefficients)
+    with pytest.raises(ValueError):
+        AdcScaling([(0.0, 10/32768), (0.0, 0.0)])
+
+
+def test_adc_volts_of_averaged_codes():
+    adc = AdcScaling([(1e-3, 10/32768), (0.0, 5/32768, 1e-11)])
+    codes = np.array([[0.5, -100.25, 32000.0], [1.0, -2.0, 20000.0]])
+    expected = np.stack((1e-3 + 10/32768*codes[0], 5/32768*codes[1] + 1e-11*codes[1]**2))
+    np.testing.assert_allclose(adc.volts(codes), expected)
+    out = np.empty((2, 3))
+    assert adc.volts(codes, out) is out
+
+
+@pytest.mark.parametrize('coefficients', [LINEAR, CURVED])
+def test_dac_to_adc_round_trip_is_within_one_code(coefficients):
+    '''
+    volts written as dac codes and read back as adc codes land within one
+    code of the adc of the volts themselves
+    '''
+    dac = DacScaling(coefficients)
+    adc = AdcScaling([(2e-4, 10/32768)])
+    volts = sweep(low = -9.9, high = 9.9)
+    codes, _ = dac.codes(volts)
+    read = adc.codes(dac.volts(codes)[None])[0]
+    assert read.dtype == np.int16
+    assert np.abs(read.astype(int) - adc.codes(volts[None])[0]).max() <= 1
+    assert np.abs(adc.volts(read[None])[0] - volts).max() <= 10/32768 + dac.lsb/2
@@ -0,0 +1,127 @@
+'''
+round trip of the on disk datasets
+'''
+import os
+
+import numpy as np
+
+from dac import AdcScaling
+from dataset import CHANNELS, ShotDataset, RawDataset, open_dataset, read_header, encode_chunk, decode_chunk
+
+
+def test_shot_dataset_round_trip(tmp_path):
+    file_name = os.path.join(tmp_path, 'run')
+    rng = np.random.default_rng(0)
+    dataset = ShotDataset.create(file_name, 4, 1000, 250000, {'average': '3'}, t0 = 1e-3)
+    snapshots = {0: rng.normal(size = (3, 1000)), 2: rng.normal(size = (3, 1000))}
+    for iteration, data in snapshots.items():
+        dataset.write(iteration, data, 3)
+
+    reader = open_dataset(file_name)
+    assert isinstance(reader, ShotDataset)
+    assert reader.completed() == [0, 2]
+    assert reader.header['averages'] == [3, 0, 3, 0]
+    assert reader.header['channels'] == CHANNELS
+    assert reader.header['parameters'] == {'average': '3'}
+    for iteration, data in snapshots.items():
+        np.testing.assert_array_equal(reader.data[iteration], data)
+    np.testing.assert_array_equal(reader.data[1], 0)
+    np.testing.assert_allclose(reader.time_axis(), 1e-3 + np.arange(1000)/250000)
+    dataset.close()
+
+
+def test_readable_while_written(tmp_path):
+    '''
+    a reader opened before a write sees the data and, after reading the
+    header again, its averages
+    '''
+    file_name = os.path.join(tmp_path, 'run')
+    dataset = ShotDataset.create(file_name, 2, 10, 1000)
+    reader = open_dataset(file_name)
+    dataset.write(1, np.ones((3, 10)), 5)
+    np.testing.assert_array_equal(reader.data[1], 1)
+    assert read_header(file_name)['averages'] == [0, 5]
+    dataset.close()
+
+
+def test_complex_dataset(tmp_path):
+    file_name = os.path.join(tmp_path, 'run')
+    dataset = ShotDataset.create(file_name, 1, 8, 2500, dtype = complex)
+    data = np.arange(24).reshape(3, 8)*(1 + 2j)
+    dataset.write(0, data, 1)
+    reader = open_dataset(file_name)
+    assert reader.data.dtype == complex
+    np.testing.assert_array_equal(reader.data[0], data)
+    dataset.close()
+
+
+def test_chunk_encoding_is_lossless():
+    rng = np.random.default_rng(1)
+    for dtype in (np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        sums = rng.integers(info.min//2, info.max//2, size = (3, 1001), dtype = dtype)
+        sums[1] = np.cumsum(rng.integers(-3, 4, size = 1001)).astype(dtype)
+        decoded = decode_chunk(encode_chunk(sums), sums.shape, dtype)
+        assert decoded.dtype == dtype
+        np.testing.assert_array_equal(decoded, sums)
+
+
+def test_raw_dataset_round_trip(tmp_path):
+    '''
+    the sums come back exactly, scaled on access, and the chunks of earlier
+    snapshots are dropped when the dataset is closed
+    '''
+    file_name = os.path.join(tmp_path, 'raw')
+    scaling = [(1e-3, 10/32768), (-2e-3, 5/32768, 1e-12), (0.0, 1/32768)]
+    rng = np.random.default_rng(2)
+    dataset = RawDataset.create(file_name, 3, 500, 250000, scaling, {'ai_format': 'int16'},
+                                dtype = np.int32, t0 = 2e-4)
+    earlier = rng.integers(-2**15, 2**15, size = (3, 500)).astype(np.int32)
+    final = {0: earlier + rng.integers(-2**15, 2**15, size = (3, 500)).astype(np.int32),
+             2: rng.integers(-2**15, 2**15, size = (3, 500)).astype(np.int32)}
+    dataset.write(0, earlier, 1)
+    dataset.write(0, final[0], 2)
+    dataset.write(2, final[2], 1)
+    size = dataset.header['size']
+    dataset.close()
+
+    reader = open_dataset(file_name)
+    assert isinstance(reader, RawDataset)
+    assert reader.header['size'] < size
+    assert reader.completed() == [0, 2]
+    assert reader.header['averages'] == [2, 0, 1]
+    np.testing.assert_allclose(reader.time_axis(), 2e-4 + np.arange(500)/250000)
+    adc = AdcScaling(scaling)
+    for iteration, sums in final.items():
+        np.testing.assert_array_equal(reader.sums(iteration), sums)
+        averages = reader.header['averages'][iteration]
+        expected = adc.volts(sums/averages)
+        np.testing.assert_allclose(reader.read(iteration), expected)
+        np.testing.assert_allclose(reader.data[iteration], expected)
+        np.testing.assert_allclose(reader.data[iteration, 1, 10:20], expected[1, 10:20])
+    np.testing.assert_array_equal(reader.data[1], 0)
+    assert reader.data[:].shape == (3, 3, 500)
+    assert np.asarray(reader.data).shape == (3, 3, 500)
+
+
+def test_raw_dataset_holds_one_chunk_per_iteration(tmp_path):
+    '''
+    iterations written once leave nothing to compact
+    '''
+    file_name = os.path.join(tmp_path, 'raw')
+    dataset = RawDataset.create(file_name, 4, 300, 250000, [(0.0, 1/32768)]*3, dtype = np.int32)
+    rng = np.random.default_rng(3)
+    for iteration in range(4):
+        dataset.write(iteration, rng.integers(-2**20, 2**20, size = (3, 300)).astype(np.int32), 64)
+    chunks = [chunk[:] for chunk in dataset.header['chunks']]
+    dataset.close()
+    assert os.path.getsize(file_name + '.raw') == sum(size for _, size in chunks)
+    assert read_header(file_name)['chunks'] == chunks
+
+
+def test_adc_scaling_inverts_the_codes():
+    adc = AdcScaling([(2e-4, 10/32768)]*3)
+    volts = np.linspace(-9.9, 9.9, 3000).reshape(3, 1000)
+    codes = adc.codes(volts)
+    assert codes.dtype == np.int16
+    np.testing.assert_allclose(adc.volts(codes), volts, rtol = 0, atol = 10/32768/2 + 1e-12)
@@ -0,0 +1,126 @@
+'''
+the envelopes of shaped pulses: their shape, their area and how a pulse uses
+them
+'''
+import math
+
+import numpy as np
+import pytest
+
+from envelopes import Shape, parse_shape, phase_words, pulse_axis, MAX_ENVELOPES
+from nmr_pulses import Pulse
+
+SAMP_RATE = 250000
+N = 4000
+
+
+def area(amplitude):
+    '''
+    integral over x from -1 to 1 by the midpoint rule of pulse_axis
+    '''
+    return amplitude.sum()*2/len(amplitude)
+
+
+def turns(words):
+    return words.astype(np.float64)/2.0**64
+
+
+def test_pulse_axis_is_symmetric():
+    x = pulse_axis(N)
+    np.testing.assert_allclose(x, -x[::-1], atol = 1e-15)
+    assert x[0] == pytest.approx(-1 + 1/N)
+    assert len(pulse_axis(0)) == 0
+
+
+@pytest.mark.parametrize('k', [2.0, 3.0, 5.0])
+def test_gauss(k):
+    amplitude, phase = parse_shape(f'gauss:{k}').envelope(N, SAMP_RATE)
+    assert phase is None
+    assert amplitude.max() == pytest.approx(1, abs = 1e-5)
+    assert amplitude[0] == pytest.approx(math.exp(-k**2/2), rel = 1e-2)
+    assert area(amplitude) == pytest.approx(math.sqrt(2*math.pi)/k*math.erf(k/math.sqrt(2)), rel = 1e-6)
+
+
+@pytest.mark.parametrize('lobes', [1.0, 3.0])
+def test_sinc_crosses_zero_lobes_times_on_each_side(lobes):
+    amplitude, _ = parse_shape(f'sinc:{lobes:g}').envelope(N, SAMP_RATE)
+    x = pulse_axis(N)
+    assert amplitude.max() == pytest.approx(1, abs = 1e-5)
+    crossings = np.flatnonzero(np.diff(np.sign(amplitude[x > 0])))
+    assert len(crossings) == int(lobes) - 1
+    fine = pulse_axis(100*N)
+    assert area(amplitude) == pytest.approx(area(np.sinc(lobes*fine)), rel = 1e-6)
+
+
+def test_hsec_without_sweep():
+    beta = 5.3
+    amplitude, phase = parse_shape('hsec').envelope(N, SAMP_RATE)
+    assert phase is None
+    assert area(amplitude) == pytest.approx(4/beta*math.atan(math.tanh(beta/2)), rel = 1e-6)
+
+
+def test_hsec_sweeps_the_frequency():
+    '''
+    the phase of the envelope advances at sweep/2*tanh(beta*x) Hz
+    '''
+    beta, sweep = 4.0, 2000.0
+    amplitude, phase = parse_shape(f'hsec:{beta:g}:{sweep:g}').envelope(N, SAMP_RATE)
+    np.testing.assert_allclose(amplitude, 1/np.cosh(beta*pulse_axis(N)))
+    frequency = ((np.diff(turns(phase)) + 0.5) % 1 - 0.5)*SAMP_RATE
+    middle = (pulse_axis(N)[1:] + pulse_axis(N)[:-1])/2
+    np.testing.assert_allclose(frequency, sweep/2*np.tanh(beta*middle), rtol = 0, atol = 1e-3)
+
+
+def test_table_is_interpolated(tmp_path):
+    table = tmp_path / 'shape.txt'
+    table.write_text('# amplitude phase\n0 0\n1 90\n0 180\n')
+    shape = parse_shape('table:shape.txt', str(tmp_path))
+    amplitude, phase = shape.envelope(6, SAMP_RATE)
+    x = pulse_axis(6)
+    np.testing.assert_allclose(amplitude, np.interp(x, pulse_axis(3), [0, 1, 0]))
+    np.testing.assert_allclose(turns(phase), np.interp(x, pulse_axis(3), [0, 90, 180])/360, atol = 1e-15)
+    assert repr(shape) == f'table:{table}'
+    table.write_text('0.5\n1\n')
+    assert parse_shape('table:shape.txt', str(tmp_path)).envelope(4, SAMP_RATE)[1] is None
+
+
+def test_phase_words_wrap_at_one_turn():
+    words = phase_words(np.array([0.0, 0.25, 1.25, -0.25]))
+    assert words.dtype == np.uint64
+    np.testing.assert_array_equal(words[1], words[2])
+    assert words[1] == 2**62 and words[3] == 3*2**62 and words[0] == 0
+
+
+def test_envelopes_are_memoized_read_only():
+    shape = Shape('gauss')
+    amplitude, _ = shape.envelope(100, SAMP_RATE)
+    assert shape.envelope(100, SAMP_RATE)[0] is amplitude
+    assert shape.computed == 1
+    with pytest.raises(ValueError):
+        amplitude[0] = 0
+    for n in range(101, 101 + MAX_ENVELOPES):
+        shape.envelope(n, SAMP_RATE)
+    assert len(shape.envelopes) == MAX_ENVELOPES
+    assert shape.envelope(100, SAMP_RATE)[0] is not amplitude
+
+
+def test_specs():
+    assert parse_shape('square') is None
+    assert repr(parse_shape('gauss')) == 'gauss:3'
+    assert repr(parse_shape('hsec:4')) == 'hsec:4:0'
+    for spec in ['ramp', 'gauss:1:2', 'table', 'table:a:b']:
+        with pytest.raises(ValueError):
+            parse_shape(spec)
+
+
+def test_shaped_pulse_is_the_square_pulse_times_the_envelope():
+    '''
+    an envelope without phase scales the carrier point by point, so the area
+    of the pulse in volts is the area of the envelope times its power
+    '''
+    duration = N/SAMP_RATE
+    square = Pulse([duration], 0, [31200], [0.8], [30]).waveform_generation(SAMP_RATE, 1234, 0)
+    for spec in ['gauss', 'sinc:2', 'hsec']:
+        shaped = Pulse([duration], 0, [31200], [0.8], [30], spec).waveform_generation(SAMP_RATE, 1234, 0)
+        amplitude, _ = parse_shape(spec).envelope(N, SAMP_RATE)
+        np.testing.assert_allclose(shaped, square*amplitude, rtol = 0, atol = 1e-12)
@@ -0,0 +1,79 @@
+'''
+the decimation of the live plot and its blitted frames on an Agg canvas
+'''
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from live_plot import LivePlotter, minmax_decimate
+
+KEYS = ('nmr_time', 'nmr_freq', 'nsor_time', 'nsor_freq')
+
+
+def plotter(blit = True):
+    canvas = FigureCanvasAgg(Figure(figsize = (8, 4), dpi = 50))
+    axes = {key: canvas.figure.add_subplot(221 + index) for index, key in enumerate(KEYS)}
+    live = LivePlotter(canvas, axes, blit)
+    live.timer.stop()
+    return live
+
+
+def test_decimation_keeps_the_extremes_in_order():
+    rng = np.random.default_rng(1)
+    x = np.arange(10007.0)
+    y = rng.standard_normal(10007)
+    dx, dy = minmax_decimate(x, y, 100)
+    assert len(dy) <= 2*101
+    assert np.all(np.diff(dx) > 0)
+    for start in range(0, 10000, 100):
+        inside = (dx >= start) & (dx < start + 100)
+        assert dy[inside].max() == y[start:start+100].max()
+        assert dy[inside].min() == y[start:start+100].min()
+    short = y[:50]
+    assert minmax_decimate(x[:50], short, 100)[1] is short
+
+
+def test_frames_are_blitted_until_the_axes_change():
+    live = plotter()
+    x = np.linspace(0, 1, 5000)
+    for key in KEYS:
+        live.update(key, x, np.sin(40*x))
+    live.draw_frame()
+    assert live.full_draws == 1 and set(live.backgrounds) == set(KEYS)
+    for scale in (0.9, 1.0, 0.8):
+        live.update('nmr_time', x, scale*np.sin(40*x))
+        live.draw_frame()
+    assert live.full_draws == 1 and live.frames == 4
+    live.update('nmr_time', x, 3*np.sin(40*x))
+    live.draw_frame()
+    assert live.full_draws == 2
+    assert live.ax['nmr_time'].get_ylim()[1] >= 3
+    live.update('nmr_time', x, 0.1*np.sin(40*x))
+    live.draw_frame()
+    assert live.full_draws == 3
+    assert live.ax['nmr_time'].get_ylim()[1] < 1
+    live.set_cursor('time', [0.2, 0.4])
+    live.draw_frame()
+    assert live.full_draws == 4
+
+
+def test_fixed_limits_never_rescale():
+    live = plotter()
+    live.set_y_limit('time', [-1, 1])
+    x = np.linspace(0, 1, 500)
+    live.update('nmr_time', x, np.zeros(500))
+    live.draw_frame()
+    live.update('nmr_time', x, 5 + np.zeros(500))
+    live.draw_frame()
+    assert live.full_draws == 1
+    assert live.ax['nmr_time'].get_ylim() == (-1, 1)
+
+
+def test_lines_are_drawn_without_blit():
+    live = plotter(blit = False)
+    assert not live.lines['nmr_time'].get_animated()
+    live.update('nmr_time', np.arange(3.0), np.ones(3))
+    live.draw_frame()
+    assert live.full_draws == 0 and not live.backgrounds
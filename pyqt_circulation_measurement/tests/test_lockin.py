@@ -0,0 +1,71 @@
+'''
+the streaming lock-in against the known baseband of test tones
+'''
+import numpy as np
+
+from lockin import LockIn, TAP_BLOCKS, lowpass_taps
+
+SAMP_RATE = 250000
+REF_FREQ = 31200.0
+
+
+def tone(n, frequency, amplitude, phase_deg, channels = 3):
+    t = np.arange(n)/SAMP_RATE
+    return np.tile(amplitude*np.cos(2*np.pi*frequency*t + np.deg2rad(phase_deg)), (channels, 1))
+
+
+def test_lowpass_unit_dc_gain():
+    for factor in (1, 4, 100):
+        taps = lowpass_taps(factor)
+        assert len(taps) == TAP_BLOCKS*factor
+        assert np.isclose(taps.sum(), 1)
+
+
+def test_tone_at_reference_becomes_its_amplitude_and_phase():
+    lockin = LockIn(SAMP_RATE, REF_FREQ, 30, 2500)
+    assert lockin.factor == 100 and lockin.out_rate == 2500
+    shot = tone(50000, REF_FREQ, 0.8, 75)
+    out = lockin.demodulate_shot(shot)
+    assert out.shape == (3, lockin.output_length(50000))
+    settled = out[:, TAP_BLOCKS:]
+    np.testing.assert_allclose(settled, 0.8*np.exp(1j*np.deg2rad(75 - 30)), atol = 1e-3)
+
+
+def test_offset_tone_rotates_at_the_offset():
+    '''
+    a tone 100 Hz above the reference turns at 100 Hz in the baseband
+    '''
+    lockin = LockIn(SAMP_RATE, REF_FREQ, 0, 2500)
+    out = lockin.demodulate_shot(tone(50000, REF_FREQ + 100, 1, 0))[0, TAP_BLOCKS:]
+    step = np.angle(out[1:]/out[:-1])
+    np.testing.assert_allclose(step, 2*np.pi*100/lockin.out_rate, atol = 1e-3)
+    np.testing.assert_allclose(np.abs(out), 1, atol = 2e-2)
+
+
+def test_out_of_band_tone_is_rejected():
+    lockin = LockIn(SAMP_RATE, REF_FREQ, 0, 2500)
+    out = lockin.demodulate_shot(tone(50000, REF_FREQ + 5000, 1, 0))
+    assert np.abs(out[:, TAP_BLOCKS:]).max() < 1e-3
+
+
+def test_chunks_match_one_pass():
+    '''
+    the history and the phase of the reference carry over between chunks
+    '''
+    rng = np.random.default_rng(0)
+    shot = tone(20000, REF_FREQ, 1, 10) + 0.1*rng.normal(size = (3, 20000))
+    whole = LockIn(SAMP_RATE, REF_FREQ, 0, 2500).demodulate_shot(shot)
+    lockin = LockIn(SAMP_RATE, REF_FREQ, 0, 2500)
+    parts = [lockin.process(shot[:, start:stop])
+             for start, stop in ((0, 333), (333, 7000), (7000, 7001), (7001, 20000))]
+    np.testing.assert_allclose(np.concatenate(parts, axis = 1), whole, atol = 1e-12)
+
+
+def test_shots_are_coherent():
+    '''
+    demodulate_shot starts every shot from the same state
+    '''
+    lockin = LockIn(SAMP_RATE, REF_FREQ, 0, 2500)
+    shot = tone(10000, REF_FREQ, 1, 40)
+    first = lockin.demodulate_shot(shot)
+    np.testing.assert_array_equal(lockin.demodulate_shot(shot), first)
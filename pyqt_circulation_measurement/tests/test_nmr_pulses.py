@@ -0,0 +1,230 @@
+'''
+the pulse programs against a flat, segment by segment expansion of the pulse
+files, the way they were interpreted before loops were kept as Loop items
+'''
+import os
+import textwrap
+
+import numpy as np
+import pytest
+
+from nmr_pulses import Delay, Pulse, Loop, PulseProgram, pulse_interpreter, walk, parse_pulse_file
+from oscillator import OSCILLATOR_TOLERANCE, synthesize
+
+PULSE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pulse_sequences')
+# model_sequence has two repeat_pos pairs but one repeat_num, so like before
+# nothing is repeated
+LOOP_FREE = ('simple_sequence.txt', 'nutation.txt', 'sin_wave.txt', 'model_sequence.txt')
+SAMP_RATE = 100000
+
+NESTED = '''
+constant:
+repeat_pos = 0 0
+repeat_num = 1
+ph1 = 0 90 180 270
+ph2 = 0 180
+pw1 = 1
+freq1 = 1000
+p1 = 0.001
+d1 = 0.002
+p2 = 0.003
+configuration:
+0 p1 freq1 pw1 ph2
+loop 2 ph2
+1 d1
+loop 3 ph1
+2 p2 freq1 pw1 ph1
+end
+3 p1 freq1 pw1 ph2
+end
+'''
+
+
+def pulse_file(tmp_path, text, name = 'sequence.txt'):
+    path = os.path.join(tmp_path, name)
+    with open(path, 'w') as f:
+        f.write(textwrap.dedent(text).lstrip())
+    return path
+
+
+def flat_expansion(items):
+    '''
+    (item, cycle) of every segment in order with the loops expanded, cycle is
+    the repetition which selects the phase (None: the iteration does), an
+    inner loop claims its own phase constants first
+    '''
+    for item in items:
+        if isinstance(item, Loop):
+            for repetition in range(item.count):
+                for inner, inner_cycle in flat_expansion(item.body):
+                    if inner_cycle is None and isinstance(inner, Pulse) and inner.phase_key in item.cycles:
+                        inner_cycle = repetition
+                    yield inner, inner_cycle
+        else:
+            yield item, None
+
+
+def flat_waveform(program, samp_rate, iteration):
+    segments = list(flat_expansion(program.pulse_sequence))
+    lengths = [item.nop(samp_rate, iteration) for item, _ in segments]
+    out = np.zeros(sum(lengths))
+    start = 0
+    for (item, cycle), n in zip(segments, lengths):
+        if isinstance(item, Pulse):
+            phase = item.phase[(iteration if cycle is None else cycle) % len(item.phase)]
+            synthesize(out[start:start+n], item.frequency[iteration % len(item.frequency)], phase,
+                       item.power[iteration % len(item.power)], samp_rate, start,
+                       *item.shaped_waveform(n, samp_rate))
+        start += n
+    return out
+
+
+@pytest.mark.parametrize('name', LOOP_FREE)
+def test_loop_free_files_are_unchanged(name):
+    '''
+    without loops the waveform is the concatenation of the segments, sample
+    for sample
+    '''
+    path = os.path.join(PULSE_FOLDER, name)
+    program = PulseProgram(path)
+    assert not any(isinstance(item, Loop) for item in program.pulse_sequence)
+    for iteration in (0, 1, 3):
+        start = 0
+        segments = []
+        for item in program.pulse_sequence:
+            segments.append(item.waveform_generation(SAMP_RATE, start, iteration))
+            start += item.nop(SAMP_RATE, iteration)
+        expected = np.concatenate(segments)
+        np.testing.assert_array_equal(program.waveform(SAMP_RATE, iteration), expected)
+        np.testing.assert_array_equal(pulse_interpreter(path, SAMP_RATE, iteration), expected)
+
+
+def test_cpmg_matches_the_flat_expansion():
+    '''
+    repeat_pos becomes a Loop, the copies of a pulse are rotations of one
+    synthesis, within 2*OSCILLATOR_TOLERANCE*power of the flat expansion
+    '''
+    program = PulseProgram(os.path.join(PULSE_FOLDER, 'cpmg_sequence.txt'))
+    kinds = [type(item).__name__ for item in program.pulse_sequence]
+    assert kinds == ['Pulse', 'Loop']
+    assert program.pulse_sequence[1].count == 10
+    assert [item.label for item in program.pulse_sequence[1].body] == [1, 2, 3]
+    for iteration in (0, 1):
+        np.testing.assert_allclose(program.waveform(SAMP_RATE, iteration),
+                                   flat_waveform(program, SAMP_RATE, iteration),
+                                   rtol = 0, atol = 2*OSCILLATOR_TOLERANCE)
+
+
+def test_nested_repeat_pos(tmp_path):
+    '''
+    a repeat_pos pair inside another one is a loop inside the loop
+    '''
+    header = NESTED.split('configuration:')[0].replace('repeat_pos = 0 0', 'repeat_pos = 1 4 2 3') \
+                                            .replace('repeat_num = 1', 'repeat_num = 2 3')
+    path = pulse_file(tmp_path, header + '''configuration:
+        0 p1 freq1 pw1 ph1
+        1 d1
+        2 p2 freq1 pw1 ph2
+        3 p1 freq1 pw1 ph1
+        4 d1
+        ''')
+    _, sequence = parse_pulse_file(path)
+    assert [type(item).__name__ for item in sequence] == ['Pulse', 'Loop', 'Delay']
+    outer = sequence[1]
+    assert outer.count == 2 and [type(item).__name__ for item in outer.body] == ['Delay', 'Loop', 'Pulse']
+    assert outer.body[1].count == 3
+    labels = [item.label for item, _ in flat_expansion(sequence)]
+    assert labels == [0, 1, 2, 2, 2, 3, 1, 2, 2, 2, 3, 4]
+    program = PulseProgram(path)
+    np.testing.assert_allclose(program.waveform(SAMP_RATE, 1), flat_waveform(program, SAMP_RATE, 1),
+                               rtol = 0, atol = 2*OSCILLATOR_TOLERANCE)
+
+
+def test_nested_loops_and_phase_cycling(tmp_path):
+    program = PulseProgram(pulse_file(tmp_path, NESTED))
+    outer = program.pulse_sequence[1]
+    inner = outer.body[1]
+    assert (outer.count, outer.cycles, inner.count, inner.cycles) == (2, ('ph2',), 3, ('ph1',))
+    assert [item.label for item, _ in walk(program.pulse_sequence)] == [0, 1, 2, 3]
+    assert [len(loops) for _, loops in walk(program.pulse_sequence)] == [0, 1, 2, 1]
+
+    '''
+    p1 100, d1 200, p2 300 points at 100 kS/s, one outer repetition is
+    d1, 3 times p2, p1 = 1200 points
+    '''
+    assert program.nop(SAMP_RATE, 0) == 100 + 2*1200
+    labels = [(item.label, cycle) for item, cycle in flat_expansion(program.pulse_sequence)]
+    assert labels == [(0, None),
+                      (1, None), (2, 0), (2, 1), (2, 2), (3, 0),
+                      (1, None), (2, 0), (2, 1), (2, 2), (3, 1)]
+    occurrences = {pulse.label: (offsets, cycle) for pulse, offsets, cycle in outer.occurrences(SAMP_RATE, 0)}
+    np.testing.assert_array_equal(occurrences[2][0], [200, 500, 800, 1400, 1700, 2000])
+    np.testing.assert_array_equal(occurrences[2][1], [0, 1, 2, 0, 1, 2])
+    np.testing.assert_array_equal(occurrences[3][0], [1100, 2300])
+    np.testing.assert_array_equal(occurrences[3][1], [0, 1])
+
+    '''
+    every copy has the phase of its repetition, the pulse in front of the
+    loops follows the iteration
+    '''
+    for iteration in (0, 1):
+        waveform = program.waveform(SAMP_RATE, iteration)
+        np.testing.assert_allclose(waveform, flat_waveform(program, SAMP_RATE, iteration),
+                                   rtol = 0, atol = 2*OSCILLATOR_TOLERANCE)
+        for start, n, phase in ((0, 100, (0, 180)[iteration]),
+                                (300, 300, 0), (600, 300, 90), (900, 300, 180),
+                                (1200, 100, 0), (2400, 100, 180)):
+            expected = synthesize(np.empty(n), 1000, phase, 1, SAMP_RATE, start)
+            np.testing.assert_allclose(waveform[start:start+n], expected, rtol = 0,
+                                       atol = 2*OSCILLATOR_TOLERANCE)
+
+
+def test_batch_matches_single_iterations(tmp_path):
+    for path in (os.path.join(PULSE_FOLDER, 'model_sequence.txt'), pulse_file(tmp_path, NESTED)):
+        program = PulseProgram(path)
+        batch = program.waveforms(SAMP_RATE, range(4))
+        for index in range(4):
+            np.testing.assert_allclose(batch.waveform(index), program.waveform(SAMP_RATE, index),
+                                       rtol = 0, atol = 1e-12)
+
+
+@pytest.mark.parametrize('iteration', [0, 1, 3])
+def test_span_is_a_slice_of_the_waveform(tmp_path, iteration):
+    '''
+    spans across items, across and inside the copies of nested loops, of
+    shaped pulses and past the ends of the sequence
+    '''
+    shaped = NESTED.replace('2 p2 freq1 pw1 ph1', '2 p2 freq1 pw1 ph1 gauss:2')
+    paths = [os.path.join(PULSE_FOLDER, name) for name in ('nutation.txt', 'cpmg_sequence.txt')]
+    paths += [pulse_file(tmp_path, NESTED), pulse_file(tmp_path, shaped, 'shaped.txt')]
+    for path in paths:
+        program = PulseProgram(path)
+        waveform = program.waveform(SAMP_RATE, iteration)
+        n = len(waveform)
+        for start, stop in ((0, 50), (90, 110), (250, 1350), (1199, 1201), (n//3, 2*n//3),
+                            (n - 150, n + 80), (-30, 40), (700, 700), (n + 5, n + 10)):
+            span = program.span(SAMP_RATE, iteration, start, stop)
+            np.testing.assert_allclose(span, waveform[max(start, 0):max(min(stop, n), 0)], rtol = 0,
+                                       atol = 2*OSCILLATOR_TOLERANCE, err_msg = f'{path} {start} {stop}')
+        assert program.span(SAMP_RATE, iteration, 0, n, np.float32).dtype == np.float32
+
+
+def test_delays_clear_a_reused_buffer():
+    delay = Delay([0.001, 0.001], 0)
+    out = np.ones((3, 500))
+    delay.write_batch(out, SAMP_RATE, np.array([0, 50, 300]), delay.nop_array(SAMP_RATE, [0, 1, 2]),
+                      np.arange(3))
+    for row, (start, n) in enumerate(((0, 100), (50, 200), (300, 300))):
+        stop = min(start + n, 500)
+        assert not out[row, start:stop].any()
+        assert (out[row, :start] == 1).all() and (out[row, stop:] == 1).all()
+
+
+def test_unbalanced_loops_are_refused(tmp_path):
+    header = NESTED.split('configuration:')[0] + 'configuration:\n'
+    with pytest.raises(ValueError, match = 'without an end'):
+        PulseProgram(pulse_file(tmp_path, header + 'loop 2\n1 d1\n', 'open.txt'))
+    with pytest.raises(ValueError, match = 'without a loop'):
+        PulseProgram(pulse_file(tmp_path, header + '1 d1\nend\n', 'close.txt'))
+    with pytest.raises(ValueError):
+        Loop(0, [Delay([0.001], 0)])
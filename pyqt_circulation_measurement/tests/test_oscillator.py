@@ -0,0 +1,58 @@
+'''
+accuracy of the phase accumulator oscillator against np.cos and against the
+former np.linspace time axis
+'''
+import numpy as np
+import pytest
+
+from oscillator import (OSCILLATOR_TOLERANCE, BLOCK_SIZE, synthesize, reference, max_error,
+                        legacy_error, legacy_bound)
+
+SAMP_RATES = (1e6, 1e7, 1e8, 1e9)
+
+
+@pytest.mark.parametrize('samp_freq', SAMP_RATES)
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_max_error_within_tolerance(samp_freq, dtype):
+    '''
+    start indices of up to a few seconds, further out the float64 time axis
+    of reference() is no longer exact enough to compare with
+    '''
+    for frequency, phase, power in ((31200, 0, 1), (31200, 37.5, 2), (1.234567e5, 270, 0.5)):
+        for start_index in (0, 12345, 10**7 + 3):
+            error = max_error(3*BLOCK_SIZE + 17, frequency, samp_freq, phase, power, start_index, dtype)
+            assert error <= OSCILLATOR_TOLERANCE*power
+
+
+def test_float32_output_is_float32():
+    out = synthesize(np.empty(1000, dtype = np.float32), 31200, 0, 1, 1e8)
+    assert out.dtype == np.float32
+
+
+def test_phase_continues_across_segments():
+    '''
+    two segments written at their start index are one waveform
+    '''
+    n = 5000
+    whole = synthesize(np.empty(2*n), 31200, 10, 1.5, 1e7)
+    first = synthesize(np.empty(n), 31200, 10, 1.5, 1e7, 0)
+    second = synthesize(np.empty(n), 31200, 10, 1.5, 1e7, n)
+    np.testing.assert_array_equal(whole, np.concatenate((first, second)))
+
+
+def test_matches_reference_at_low_rates():
+    out = synthesize(np.empty(20000), 31200, 45, 1, 250000, 99)
+    np.testing.assert_allclose(out, reference(20000, 31200, 45, 1, 250000, 99),
+                               rtol = 0, atol = OSCILLATOR_TOLERANCE)
+
+
+@pytest.mark.parametrize('samp_freq', (250000, 1e6, 1e8))
+def test_legacy_error_within_bound(samp_freq):
+    '''
+    the pulses of model_sequence, whose int() truncated lengths stretched the
+    old time axis by up to two samples
+    '''
+    for duration, power in ((0.1, 2), (0.08, 1), (0.05, 1), (0.09, 3)):
+        for start_index in (0, int(0.11*samp_freq)):
+            error = legacy_error(duration, 31200, samp_freq, 0, power, start_index)
+            assert error <= legacy_bound(31200, samp_freq, power) + OSCILLATOR_TOLERANCE*power
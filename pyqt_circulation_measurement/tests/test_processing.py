@@ -0,0 +1,92 @@
+'''
+the spectra of the worker processes against the same SpectrumEngine in
+process
+'''
+import numpy as np
+import pytest
+
+from processing import SpectrumProcessPool, reduce_spectra
+from spectrum import SpectrumEngine
+
+SAMP_RATE = 250000
+TIMEOUT = 30
+
+
+def snapshot(seed, points = 5000, frequency = 31200):
+    rng = np.random.default_rng(seed)
+    t = np.arange(points)/SAMP_RATE
+    rows = 0.01*rng.standard_normal((3, points))
+    rows[0] += np.cos(2*np.pi*frequency*t)
+    rows[1] += 0.3*np.sin(2*np.pi*(frequency + 500)*t)
+    return rows
+
+
+def collect(pool, count):
+    '''
+    the results of count snapshots, oldest first within every poll only
+    '''
+    finished = []
+    while len(finished) < count:
+        results = pool.poll(timeout = TIMEOUT)
+        assert results
+        finished += results
+    return finished
+
+
+@pytest.fixture(scope = 'module')
+def pool():
+    pool = SpectrumProcessPool(workers = 2)
+    yield pool
+    pool.close()
+
+
+def test_reduce_spectra_finds_the_highest_peak():
+    axis = np.array([10.0, 20.0, 30.0])
+    spectra = np.array([[1, -3j, 2], [0.5, 0, -4]])
+    assert reduce_spectra(axis, spectra) == [(20.0, 3.0), (30.0, 4.0)]
+
+
+@pytest.mark.parametrize('window, band', [('rect', None), ('hann', (30000, 33000))])
+def test_spectra_match_the_engine(pool, window, band):
+    engine = SpectrumEngine(SAMP_RATE, window, band, zoom_points = 600)
+    pool.configure(engine, (3, 5000), np.float64)
+    for seed in range(2):
+        data = snapshot(seed)
+        assert pool.submit(data)
+        assert pool.busy()
+        (axis, spectra, reductions), = collect(pool, 1)
+        assert not pool.busy()
+        expected_axis, expected = engine.spectrum(data)
+        np.testing.assert_array_equal(axis, expected_axis)
+        np.testing.assert_allclose(spectra, expected, rtol = 0, atol = 1e-9*abs(expected).max())
+        assert reductions == pytest.approx(reduce_spectra(expected_axis, expected))
+    assert reductions[0][0] == pytest.approx(31200, abs = 2*SAMP_RATE/5000)
+
+
+def test_submit_refuses_when_every_worker_is_busy(pool):
+    engine = SpectrumEngine(SAMP_RATE)
+    pool.configure(engine, (3, 5000), np.float64)
+    assert pool.submit(snapshot(0))
+    assert pool.submit(snapshot(1))
+    assert not pool.submit(snapshot(2))
+    assert not pool.submit(snapshot(3, points = 400))
+    assert len(collect(pool, 2)) == 2
+    assert not pool.busy()
+    assert pool.submit(snapshot(2))
+    pool.wait_idle()
+
+
+def test_new_shape_and_band_reach_the_workers(pool):
+    engine = SpectrumEngine(SAMP_RATE, zoom_points = 300)
+    pool.configure(engine, (3, 5000), np.float64)
+    data = snapshot(5, points = 3000)
+    assert not pool.submit(data)
+    pool.configure(engine, data.shape, np.float64)
+    engine.set_band((30000, 32000))
+    pool.set_engine(engine)
+    assert pool.submit(data)
+    (axis, spectra, _), = collect(pool, 1)
+    expected_axis, expected = engine.spectrum(data)
+    assert spectra.shape == (3, 300)
+    np.testing.assert_array_equal(axis, expected_axis)
+    np.testing.assert_allclose(spectra, expected, rtol = 0, atol = 1e-9*abs(expected).max())
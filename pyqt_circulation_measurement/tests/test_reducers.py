@@ -0,0 +1,106 @@
+'''
+the reducers against a direct computation and the file of the reduced curves
+'''
+import os
+
+import numpy as np
+import pytest
+
+from reducers import SpectralPeak, TimeAmplitude, ReductionStage, parse_reducers, open_reduction
+
+SAMP_RATE = 250000
+N = 5000
+BAND = (31000.0, 31400.0)
+
+
+def direct_peak(rows, band, points, center = 0):
+    '''
+    the mean magnitude of a direct DFT at points frequencies across band,
+    times the width of the band, scaled to the amplitude of a tone
+    '''
+    frequencies = np.linspace(*band, points)
+    n = np.arange(rows.shape[1])
+    kernel = np.exp(-2j*np.pi*np.outer(n, frequencies - center)/SAMP_RATE)
+    scale = 1/rows.shape[1] if np.iscomplexobj(rows) else 2/rows.shape[1]
+    return np.abs(scale*rows @ kernel).mean(axis = 1)*(band[1] - band[0])
+
+
+def tones(amplitudes, frequency = 31210, n = N):
+    t = np.arange(n)/SAMP_RATE
+    return np.outer(amplitudes, np.cos(2*np.pi*frequency*t + 0.4))
+
+
+def test_spectral_peak_matches_a_direct_dft():
+    rows = tones([1.0, 0.25, 0.0])
+    peak = SpectralPeak(SAMP_RATE, BAND[::-1], points = 129)
+    assert peak.band == list(BAND)
+    values = peak(0, rows)
+    np.testing.assert_allclose(values, direct_peak(rows, BAND, 129), rtol = 1e-7, atol = 1e-12)
+    assert values[1] == pytest.approx(values[0]/4)
+    assert peak.settings() == {'band': list(BAND), 'points': 129, 'window': 'rect'}
+
+
+def test_spectral_peak_of_the_baseband_uses_the_center_of_the_iteration():
+    t = np.arange(N)/SAMP_RATE
+    centers = [31100.0, 31250.0]
+    peak = SpectralPeak(SAMP_RATE, BAND, points = 129, centers = centers)
+    for iteration, center in enumerate(centers):
+        rows = np.outer([0.5, 0.1j, 0], np.exp(2j*np.pi*(31210 - center)*t))
+        np.testing.assert_allclose(peak(iteration, rows), direct_peak(rows, BAND, 129, center),
+                                   rtol = 1e-7, atol = 1e-12)
+
+
+def test_time_amplitude_matches_the_rms_of_the_window():
+    time_axis = 1e-4 + np.arange(N)/SAMP_RATE
+    rng = np.random.default_rng(6)
+    rows = tones([1.0, 0.3, 0.0]) + rng.normal(scale = 0.01, size = (3, N)) + 2.0
+    amplitude = TimeAmplitude(time_axis, (0.012, 0.002))
+    start, stop = np.searchsorted(time_axis, [0.002, 0.012])
+    np.testing.assert_allclose(amplitude(0, rows), np.sqrt(2)*rows[:, start:stop].std(axis = 1))
+    np.testing.assert_allclose(amplitude(0, rows)[:2], [1.0, 0.3], rtol = 0.02)
+    assert amplitude.settings() == {'window': [0.002, 0.012]}
+
+
+def test_time_amplitude_of_the_baseband_is_signed():
+    time_axis = np.arange(N)/SAMP_RATE
+    rows = np.array([[0.4 + 0.1j], [-0.2 + 0.5j], [0j]])*np.ones(N)
+    np.testing.assert_allclose(TimeAmplitude(time_axis, (0.001, 0.002))(0, rows), [0.4, -0.2, 0])
+
+
+def test_time_amplitude_of_an_empty_window_takes_one_point():
+    time_axis = np.arange(N)/SAMP_RATE
+    amplitude = TimeAmplitude(time_axis, (0.0050001, 0.0050002))
+    assert amplitude.index.stop - amplitude.index.start == 1
+
+
+def test_parse_reducers():
+    assert parse_reducers('off') == []
+    assert parse_reducers(' ') == []
+    assert parse_reducers('peak, amplitude') == ['peak', 'amplitude']
+    with pytest.raises(ValueError):
+        parse_reducers('peak,area')
+
+
+def test_reduction_stage_file(tmp_path):
+    file_name = os.path.join(tmp_path, 'run')
+    time_axis = np.arange(N)/SAMP_RATE
+    reducers = [SpectralPeak(SAMP_RATE, BAND, points = 65), TimeAmplitude(time_axis, (0.001, 0.019))]
+    stage = ReductionStage(file_name, reducers, ('pulse length', [1e-4, 2e-4, 3e-4]))
+    snapshots = {0: tones([1.0, 0.5, 0.0]), 2: tones([0.2, 0.1, 0.0])}
+    for iteration, rows in snapshots.items():
+        stage.add(iteration, rows, 16)
+    stage.close()
+    assert stage.count == 2
+
+    header, values = open_reduction(file_name)
+    assert header['reducers'] == ['peak', 'amplitude']
+    assert header['axis_name'] == 'pulse length'
+    assert header['averages'] == [16, 0, 16]
+    assert values.shape == (3, 2, 3)
+    assert np.isnan(values[1]).all()
+    for iteration, rows in snapshots.items():
+        np.testing.assert_allclose(values[iteration, 0], reducers[0](iteration, rows))
+        np.testing.assert_allclose(values[iteration, 1], reducers[1](iteration, rows))
+    axis, curve = stage.curve('amplitude', 'nsor')
+    np.testing.assert_allclose(axis, [1e-4, 2e-4, 3e-4])
+    np.testing.assert_allclose(curve[[0, 2]], [0.5, 0.1], rtol = 1e-3)
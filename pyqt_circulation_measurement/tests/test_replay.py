@@ -0,0 +1,123 @@
+'''
+the offline replay against the processing of the live run and of the same
+settings in process
+'''
+import os
+
+import numpy as np
+import pytest
+
+from dataset import ShotDataset, open_dataset, read_header
+from engine import AcquisitionEngine, read_parameter
+from reducers import open_reduction
+from replay import Replay, find_runs, read_ahead, replay, replay_batch
+from simulated_daq import SimulatedBackend
+from spectrum import SpectrumEngine
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMP_RATE = 250000
+
+
+def live_run(folder, ai_format = 'float64', name = 'run'):
+    '''
+    a short nutation run on the simulated card, with the live reduction
+    '''
+    parameters = read_parameter(os.path.join(PACKAGE, 'parameter.txt'))
+    parameters.update({'file_name': os.path.join(folder, name), 'iteration': '3', 'average': '2',
+                       'ai_format': ai_format, 'daq_backend': 'simulated', 'cache_folder': '',
+                       'telemetry': 'off', 'time_cursor': ['0.001', '0.05']})
+    backend = SimulatedBackend(noise = 0.01, time_scale = 0, arm_time = 0, seed = 1)
+    engine = AcquisitionEngine(parameters, backend)
+    engine.configure(os.path.join(PACKAGE, 'pulse_sequences', 'nutation.txt'))
+    engine.prepare_run()
+    try:
+        engine.run()
+    finally:
+        engine.close()
+    return parameters['file_name']
+
+
+def synthetic_run(folder, name = 'synthetic', iterations = 4, points = 3000, completed = 3):
+    rng = np.random.default_rng(len(name))
+    file_name = os.path.join(folder, name)
+    dataset = ShotDataset.create(file_name, iterations, points, SAMP_RATE,
+                                 {'freq_cursor': ['31100', '31300'], 'time_cursor': ['0', '0.01'],
+                                  'freq_x_limit': ['31000', '31400'], 'spectrum_window': 'hann'})
+    t = np.arange(points)/SAMP_RATE
+    for iteration in range(completed):
+        data = 0.01*rng.standard_normal((3, points))
+        data[0] += (iteration + 1)*np.cos(2*np.pi*31200*t)
+        dataset.write(iteration, data, 8)
+    dataset.close()
+    return file_name
+
+
+@pytest.mark.parametrize('ai_format', ['float64', 'int16'])
+def test_replay_reproduces_the_live_reduction(tmp_path, ai_format):
+    file_name = live_run(str(tmp_path), ai_format)
+    summary = replay(file_name)
+    assert summary['iterations'] == 3
+    live_header, live = open_reduction(file_name)
+    header, values = open_reduction(file_name + '_replay')
+    assert header['axis'] == live_header['axis']
+    assert header['averages'] == live_header['averages'] == [2, 2, 2]
+    np.testing.assert_allclose(values, live, rtol = 1e-12, atol = 0)
+
+
+def test_replay_matches_an_in_process_pass(tmp_path):
+    '''
+    reduced curves and spectra of the replay are the reducers and the
+    SpectrumEngine applied to every iteration of the dataset
+    '''
+    file_name = synthetic_run(str(tmp_path))
+    overrides = {'spectrum_zoom': 'on', 'spectrum_points': '401'}
+    run = Replay(file_name, overrides, spectra = True)
+    summary = run.run()
+    assert summary['outputs'] == [file_name + '_replay_reduced.npy', file_name + '_replay_spectrum.npy']
+    dataset = open_dataset(file_name)
+    engine = SpectrumEngine(SAMP_RATE, 'hann', [31000.0, 31400.0], 401)
+    spectra = np.load(file_name + '_replay_spectrum.npy')
+    spectrum_header = read_header(file_name + '_replay_spectrum')
+    _, values = open_reduction(file_name + '_replay')
+    for iteration in range(3):
+        data = np.asarray(dataset.data[iteration])
+        axis, expected = engine.spectrum(data)
+        np.testing.assert_allclose(spectra[iteration], np.abs(expected), rtol = 1e-12, atol = 1e-15)
+        for index, reducer in enumerate(run.reduction.reducers):
+            np.testing.assert_allclose(values[iteration, index], reducer(iteration, data), rtol = 1e-12)
+    assert spectrum_header['f0'] == axis[0]
+    assert spectrum_header['df'] == pytest.approx(axis[1] - axis[0])
+    assert spectrum_header['iterations'] == [0, 1, 2]
+    assert not spectra[3].any()
+    assert np.isnan(values[3]).all()
+    np.testing.assert_allclose(values[:3, 1, 0], [1, 2, 3], rtol = 0.01)
+
+
+def test_read_ahead_reads_in_order(tmp_path):
+    dataset = open_dataset(synthetic_run(str(tmp_path), iterations = 6, completed = 6))
+    iterations = [0, 2, 3, 5]
+    for (iteration, snapshot), expected in zip(read_ahead(dataset, iterations, prefetch = 1), iterations):
+        assert iteration == expected
+        np.testing.assert_array_equal(snapshot, dataset.data[expected])
+    for iteration, _ in read_ahead(dataset, range(6), prefetch = 1):
+        if iteration == 1:
+            break
+
+
+def test_batch_in_workers_matches_one_by_one(tmp_path):
+    folder = str(tmp_path)
+    runs = [synthetic_run(folder, name) for name in ('first', 'second')]
+    with open(os.path.join(folder, 'notes.json'), 'w') as f:
+        f.write('[1, 2]')
+    assert find_runs(folder) == sorted(runs)
+    single = {}
+    for file_name in runs:
+        replay(file_name)
+        single[file_name] = np.load(file_name + '_replay_reduced.npy')
+    done = []
+    summaries = replay_batch(runs + [os.path.join(folder, 'missing')], workers = 2, on_done = done.append)
+    assert len(summaries) == len(done) == 3
+    failed = [summary for summary in summaries if 'error' in summary]
+    assert [summary['file_name'] for summary in failed] == [os.path.join(folder, 'missing')]
+    for file_name in runs:
+        np.testing.assert_array_equal(np.load(file_name + '_replay_reduced.npy'), single[file_name])
@@ -0,0 +1,84 @@
+'''
+the snapshot ring and its latest-wins readers
+'''
+import threading
+
+import numpy as np
+
+from ring import ShotRing, RingReader
+
+
+def test_latest_wins_and_counts_skipped():
+    ring = ShotRing(4, (3, 5))
+    reader = RingReader(ring)
+    assert reader.latest() is None and not reader.pending()
+    for value in range(3):
+        ring.write(np.full((3, 5), value), value, value + 1)
+    assert reader.pending()
+    sequence, iteration, averages, data = reader.latest()
+    assert (sequence, iteration, averages) == (2, 2, 3)
+    np.testing.assert_array_equal(data, 2)
+    assert reader.skipped == 2
+    assert reader.latest() is None
+
+
+def test_readers_are_independent():
+    ring = ShotRing(2, (1, 3))
+    first, second = RingReader(ring), RingReader(ring)
+    ring.write(np.ones((1, 3)), 0, 1)
+    assert first.latest()[0] == 0
+    ring.write(np.full((1, 3), 2.0), 0, 2)
+    assert first.latest()[0] == 1
+    assert second.latest()[0] == 1 and second.skipped == 1
+
+
+def test_overwritten_or_busy_slot_is_refused():
+    ring = ShotRing(2, (1, 3))
+    out = np.empty((1, 3))
+    for value in range(3):
+        ring.write(np.full((1, 3), value), 0, 1)
+    assert ring.read(0, out) is None
+    assert ring.read(2, out) == (0, 1)
+    ring.version[2 % ring.slots] += 1 # the producer is writing the slot
+    assert ring.read(2, out) is None
+
+
+def test_claimed_slot_is_hidden_until_published():
+    ring = ShotRing(2, (1, 3))
+    reader = RingReader(ring)
+    ring.write(np.ones((1, 3)), 0, 1)
+    slot = ring.claim()
+    slot[:] = 5
+    assert reader.latest()[0] == 0
+    assert ring.read(1, np.empty((1, 3))) is None
+    assert ring.publish(0, 2) == 1
+    sequence, iteration, averages, data = reader.latest()
+    assert (sequence, averages) == (1, 2)
+    np.testing.assert_array_equal(data, 5)
+
+
+def test_concurrent_reads_are_never_torn():
+    '''
+    every row of a snapshot carries its sequence number, a read with mixed
+    rows would be a torn copy
+    '''
+    ring = ShotRing(3, (64, 256))
+    reader = RingReader(ring)
+    done = threading.Event()
+    def produce():
+        for sequence in range(3000):
+            ring.write(np.full((64, 256), float(sequence)), sequence, 1)
+        done.set()
+    producer = threading.Thread(target = produce)
+    producer.start()
+    reads = 0
+    while not done.is_set() or reader.pending():
+        result = reader.latest()
+        if result is not None:
+            sequence, iteration, _, data = result
+            assert iteration == sequence
+            assert np.all(data == sequence)
+            reads += 1
+    producer.join()
+    assert reads > 0
+    assert reader.last == 2999
@@ -0,0 +1,161 @@
+'''
+the simulated daq card: the spin system, the ao and ai tasks and the readers
+and writers of the nidaqmx api it stands in for
+'''
+import threading
+
+import numpy as np
+import pytest
+
+from simulated_daq import SimulatedBackend, SpinSystem, AcquisitionType
+
+SAMP_RATE = 250000
+
+
+def pulse(amplitude, points, frequency, total):
+    waveform = np.zeros(total)
+    waveform[:points] = amplitude*np.cos(2*np.pi*frequency*np.arange(points)/SAMP_RATE)
+    return waveform
+
+
+def make_tasks(backend, samples, mode = AcquisitionType.FINITE, channels = 3):
+    ao = backend.task('ao')
+    ao.ao_channels.add_ao_voltage_chan('Dev1/ao0')
+    ao.timing.cfg_samp_clk_timing(SAMP_RATE, sample_mode = mode, samps_per_chan = samples)
+    ai = backend.task('ai')
+    for channel in range(channels):
+        ai.ai_channels.add_ai_voltage_chan(f'Dev1/ai{channel}')
+    ai.timing.cfg_samp_clk_timing(SAMP_RATE, source = '/Dev1/ao/SampleClock',
+                                  sample_mode = mode, samps_per_chan = samples)
+    return ao, ai
+
+
+def test_pi_half_pulse_tips_the_full_magnetization():
+    '''
+    a pulse of area 1/(4*rabi) on resonance gives an fid of the full
+    amplitude, which decays with t2
+    '''
+    system = SpinSystem(larmor = 31250, rabi = 50, t2 = 0.01, amplitude = 0.5, feedthrough = 0)
+    points = 500
+    amplitude = 1/(4*system.rabi*points/SAMP_RATE)
+    response = system.respond(pulse(amplitude, points, system.larmor, 5000), SAMP_RATE, 3)
+    assert np.all(response[0, :points] == 0)
+    fid = response[0, points:]
+    assert abs(fid[:100]).max() == pytest.approx(0.5, rel = 1e-3)
+    decay = np.exp(-4000/(system.t2*SAMP_RATE))
+    assert abs(fid[4000:4100]).max() == pytest.approx(0.5*decay, rel = 1e-3)
+    assert abs(response[1, points:]).max() == pytest.approx(0.05, rel = 1e-3)
+    np.testing.assert_array_equal(response[2], system.laser)
+
+
+def test_pi_pulse_leaves_no_fid():
+    system = SpinSystem(larmor = 31250, rabi = 50, feedthrough = 0)
+    points = 1000
+    amplitude = 1/(2*system.rabi*points/SAMP_RATE)
+    response = system.respond(pulse(amplitude, points, system.larmor, 3000), SAMP_RATE, 1)
+    assert abs(response[0]).max() < 1e-3*system.amplitude
+
+
+def test_finite_read_is_the_response_to_the_dac_output():
+    backend = SimulatedBackend(noise = 0, time_scale = 0, arm_time = 0, feedthrough = 0.1)
+    ao, ai = make_tasks(backend, 4000)
+    waveform = pulse(2.0, 400, 31200, 4000)
+    assert ao.write(waveform) == 4000
+    ao.start()
+    ai.start()
+    ai.wait_until_done()
+    data = np.zeros((3, 4000))
+    assert backend.reader(ai).read_many_sample(data, number_of_samples_per_channel = 4000) == 4000
+    output = backend.dac_scaling.volts(backend.dac_scaling.codes(waveform)[0])
+    np.testing.assert_allclose(data, backend.system.respond(output, SAMP_RATE, 3))
+    np.testing.assert_allclose(ai.read(number_of_samples_per_channel = 4000), data)
+
+
+def test_continuous_read_repeats_the_response():
+    backend = SimulatedBackend(noise = 0, time_scale = 0, arm_time = 0)
+    ao, ai = make_tasks(backend, 1000, AcquisitionType.CONTINUOUS, channels = 1)
+    ao.write(pulse(1.0, 100, 31200, 1000))
+    ao.start()
+    ai.start()
+    reader = backend.reader(ai)
+    shots = np.zeros((3, 1, 700))
+    for shot in shots:
+        reader.read_many_sample(shot, 700)
+    response = backend.device('Dev1').response(1)
+    np.testing.assert_allclose(np.concatenate(shots, axis = 1), np.tile(response, 3)[:, :2100])
+    with pytest.raises(RuntimeError):
+        ai.wait_until_done()
+
+
+def test_noise_has_the_given_deviation():
+    backend = SimulatedBackend(noise = 0.05, time_scale = 0, arm_time = 0, seed = 4)
+    ao, ai = make_tasks(backend, 20000, channels = 3)
+    ao.write(np.zeros(20000))
+    data = np.zeros((3, 20000))
+    backend.reader(ai).read_many_sample(data, 20000)
+    assert data[0].std() == pytest.approx(0.05, rel = 0.05)
+    assert data[2].mean() == pytest.approx(backend.system.laser, abs = 0.005)
+
+
+def test_write_refuses_points_outside_the_range():
+    backend = SimulatedBackend()
+    ao, _ = make_tasks(backend, 10)
+    with pytest.raises(ValueError):
+        ao.write(np.full(10, 10.5))
+
+
+def test_unscaled_writer_loads_the_codes():
+    backend = SimulatedBackend()
+    ao, _ = make_tasks(backend, 5)
+    codes = np.array([[-32768, -1, 0, 1, 32767]], dtype = np.int16)
+    assert backend.unscaled_writer(ao).write_int16(codes) == 5
+    device = backend.device('Dev1')
+    np.testing.assert_array_equal(device.codes, codes[0])
+    np.testing.assert_allclose(device.waveform, backend.dac_scaling.volts(codes[0]))
+    with pytest.raises(ValueError):
+        backend.unscaled_writer(ao).write_int16(codes[0])
+    with pytest.raises(ValueError):
+        backend.unscaled_writer(ao).write_int16(codes.astype(np.int32))
+
+
+def test_unscaled_reader_returns_the_adc_codes():
+    backend = SimulatedBackend(noise = 0, time_scale = 0, arm_time = 0)
+    ao, ai = make_tasks(backend, 3000)
+    ao.write(pulse(1.0, 300, 31200, 3000))
+    volts = np.zeros((3, 3000))
+    backend.reader(ai).read_many_sample(volts, 3000)
+    codes = np.zeros((3, 3000), dtype = np.int16)
+    backend.unscaled_reader(ai).read_int16(codes, number_of_samples_per_channel = 3000)
+    scaling = backend.ai_scaling(ai)
+    np.testing.assert_array_equal(codes, scaling.codes(volts))
+    np.testing.assert_allclose(scaling.volts(codes), volts, rtol = 0, atol = 10/32768/2 + 1e-12)
+    with pytest.raises(TypeError):
+        backend.unscaled_reader(ai).read_int16(volts, 3000)
+    with pytest.raises(TypeError):
+        backend.reader(ai).read_many_sample(codes, 3000)
+
+
+def test_every_n_samples_event_follows_the_ao_clock():
+    backend = SimulatedBackend(noise = 0, time_scale = 0.01, arm_time = 0)
+    ao, ai = make_tasks(backend, 1000, AcquisitionType.CONTINUOUS)
+    ao.write(np.zeros(1000))
+    calls = []
+    done = threading.Event()
+    def acquired(task_handle, event_type, number_of_samples, callback_data):
+        calls.append(number_of_samples)
+        if len(calls) == 5:
+            done.set()
+        return 0
+    ai.register_every_n_samples_acquired_into_buffer_event(1000, acquired)
+    ai.start()
+    with pytest.raises(RuntimeError):
+        ai.register_every_n_samples_acquired_into_buffer_event(1000, acquired)
+    ao.start()
+    assert done.wait(5)
+    ai.stop()
+    ao.stop()
+    count = len(calls)
+    assert calls == [1000]*count
+    ai.start()
+    ai.stop()
+    assert len(calls) == count
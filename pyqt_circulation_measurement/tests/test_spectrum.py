@@ -0,0 +1,128 @@
+'''
+SpectrumEngine against a direct DFT
+'''
+import numpy as np
+import pytest
+
+from spectrum import SpectrumEngine, WINDOWS, ZOOM_ATTENUATION, decimation_filter, next_fast_len
+
+SAMP_RATE = 250000
+
+
+def alias_tolerance(rows, samp_rate, band, window, scale):
+    '''
+    the zoom of decimated rows is exact up to the aliasing through the stopband
+    of its filter, for noise about ZOOM_ATTENUATION dB times the square root of
+    the factor below the largest point of the whole spectrum
+    '''
+    factor, _ = decimation_filter(samp_rate, band[1] - band[0])
+    spectrum = scale*np.abs(np.fft.fft(rows*window, axis = -1)).max()
+    return 10**(-ZOOM_ATTENUATION/20)*np.sqrt(factor)*spectrum
+
+
+def direct_dft(rows, frequencies, samp_rate, window, scale):
+    '''
+    scale*sum(window[n]*rows[n]*exp(-2i*pi*f*n/samp_rate)) for every f
+    '''
+    n = np.arange(rows.shape[1])
+    kernel = np.exp(-2j*np.pi*np.outer(n, frequencies)/samp_rate)
+    return scale*(rows*window) @ kernel
+
+
+def smooth(m):
+    for p in (2, 3, 5):
+        while m % p == 0:
+            m //= p
+    return m == 1
+
+
+def test_next_fast_len():
+    '''
+    the smallest 5-smooth length, checked against a search for small n
+    '''
+    for n in range(1, 2000):
+        assert next_fast_len(n) == next(m for m in range(n, 2*n + 1) if smooth(m))
+    for n in (151150, 10**6 + 1):
+        assert next_fast_len(n) >= n and smooth(next_fast_len(n))
+
+
+@pytest.mark.parametrize('window', list(WINDOWS))
+def test_zoom_matches_direct_dft(window):
+    rng = np.random.default_rng(1)
+    rows = rng.normal(size = (3, 5001))
+    band = (31000.0, 31400.0)
+    engine = SpectrumEngine(SAMP_RATE, window, band, 301)
+    axis, spectra = engine.spectrum(rows)
+    np.testing.assert_allclose(axis, np.linspace(*band, 301))
+    weights = WINDOWS[window](rows.shape[1])
+    expected = direct_dft(rows, axis, SAMP_RATE, weights, 2/weights.sum())
+    np.testing.assert_allclose(spectra, expected, rtol = 0,
+                               atol = alias_tolerance(rows, SAMP_RATE, band, weights, 2/weights.sum()))
+
+
+@pytest.mark.parametrize('n', [5000, 5001, 6240])
+def test_zoom_of_a_tone_is_exact(n):
+    '''
+    without noise outside of the band there is nothing to alias, the filter
+    itself is divided out exactly, whatever the length of the last block
+    '''
+    t = np.arange(n)/SAMP_RATE
+    rows = np.stack((np.cos(2*np.pi*31210*t + 0.3), 0.5*np.sin(2*np.pi*31330*t)))
+    band = (31000.0, 31400.0)
+    axis, spectra = SpectrumEngine(SAMP_RATE, 'hann', band, 257).spectrum(rows)
+    weights = np.hanning(n)
+    expected = direct_dft(rows, axis, SAMP_RATE, weights, 2/weights.sum())
+    np.testing.assert_allclose(spectra, expected, rtol = 0, atol = 1e-7*np.abs(expected).max())
+
+
+def test_wide_band_is_exact():
+    '''
+    a band too wide to decimate goes through the chirp z transform directly
+    '''
+    rng = np.random.default_rng(4)
+    rows = rng.normal(size = (2, 3001))
+    band = (10000.0, 90000.0)
+    engine = SpectrumEngine(SAMP_RATE, 'rect', band, 401)
+    axis, spectra = engine.spectrum(rows)
+    assert engine.decimator(3001, band) is None
+    expected = direct_dft(rows, axis, SAMP_RATE, np.ones(3001), 2/3001)
+    np.testing.assert_allclose(spectra, expected, rtol = 0, atol = 1e-9*np.abs(expected).max())
+
+
+def test_complex_zoom_around_center():
+    '''
+    the baseband of the lock-in, the axis is in absolute Hz
+    '''
+    rng = np.random.default_rng(2)
+    rows = rng.normal(size = (2, 800)) + 1j*rng.normal(size = (2, 800))
+    center = 31200.0
+    engine = SpectrumEngine(2500, 'hann', (31000.0, 31400.0), 129, center)
+    axis, spectra = engine.spectrum(rows)
+    weights = np.hanning(800)
+    expected = direct_dft(rows, axis - center, 2500, weights, 1/weights.sum())
+    np.testing.assert_allclose(spectra, expected, rtol = 0,
+                               atol = alias_tolerance(rows, 2500, (-200, 200), weights, 1/weights.sum()))
+
+
+def test_full_spectrum_matches_direct_dft():
+    rng = np.random.default_rng(3)
+    rows = rng.normal(size = (3, 1000))
+    axis, spectra = SpectrumEngine(SAMP_RATE).spectrum(rows)
+    n_fft = next_fast_len(1000)
+    np.testing.assert_allclose(axis, np.fft.rfftfreq(n_fft, 1/SAMP_RATE))
+    pick = [0, 17, 100, len(axis) - 1]
+    expected = direct_dft(rows, axis[pick], SAMP_RATE, np.ones(1000), 2/1000)
+    np.testing.assert_allclose(spectra[:, pick], expected, rtol = 0, atol = 1e-10)
+
+
+def test_peak_height_is_amplitude():
+    '''
+    a cosine on a bin shows up with its amplitude
+    '''
+    n = 150000
+    frequency = 250*SAMP_RATE/n
+    t = np.arange(n)/SAMP_RATE
+    rows = np.stack((0.7*np.cos(2*np.pi*frequency*t), 0.2*np.cos(2*np.pi*frequency*t + 1)))
+    for window in WINDOWS:
+        axis, spectra = SpectrumEngine(SAMP_RATE, window, (frequency - 50, frequency + 50), 101).spectrum(rows)
+        np.testing.assert_allclose(np.abs(spectra[:, 50]), [0.7, 0.2], rtol = 1e-3)
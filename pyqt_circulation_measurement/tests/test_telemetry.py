@@ -0,0 +1,32 @@
+'''
+the telemetry records and the durations added to them afterwards
+'''
+import numpy as np
+
+from telemetry import Telemetry, STAGE_INDEX
+
+
+def test_stages_and_late_adds():
+    telemetry = Telemetry(4)
+    for shot in range(6):
+        telemetry.begin(0, shot)
+        telemetry.mark('read')
+        telemetry.add('save', 0.5)
+    telemetry.add('plot', 1.0, 5)
+    telemetry.add('plot', 1.0, 1) # recycled
+    telemetry.add('plot', 1.0, 6) # not begun yet
+    records = telemetry.snapshot()
+    np.testing.assert_array_equal(records[:, 0], [2, 3, 4, 5])
+    np.testing.assert_array_equal(records[:, STAGE_INDEX['save']], 0.5)
+    np.testing.assert_array_equal(records[:, STAGE_INDEX['plot']], [0, 0, 0, 1.0])
+    assert set(telemetry.summary()['stages']) == {'read', 'save', 'plot'}
+
+
+def test_stages_without_time_are_left_out():
+    telemetry = Telemetry(4)
+    telemetry.begin(0, 0)
+    telemetry.add('read', 0.25)
+    summary = telemetry.summary()
+    assert summary['stages'] == {'read': {'mean': 0.25, 'max': 0.25}}
+    assert Telemetry(4).summary()['stages'] == {}
+
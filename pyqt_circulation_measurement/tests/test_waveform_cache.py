@@ -0,0 +1,110 @@
+'''
+the two tiers of the waveform cache: LRU eviction in memory, hits and the
+byte budget on disk, and new keys when a pulse file or its shape table changes
+'''
+import os
+import textwrap
+
+import numpy as np
+
+import waveform_cache
+from nmr_pulses import PulseProgram
+from waveform_cache import WaveformCache, waveform_key
+
+SAMP_RATE = 100000
+
+SHAPED = '''
+constant:
+repeat_pos = 0 0
+repeat_num = 1
+ph1 = 0
+pw1 = 1
+freq1 = 1000
+p1 = 0.002
+d1 = 0.001
+configuration:
+0 d1
+1 p1 freq1 pw1 ph1 table:shape.txt
+2 d1
+'''
+
+
+def shaped_program(tmp_path, table):
+    with open(os.path.join(tmp_path, 'shape.txt'), 'w') as f:
+        f.write(table)
+    path = os.path.join(tmp_path, 'shaped.txt')
+    with open(path, 'w') as f:
+        f.write(textwrap.dedent(SHAPED).lstrip())
+    return PulseProgram(path)
+
+
+def disk_files(folder):
+    return sorted(name for name in os.listdir(folder) if name.endswith('.npy'))
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+    cache = WaveformCache(max_bytes = 3*800)
+    for key in 'abc':
+        cache.put(key, np.zeros(100))
+    assert cache.get('a') is not None
+    cache.put('d', np.zeros(100))
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.nbytes == 3*800
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.put('e', np.zeros(300))
+    assert list(cache.entries) == ['e']
+
+
+def test_disk_hits_survive_a_new_cache(tmp_path):
+    program = shaped_program(tmp_path, '0\n1\n0\n')
+    folder = os.path.join(tmp_path, 'cache')
+    expected = WaveformCache(cache_folder = folder).waveform(program, SAMP_RATE, 1)
+    cache = WaveformCache(cache_folder = folder)
+    data = cache.waveform(program, SAMP_RATE, 1)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert isinstance(data, np.memmap)
+    np.testing.assert_array_equal(data, expected)
+    np.testing.assert_array_equal(data, program.waveform(SAMP_RATE, 1))
+
+
+def test_a_changed_table_is_a_new_key(tmp_path):
+    program = shaped_program(tmp_path, '0\n1\n0\n')
+    cache = WaveformCache(cache_folder = os.path.join(tmp_path, 'cache'))
+    key = waveform_key(program.file_path, SAMP_RATE, 0, program.table_files)
+    triangle = cache.waveform(program, SAMP_RATE, 0)
+    program = shaped_program(tmp_path, '1\n1\n1\n')
+    assert waveform_key(program.file_path, SAMP_RATE, 0, program.table_files) != key
+    square = cache.waveform(program, SAMP_RATE, 0)
+    assert cache.misses == 2
+    assert not np.array_equal(square, triangle)
+    np.testing.assert_array_equal(square, program.waveform(SAMP_RATE, 0))
+
+
+def test_disk_tier_keeps_to_its_budget(tmp_path):
+    folder = os.path.join(tmp_path, 'cache')
+    cache = WaveformCache(max_bytes = 0, cache_folder = folder, max_disk_bytes = 3*8128 + 3*128)
+    keys = [f'{index:040x}' for index in range(4)]
+    for age, key in enumerate(keys[:3]):
+        cache.put(key, np.zeros(1016))
+        os.utime(cache._disk_path(key), ns = (age*10**9, age*10**9))
+    assert cache.disk_bytes == 3*os.path.getsize(cache._disk_path(keys[0]))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[3], np.zeros(1016))
+    assert disk_files(folder) == sorted(f'v{waveform_cache.CACHE_VERSION}_{key}.npy'
+                                        for key in (keys[0], keys[2], keys[3]))
+    assert cache.disk_evictions == 1
+    assert cache.disk_bytes <= cache.max_disk_bytes
+
+
+def test_other_versions_are_removed(tmp_path, monkeypatch):
+    folder = os.path.join(tmp_path, 'cache')
+    os.makedirs(folder)
+    for name in (f'{1:040x}.npy', f'v1_{1:040x}.npy', f'v1_{2:040x}_minmax16.npy', 'notes.npy'):
+        np.save(os.path.join(folder, name), np.zeros(4))
+    cache = WaveformCache(cache_folder = folder)
+    cache.put(f'{3:040x}', np.zeros(4))
+    assert disk_files(folder) == ['notes.npy', f'v{waveform_cache.CACHE_VERSION}_{3:040x}.npy']
+    monkeypatch.setattr(waveform_cache, 'CACHE_VERSION', waveform_cache.CACHE_VERSION + 1)
+    WaveformCache(cache_folder = folder)
+    assert disk_files(folder) == ['notes.npy']
@@ -0,0 +1,95 @@
+'''
+the min/max pyramid of the pulse visualizer against a brute force decimation
+of the whole waveform
+'''
+import os
+
+import numpy as np
+import pytest
+
+import waveform_pyramid
+from nmr_pulses import PulseProgram
+from oscillator import OSCILLATOR_TOLERANCE
+from waveform_cache import WaveformCache
+from waveform_pyramid import MinMaxPyramid, minmax_bins, BASE_BIN, LEVEL_FACTOR, FULL_POINTS_PER_PIXEL
+
+PULSE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pulse_sequences')
+SAMP_RATE = 250000
+
+
+def brute_force(waveform, size):
+    '''
+    min and max of every size points, the last bin holds what is left
+    '''
+    starts = range(0, len(waveform), size)
+    return np.array([[waveform[start:start+size].min() for start in starts],
+                     [waveform[start:start+size].max() for start in starts]])
+
+
+def test_minmax_bins():
+    data = np.array([3.0, -1, 4, 1, -5, 9, 2])
+    np.testing.assert_array_equal(minmax_bins(data, 3), [[-1, -5, 2], [4, 9, 2]])
+    np.testing.assert_array_equal(minmax_bins(minmax_bins(data, 2), 2), brute_force(data, 4))
+
+
+@pytest.mark.parametrize('name, iteration', [('cpmg_sequence.txt', 0), ('nutation.txt', 3)])
+def test_levels_are_the_brute_force_decimation(monkeypatch, name, iteration):
+    '''
+    a small build block, so that level 0 is built from several spans
+    '''
+    monkeypatch.setattr(waveform_pyramid, 'BUILD_BLOCK', BASE_BIN*37)
+    program = PulseProgram(os.path.join(PULSE_FOLDER, name))
+    waveform = program.waveform(SAMP_RATE, iteration)
+    pyramid = MinMaxPyramid(program, SAMP_RATE, iteration)
+    assert pyramid.length == len(waveform)
+    assert pyramid.levels[-1].shape[1] <= LEVEL_FACTOR < pyramid.levels[-2].shape[1]
+    for level, bins in enumerate(pyramid.levels):
+        np.testing.assert_allclose(bins, brute_force(waveform, pyramid.bin_size(level)),
+                                   rtol = 0, atol = 2*OSCILLATOR_TOLERANCE)
+    assert pyramid.limits() == pytest.approx((min(waveform.min(), 0), max(waveform.max(), 0)),
+                                             abs = 2*OSCILLATOR_TOLERANCE)
+
+
+def test_views_bound_the_waveform_with_few_points():
+    program = PulseProgram(os.path.join(PULSE_FOLDER, 'cpmg_sequence.txt'))
+    waveform = program.waveform(SAMP_RATE, 0)
+    pyramid = MinMaxPyramid(program, SAMP_RATE)
+    duration = pyramid.duration()
+    for t_start, t_stop, width in ((0, duration, 800), (duration/3, duration/2, 500),
+                                   (0.1*duration, 0.1*duration + 4000/SAMP_RATE, 300)):
+        time, values, level = pyramid.view(t_start, t_stop, width)
+        assert level >= 0
+        assert len(values) <= 2*LEVEL_FACTOR*width + 4
+        start, stop = int(np.floor(t_start*SAMP_RATE)), min(int(np.ceil(t_stop*SAMP_RATE)) + 1, len(waveform))
+        assert values.min() <= waveform[start:stop].min() + 2*OSCILLATOR_TOLERANCE
+        assert values.max() >= waveform[start:stop].max() - 2*OSCILLATOR_TOLERANCE
+        assert time[0] <= t_start + pyramid.bin_size(level)/SAMP_RATE
+        assert time[-1] >= t_stop - pyramid.bin_size(level)/SAMP_RATE
+
+
+def test_narrow_views_are_the_samples():
+    program = PulseProgram(os.path.join(PULSE_FOLDER, 'cpmg_sequence.txt'))
+    waveform = program.waveform(SAMP_RATE, 0)
+    pyramid = MinMaxPyramid(program, SAMP_RATE)
+    width = 400
+    '''
+    the view takes the samples from t_start to t_stop, both included
+    '''
+    stop = 100 + FULL_POINTS_PER_PIXEL*width
+    time, values, level = pyramid.view(100/SAMP_RATE, (stop - 1)/SAMP_RATE, width)
+    assert level == -1
+    np.testing.assert_allclose(time, np.arange(100, stop)/SAMP_RATE)
+    np.testing.assert_allclose(values, waveform[100:stop], rtol = 0, atol = 2*OSCILLATOR_TOLERANCE)
+    assert pyramid.view(100/SAMP_RATE, stop/SAMP_RATE, width)[2] >= 0
+    assert len(pyramid.view(2*pyramid.duration(), 3*pyramid.duration(), width)[0]) == 0
+
+
+def test_level_zero_comes_from_the_cache(monkeypatch, tmp_path):
+    program = PulseProgram(os.path.join(PULSE_FOLDER, 'nutation.txt'))
+    cache = WaveformCache(cache_folder = str(tmp_path))
+    first = MinMaxPyramid(program, SAMP_RATE, 2, cache)
+    monkeypatch.setattr(MinMaxPyramid, 'build_base', lambda self: pytest.fail('level 0 was built again'))
+    for cached in (MinMaxPyramid(program, SAMP_RATE, 2, cache),
+                   MinMaxPyramid(program, SAMP_RATE, 2, WaveformCache(cache_folder = str(tmp_path)))):
+        for bins, expected in zip(cached.levels, first.levels):
+            np.testing.assert_array_equal(bins, expected)
@@ -0,0 +1,141 @@
+'''
+the policies of the background writer and its handling of a failing dataset
+'''
+import threading
+
+import numpy as np
+import pytest
+
+from writer import DatasetWriter
+
+TIMEOUT = 5
+
+
+class SlowDataset:
+    '''
+    records the writes, every write waits for release, write number fail
+    raises
+    '''
+    def __init__(self, fail = None):
+        self.writes = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.fail = fail
+        self.closed = False
+
+    def write(self, iteration, data, averages):
+        self.started.set()
+        assert self.release.wait(TIMEOUT)
+        if len(self.writes) == self.fail:
+            raise OSError('disk full')
+        self.writes.append((iteration, float(data[0]), averages))
+
+    def close(self):
+        self.closed = True
+
+
+def snapshot(value):
+    return np.full(4, float(value))
+
+
+def in_thread(function, *args):
+    '''
+    run function in a thread, returns the thread and a list which gets the
+    exception it raised
+    '''
+    errors = []
+    def target():
+        try:
+            function(*args)
+        except Exception as error:
+            errors.append(error)
+    thread = threading.Thread(target = target, daemon = True)
+    thread.start()
+    return thread, errors
+
+
+def busy_writer(policy, fail = None):
+    '''
+    a writer with a queue of one whose dataset is busy with snapshot 0
+    '''
+    dataset = SlowDataset(fail)
+    writer = DatasetWriter(dataset, 1, policy)
+    writer.submit(0, snapshot(0), 1)
+    assert dataset.started.wait(TIMEOUT)
+    return dataset, writer
+
+
+def test_block_waits_for_room():
+    dataset, writer = busy_writer('block')
+    writer.submit(0, snapshot(1), 2)
+    thread, errors = in_thread(writer.submit, 0, snapshot(2), 3)
+    thread.join(0.2)
+    assert thread.is_alive()
+    dataset.release.set()
+    thread.join(TIMEOUT)
+    writer.close()
+    assert not errors and dataset.closed
+    assert dataset.writes == [(0, 0.0, 1), (0, 1.0, 2), (0, 2.0, 3)]
+
+
+def test_drop_never_drops_the_final_snapshot():
+    dataset, writer = busy_writer('drop')
+    writer.submit(0, snapshot(1), 2)
+    writer.submit(0, snapshot(2), 3)
+    thread, errors = in_thread(writer.submit, 0, snapshot(3), 4, True)
+    thread.join(0.2)
+    assert thread.is_alive()
+    dataset.release.set()
+    thread.join(TIMEOUT)
+    writer.close()
+    assert not errors
+    assert dataset.writes == [(0, 0.0, 1), (0, 1.0, 2), (0, 3.0, 4)]
+    assert writer.stats()['dropped'] == 1
+
+
+def test_coalesce_replaces_the_pending_snapshot_of_the_iteration():
+    dataset, writer = busy_writer('coalesce')
+    writer.submit(0, snapshot(1), 2)
+    writer.submit(0, snapshot(2), 3)
+    writer.submit(0, snapshot(3), 4, True)
+    thread, errors = in_thread(writer.submit, 1, snapshot(4), 1)
+    thread.join(0.2)
+    assert thread.is_alive()
+    dataset.release.set()
+    thread.join(TIMEOUT)
+    writer.close()
+    assert not errors
+    assert dataset.writes == [(0, 0.0, 1), (0, 3.0, 4), (1, 4.0, 1)]
+    assert writer.stats()['coalesced'] == 2
+
+
+def test_submitted_data_is_copied():
+    dataset = SlowDataset()
+    dataset.release.set()
+    writer = DatasetWriter(dataset, 4, 'block')
+    data = snapshot(1)
+    for value in range(1, 4):
+        data[:] = value
+        writer.submit(0, data, value)
+    writer.close()
+    assert dataset.writes == [(0, 1.0, 1), (0, 2.0, 2), (0, 3.0, 3)]
+    assert len(writer.free) <= writer.max_pending + 1
+
+
+@pytest.mark.parametrize('policy', ['block', 'drop', 'coalesce'])
+def test_errors_are_raised_instead_of_hanging(policy):
+    dataset, writer = busy_writer(policy, fail = 0)
+    writer.submit(0, snapshot(1), 2)
+    blocked, blocked_errors = in_thread(writer.submit, 1, snapshot(2), 1, True)
+    flushing, flush_errors = in_thread(writer.flush)
+    dataset.release.set()
+    for thread in (blocked, flushing):
+        thread.join(TIMEOUT)
+        assert not thread.is_alive()
+    assert isinstance(flush_errors[0], OSError)
+    assert isinstance(blocked_errors[0], OSError)
+    with pytest.raises(OSError, match = 'disk full'):
+        writer.submit(1, snapshot(3), 2)
+    with pytest.raises(OSError, match = 'disk full'):
+        writer.close()
+    assert dataset.closed and not writer.writing and not writer.pending
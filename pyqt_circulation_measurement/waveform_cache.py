@@ -0,0 +1,165 @@
+'''
+content addressed cache of generated pulse waveforms
+the key is a hash of the pulse file contents, the sampling rate and the
+iteration index, the memory tier is a LRU with a byte budget, the optional
+disk tier keeps the waveforms as .npy files which are memory mapped on a hit
+the disk tier has a byte budget as well, a hit touches the file and the least
+recently used files go first, files of another CACHE_VERSION are removed when
+the cache is opened (a pulse file which is edited gets a new key, its old
+entries are never hit again and age out)
+'''
+import hashlib
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from nmr_pulses import WaveformBatch
+
+# bump when the waveform synthesis changes so that old disk entries are not used
+CACHE_VERSION = 4
+# the files of the disk tier, v<version>_<key>[_<suffix>].npy[.tmp]
+DISK_ENTRY = re.compile(r'^(?:v(\d+)_)?[0-9a-f]{40}(?:_\w+)?\.npy(?:\.tmp)?$')
+
+
+def waveform_key(file_path, samp_freq, iteration, table_files = ()):
+    '''
+    iteration is either one iteration index or a sequence of them (batch)
+    table_files are the shape tables used by the pulse file
+    '''
+    key_hash = hashlib.sha1()
+    for name in [file_path, *table_files]:
+        with open(name, 'rb') as f:
+            key_hash.update(f.read())
+    iteration = np.atleast_1d(np.asarray(iteration, dtype = int)).tolist()
+    key_hash.update(repr((CACHE_VERSION, float(samp_freq), iteration)).encode())
+    return key_hash.hexdigest()
+
+
+class WaveformCache:
+    '''
+    max_bytes: memory budget of the LRU tier
+    cache_folder: folder of the disk tier, None to keep everything in memory
+    max_disk_bytes: budget of the disk tier
+    '''
+    def __init__(self, max_bytes = 256*2**20, cache_folder = None, max_disk_bytes = 2*2**30):
+        self.max_bytes = max_bytes
+        self.cache_folder = cache_folder
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok = True)
+            self.prune_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_folder, f'v{CACHE_VERSION}_{key}.npy')
+
+    def prune_disk(self):
+        '''
+        remove the disk entries of other cache versions, then the least
+        recently used ones until the rest fits into max_disk_bytes, files which
+        cannot be removed (still mapped on windows) are left for the next time
+        only the files named like entries are touched
+        '''
+        entries = []
+        for name in os.listdir(self.cache_folder):
+            match = DISK_ENTRY.match(name)
+            if match is None:
+                continue
+            path = os.path.join(self.cache_folder, name)
+            try:
+                if match.group(1) != str(CACHE_VERSION):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        self.disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_bytes -= size
+            self.disk_evictions += 1
+
+    def _remember(self, key, data):
+        self.entries[key] = data
+        self.nbytes += data.nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 0:
+            _, old = self.entries.popitem(last = False)
+            self.nbytes -= old.nbytes
+
+    def get(self, key):
+        '''
+        return the cached array or None, the arrays are shared so they must not
+        be modified, disk entries are mapped copy-on-write because the nidaqmx
+        writers only accept writeable arrays
+        '''
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.cache_folder is not None and os.path.exists(self._disk_path(key)):
+            data = np.load(self._disk_path(key), mmap_mode = 'c')
+            try:
+                os.utime(self._disk_path(key))
+            except OSError:
+                pass
+            self._remember(key, data)
+            self.hits += 1
+            return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        data = np.asarray(data)
+        self._remember(key, data)
+        if self.cache_folder is not None and not os.path.exists(self._disk_path(key)):
+            '''
+            write to a temporary file first so that a crash never leaves a
+            truncated entry behind
+            '''
+            temp_path = self._disk_path(key) + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.save(f, data)
+            os.replace(temp_path, self._disk_path(key))
+            self.prune_disk()
+        return data
+
+    def get_or_create(self, key, factory):
+        data = self.get(key)
+        if data is None:
+            data = self.put(key, factory())
+        return data
+
+    def waveform(self, program, samp_freq, iteration):
+        '''
+        cached PulseProgram.waveform
+        '''
+        key = waveform_key(program.file_path, samp_freq, iteration, program.table_files)
+        return self.get_or_create(key, lambda: program.waveform(samp_freq, iteration))
+
+    def waveforms(self, program, samp_freq, iterations):
+        '''
+        cached PulseProgram.waveforms, the lengths are cheap and recomputed
+        '''
+        iterations = np.atleast_1d(np.asarray(iterations, dtype = int))
+        key = waveform_key(program.file_path, samp_freq, iterations, program.table_files)
+        data = self.get_or_create(key, lambda: program.waveforms(samp_freq, iterations).data)
+        lengths = program.segment_table(samp_freq, iterations).sum(axis = 1)
+        return WaveformBatch(data, lengths, iterations)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
@@ -0,0 +1,108 @@
+'''
+level of detail of a pulse waveform for the pulse visualizer
+the waveform is synthesized once, block by block, into the minimum and maximum
+of every BASE_BIN points (level 0), every further level merges LEVEL_FACTOR
+bins of the level below, up to a few bins for the whole sequence
+a view of the span t_start to t_stop on an axis of width pixels takes the
+bins of the coarsest level which still has a bin per pixel, and only a span
+of at most FULL_POINTS_PER_PIXEL points per pixel is synthesized at the full
+sampling rate (see PulseProgram.span), so the points handed to matplotlib
+stay below 2*LEVEL_FACTOR per pixel whatever the length of the sequence
+level 0 is kept in the waveform cache next to the waveforms
+'''
+import numpy as np
+
+from waveform_cache import waveform_key
+
+# points per bin of level 0
+BASE_BIN = 16
+# bins of a level merged into one bin of the next
+LEVEL_FACTOR = 4
+# points synthesized at once while building level 0
+BUILD_BLOCK = BASE_BIN*2**16
+# spans with fewer points per pixel are drawn from the samples themselves
+FULL_POINTS_PER_PIXEL = 2
+
+
+def minmax_bins(data, size):
+    '''
+    (2, bins) minimum and maximum of every size points of data, a partial
+    last bin is padded with its last point
+    '''
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = np.stack((data, data))
+    bins = -(-data.shape[1] // size)
+    if bins*size != data.shape[1]:
+        data = np.pad(data, ((0, 0), (0, bins*size - data.shape[1])), mode = 'edge')
+    data = data.reshape(2, bins, size)
+    return np.stack((data[0].min(axis = 1), data[1].max(axis = 1)))
+
+
+class MinMaxPyramid:
+    '''
+    the pyramid of the waveform of program at samp_rate for one iteration,
+    levels[k] is (2, bins) with bins of BASE_BIN*LEVEL_FACTOR**k points
+    cache is a WaveformCache for level 0
+    '''
+    def __init__(self, program, samp_rate, iteration = 0, cache = None):
+        self.program = program
+        self.samp_rate = samp_rate
+        self.iteration = iteration
+        self.length = program.nop(samp_rate, iteration)
+        if cache is None:
+            base = self.build_base()
+        else:
+            key = waveform_key(program.file_path, samp_rate, iteration, program.table_files)
+            base = cache.get_or_create(f'{key}_minmax{BASE_BIN}', self.build_base)
+        self.levels = [base]
+        while self.levels[-1].shape[1] > LEVEL_FACTOR:
+            self.levels.append(minmax_bins(self.levels[-1], LEVEL_FACTOR))
+
+    def build_base(self):
+        base = np.empty((2, -(-self.length // BASE_BIN)))
+        for start in range(0, self.length, BUILD_BLOCK):
+            block = self.program.span(self.samp_rate, self.iteration, start, start + BUILD_BLOCK)
+            base[:, start//BASE_BIN:(start + len(block) + BASE_BIN - 1)//BASE_BIN] = minmax_bins(block, BASE_BIN)
+        return base
+
+    def duration(self):
+        return self.length/self.samp_rate
+
+    def limits(self):
+        '''
+        (minimum, maximum) of the whole waveform
+        '''
+        top = self.levels[-1]
+        return float(top[0].min(initial = 0)), float(top[1].max(initial = 0))
+
+    def bin_size(self, level):
+        return BASE_BIN*LEVEL_FACTOR**level
+
+    def level_of(self, points, width):
+        '''
+        the coarsest level with at least width bins in points
+        '''
+        level = int(np.floor(np.log(max(points/(BASE_BIN*width), 1))/np.log(LEVEL_FACTOR)))
+        return min(level, len(self.levels) - 1)
+
+    def view(self, t_start, t_stop, width):
+        '''
+        (time, value, level) to draw t_start to t_stop on width pixels, level
+        is -1 for the samples themselves, the bins of a level are drawn as
+        their minimum and maximum at the center of the bin
+        '''
+        width = max(int(width), 1)
+        start = max(int(np.floor(t_start*self.samp_rate)), 0)
+        stop = min(int(np.ceil(t_stop*self.samp_rate)) + 1, self.length)
+        if stop <= start:
+            return np.empty(0), np.empty(0), -1
+        if stop - start <= FULL_POINTS_PER_PIXEL*width:
+            values = self.program.span(self.samp_rate, self.iteration, start, stop)
+            return np.arange(start, stop)/self.samp_rate, values, -1
+        level = self.level_of(stop - start, width)
+        size = self.bin_size(level)
+        first, last = start//size, -(-stop // size)
+        bins = self.levels[level][:, first:last]
+        centers = (np.arange(first, last)*size + size/2)/self.samp_rate
+        return np.repeat(centers, 2), bins.T.ravel(), level
@@ -0,0 +1,160 @@
+'''
+background writer of a ShotDataset
+the acquisition hands the snapshots over through a bounded queue, so neither
+the acquisition nor the gui ever waits for a slow disk (unless asked to)
+'''
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+POLICIES = ('block', 'drop', 'coalesce')
+
+
+class DatasetWriter(threading.Thread):
+    '''
+    writes (iteration, data, averages) snapshots into dataset in order
+    max_pending is the bound of the queue, policy decides what happens to a
+    new snapshot when the queue is full:
+        'block'     wait until the writer made room
+        'drop'      drop the new snapshot
+        'coalesce'  replace the newest pending snapshot of the same iteration,
+                    its average is contained in the new one, otherwise block
+    the final snapshot of an iteration is never dropped
+    the snapshots are copied into buffers of the writer which are reused once
+    written, at most max_pending + 1 of them are allocated
+    reduction: optional ReductionStage (see reducers.py), it gets the final
+    snapshot of every iteration once it is written
+    an exception of the dataset or the reduction stops the writer, the pending
+    snapshots are dropped and the exception is raised again by the next
+    submit(), flush() or close(), so the acquisition never waits for it
+    '''
+    def __init__(self, dataset, max_pending = 8, policy = 'coalesce', reduction = None):
+        super(DatasetWriter, self).__init__(daemon = True)
+        if policy not in POLICIES:
+            raise ValueError(f'unknown writer policy {policy}, use one of {POLICIES}')
+        self.dataset = dataset
+        self.max_pending = max_pending
+        self.policy = policy
+        self.reduction = reduction
+        self.pending = deque()
+        self.free = []
+        self.condition = threading.Condition()
+        self.writing = False
+        self.closing = False
+        self.error = None
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.start()
+
+    def submit(self, iteration, data, averages, final = False):
+        '''
+        data is copied, the caller may reuse it right away
+        '''
+        with self.condition:
+            self.check()
+            self.submitted += 1
+            if len(self.pending) >= self.max_pending:
+                if self.policy == 'coalesce':
+                    for entry in reversed(self.pending):
+                        if entry[0] == iteration:
+                            np.copyto(entry[1], data)
+                            entry[2:] = [averages, final]
+                            self.coalesced += 1
+                            return
+                elif self.policy == 'drop' and not final:
+                    self.dropped += 1
+                    return
+                while len(self.pending) >= self.max_pending:
+                    self.condition.wait()
+                    self.check()
+            buffer = self.free.pop() if self.free else np.empty_like(data)
+            np.copyto(buffer, data)
+            self.pending.append([iteration, buffer, averages, final])
+            self.max_depth = max(self.max_depth, len(self.pending))
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                iteration, data, averages, final = self.pending.popleft()
+                self.writing = True
+                self.condition.notify_all()
+            start_time = time.perf_counter()
+            try:
+                self.dataset.write(iteration, data, averages)
+                latency = time.perf_counter() - start_time
+                if final and self.reduction is not None:
+                    self.reduction.add(iteration, self.dataset.volts(data, averages), averages)
+            except Exception as error:
+                with self.condition:
+                    self.error = error
+                    self.writing = False
+                    self.pending.clear()
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.free.append(data)
+                self.writing = False
+                self.written += 1
+                self.last_latency = latency
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                self.condition.notify_all()
+
+    def check(self):
+        '''
+        raise the exception which stopped the writer, if any
+        '''
+        if self.error is not None:
+            raise self.error
+
+    def depth(self):
+        return len(self.pending)
+
+    def flush(self):
+        '''
+        wait until everything submitted so far is on disk
+        '''
+        with self.condition:
+            while (self.pending or self.writing) and self.error is None:
+                self.condition.wait()
+            self.check()
+
+    def close(self):
+        '''
+        flush, stop the thread and close the dataset
+        '''
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.join()
+        try:
+            self.dataset.close()
+            if self.reduction is not None:
+                self.reduction.close()
+        finally:
+            self.check()
+
+    def stats(self):
+        return {'depth': self.depth(),
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'last_latency': self.last_latency,
+                'mean_latency': self.total_latency/max(self.written, 1),
+                'max_latency': self.max_latency}